@@ -3,6 +3,7 @@ from fastapi.responses import HTMLResponse, JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 import auth
+import presence
 from models import get_db, Courier, DeliveryPartner
 
 router = APIRouter()
@@ -133,6 +134,7 @@ async def api_delete_account(
         # Якщо пароль вірний - видаляємо кур'єра
         await db.delete(courier)
         await db.commit()
+        presence.registry.set_on_shift(courier.id, False)
         return JSONResponse({"status": "ok", "message": "Акаунт кур'єра видалено"})
         
     elif acc_type == "partner":
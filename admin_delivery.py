@@ -1,25 +1,42 @@
 import json
 import os
 import logging
-import httpx
 import pytz
 import asyncio
 import shutil
 import html
-from datetime import datetime, time
-from urllib.parse import quote
-from fastapi import APIRouter, Depends, Form, HTTPException, Request, status, UploadFile, File
+import hashlib
+import itertools
+from datetime import datetime, time, timedelta
+from typing import Dict, List, Set
+from fastapi import APIRouter, Depends, Form, HTTPException, Request, status, UploadFile, File, WebSocket, WebSocketDisconnect
 from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, FileResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete, update, func
-from sqlalchemy.orm import joinedload
+from sqlalchemy import select, delete, update, func, event, inspect
+from sqlalchemy.orm import joinedload, Session
 
 # Імпортуємо bot_service для відправки повідомлень при верифікації
 import bot_service
 
+# WebSocket менеджер (черги з'єднань, розсилка)
+from ws_manager import manager, ClientConnection, InMemoryBroker
+
+# Реєстр присутності кур'єрів
+import presence
+
+# Пакетний запис координат кур'єрів
+import location_ingest
+import geocode_cache
+import geocoding
+import dispatch_optimizer
+import eta_model
+import order_waves
+import push_service
+from notification_outbox import outbox
+
 # Імпортуємо auth замість app, щоб уникнути циклічного імпорту
-from models import get_db, Courier, DeliveryPartner, DeliveryJob, CourierTransaction, CashRegisterTransaction, ChatMessage, Announcement, CourierMotivator, CourierMotivatorProgress
-from auth import check_admin_auth 
+from models import get_db, async_session_maker, Courier, DeliveryPartner, DeliveryJob, CourierTransaction, CashRegisterTransaction, ChatMessage, Announcement, CourierMotivator, CourierMotivatorProgress
+from auth import check_admin_auth, jwt, JWTError, SECRET_KEY, ALGORITHM
 from crud_settings import get_setting, set_setting # Імпорт для отримання часового поясу та збереження налаштувань
 
 # Імпортуємо GLOBAL_STYLES
@@ -98,32 +115,13 @@ def format_local_time(utc_dt, tz_string='Europe/Kiev', fmt='%d.%m.%Y %H:%M'):
         return utc_dt.strftime(fmt)
 
 # --- ГЕОКОДИНГ ДЛЯ КАРТИ (КЕШОВАНИЙ) ---
-GEOCODE_CACHE = {}
-
 async def get_coords(address: str):
-    """Шукає координати для адреси закладу, якщо їх немає в БД."""
-    if not address: return None, None
-    if address in GEOCODE_CACHE: return GEOCODE_CACHE[address]
-    
-    url = f"https://nominatim.openstreetmap.org/search?q={quote(address)}&format=json&limit=1"
-    headers = {"User-Agent": "RestifyAdminMap/1.0"}
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.get(url, headers=headers, timeout=3.0)
-            data = resp.json()
-            if data and len(data) > 0:
-                res = (float(data[0]["lat"]), float(data[0]["lon"]))
-                GEOCODE_CACHE[address] = res
-                return res
-        except Exception as e:
-            logging.error(f"Map Geocoding Error for {address}: {e}")
-            
-    return None, None
+    """Шукає координати для адреси закладу (через спільний сервіс геокодування з кешем)."""
+    return await geocoding.geocoder.geocode(address)
 
 
 # --- HTML ШАБЛОН: Карта Операцій ---
-def get_ops_map_html(message=""):
+def get_ops_map_html(message="", ws_token=""):
     """HTML для сторінки Real-time Ops Map."""
     
     return f"""
@@ -234,21 +232,78 @@ def get_ops_map_html(message=""):
                 return `більше 1 доби тому`;
             }}
 
+            // Поточний стан карти: знімок + зміни з /ws/admin/map
+            const state = {{ couriers: {{}}, jobs: {{}} }};
+            let fitDone = false;
+
+            function applySnapshot(data) {{
+                state.couriers = {{}};
+                state.jobs = {{}};
+                data.couriers.forEach(c => state.couriers[c.id] = c);
+                data.jobs.forEach(j => state.jobs[j.id] = j);
+                render();
+            }}
+
+            function applyDiff(diff) {{
+                diff.couriers.forEach(c => {{
+                    // Переміщення приходить без імені -- для невідомого кур'єра чекаємо повного запису
+                    if (state.couriers[c.id]) Object.assign(state.couriers[c.id], c);
+                    else if (c.name) state.couriers[c.id] = c;
+                }});
+                diff.jobs.forEach(j => state.jobs[j.id] = j);
+                diff.removed_couriers.forEach(id => delete state.couriers[id]);
+                diff.removed_jobs.forEach(id => delete state.jobs[id]);
+                render();
+            }}
+
+            function render() {{
+                const couriers = Object.values(state.couriers);
+                const jobs = Object.values(state.jobs);
+                // Хто зайнятий -- рахуємо з активних замовлень
+                const busy = {{}};
+                jobs.forEach(j => {{ if (j.courier.id) busy[j.courier.id] = j.id; }});
+                couriers.forEach(c => c.job_id = busy[c.id] || null);
+
+                document.getElementById('courier-count').innerText = `Кур'єрів онлайн: ${{couriers.length}}`;
+                document.getElementById('job-count').innerText = `Активних замовлень: ${{jobs.length}}`;
+                updateMapMarkers(couriers, jobs);
+            }}
+
             async function fetchMapData() {{
                 try {{
                     const res = await fetch('/api/admin/delivery/map_data');
-                    const data = await res.json();
-                    
-                    document.getElementById('courier-count').innerText = `Кур'єрів онлайн: ${{data.couriers.length}}`;
-                    document.getElementById('job-count').innerText = `Активних замовлень: ${{data.jobs.length}}`;
-
-                    updateMapMarkers(data.couriers, data.jobs);
-                    
+                    applySnapshot(await res.json());
                 }} catch (e) {{
                     console.error("Error fetching map data:", e);
                 }}
             }}
 
+            // --- WebSocket: один знімок при підключенні, далі лише зміни ---
+            let opsSocket = null, opsPing = null, pollFallback = null;
+            function connectOpsWS() {{
+                const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+                opsSocket = new WebSocket(`${{protocol}}//${{window.location.host}}/ws/admin/map?token={ws_token}`);
+                opsSocket.onopen = () => {{
+                    clearInterval(pollFallback); pollFallback = null;
+                    clearInterval(opsPing);
+                    opsPing = setInterval(() => {{ if (opsSocket.readyState === WebSocket.OPEN) opsSocket.send("ping"); }}, 30000);
+                }};
+                opsSocket.onmessage = (e) => {{
+                    if (e.data === "pong") return;
+                    const msg = JSON.parse(e.data);
+                    if (msg.type === 'ops_snapshot') applySnapshot(msg);
+                    else if (msg.type === 'ops_diff') applyDiff(msg);
+                }};
+                opsSocket.onclose = (e) => {{
+                    clearInterval(opsPing);
+                    // Токен протух -- перезавантажуємо сторінку (отримаємо новий)
+                    if (e.code === 1008) {{ location.reload(); return; }}
+                    // Поки немає з'єднання -- старе опитування
+                    if (!pollFallback) pollFallback = setInterval(fetchMapData, 10000);
+                    setTimeout(connectOpsWS, 3000);
+                }};
+            }}
+
             function updateMapMarkers(couriers, jobs) {{
                 courierLayer.clearLayers();
                 jobLayer.clearLayers();
@@ -353,16 +408,17 @@ def get_ops_map_html(message=""):
                     }}
                 }});
 
-                // 3. Auto-fit map
+                // 3. Auto-fit map (лише при першому рендері, щоб зміни не збивали масштаб)
+                if (fitDone) return;
                 if (bounds.isValid()) {{
                     map.fitBounds(bounds, {{ padding: [50, 50] }});
+                    fitDone = true;
                 }} else {{
                      map.setView([50.45, 30.52], 12);
                 }}
             }}
 
-            fetchMapData();
-            setInterval(fetchMapData, 10000); // Оновлення кожні 10 секунд
+            connectOpsWS();
         </script>
     </body></html>
     """
@@ -1309,7 +1365,7 @@ async def admin_delivery_page(
 async def admin_delivery_map_page(
     user: str = Depends(check_admin_auth)
 ):
-    return get_ops_map_html() 
+    return get_ops_map_html(ws_token=ops_map_token(user)) 
 
 @router.get("/admin/delivery/job/{job_id}/chat", response_class=HTMLResponse)
 async def admin_view_chat(
@@ -1322,76 +1378,323 @@ async def admin_view_chat(
     tz_string = await get_setting(db, "timezone") or "Europe/Kiev"
     return get_admin_chat_html(job_id, messages, tz_string)
 
-# --- НОВИЙ АПІ ЕНДПОІНТ ДЛЯ ОТРИМАННЯ ДАНИХ ДЛЯ КАРТИ ---
-@router.get("/api/admin/delivery/map_data")
-async def get_map_data(user: str = Depends(check_admin_auth), db: AsyncSession = Depends(get_db)):
-    
-    # 1. Отримуємо онлайн кур'єрів
-    couriers = (await db.execute(select(Courier).where(Courier.is_online == True))).scalars().all()
-    courier_list = []
-    
-    for c in couriers:
-        # Перевіряємо чи є у кур'єра активне замовлення
-        active_job = (await db.execute(
-            select(DeliveryJob.id)
-            .where(DeliveryJob.courier_id == c.id)
-            .where(DeliveryJob.status.notin_(["delivered", "cancelled"]))
-        )).scalar()
-        
-        # Добавляємо "Z", щоб Javascript розумів, що це UTC час
-        courier_list.append({
-            "id": c.id, 
-            "name": c.name, 
-            "phone": c.phone,
-            "lat": c.lat, 
-            "lon": c.lon,
-            "avg_rating": getattr(c, 'avg_rating', 5.0),
-            "last_seen": c.last_seen.isoformat() + "Z" if c.last_seen else None,
-            "job_id": active_job
-        })
+# --- ДАНІ ДЛЯ КАРТИ ОПЕРАЦІЙ (спільні для map_data та /ws/admin/map) ---
+def courier_map_entry(c: Courier, job_id=None) -> dict:
+    p = presence.registry.get(c.id)
+    last_seen = p.position_at if p and p.position_at else c.last_seen
+    # Добавляємо "Z", щоб Javascript розумів, що це UTC час
+    return {
+        "id": c.id, 
+        "name": c.name, 
+        "phone": c.phone,
+        "lat": p.lat if p else c.lat, 
+        "lon": p.lon if p else c.lon,
+        "avg_rating": getattr(c, 'avg_rating', 5.0),
+        "last_seen": last_seen.isoformat() + "Z" if last_seen else None,
+        "connected": presence.registry.is_connected(c.id),
+        "job_id": job_id
+    }
+
+def job_map_entry(j: DeliveryJob) -> dict:
+    p_lat, p_lon = None, None
+    if j.partner:
+        # Координати закладу зберігаються в delivery_partners
+        p_lat, p_lon = j.partner.lat, j.partner.lon
         
-    # 2. Отримуємо активні замовлення та їхні координати
-    jobs_query = await db.execute(
+    return {
+        "id": j.id,
+        "status": j.status,
+        "created_at": j.created_at.isoformat() + "Z" if j.created_at else None,
+        "order_price": j.order_price,
+        "delivery_fee": j.delivery_fee,
+        "partner": {
+            "id": j.partner.id if j.partner else None,
+            "name": j.partner.name if j.partner else "Невідомо",
+            "address": j.partner.address if j.partner else "",
+            "lat": p_lat,
+            "lon": p_lon
+        },
+        "dropoff": {
+            "address": j.dropoff_address,
+            "lat": j.dropoff_lat,
+            "lon": j.dropoff_lon,
+            "customer_phone": j.customer_phone
+        },
+        "courier": {
+            "id": j.courier.id if j.courier else None,
+            "name": j.courier.name if j.courier else None
+        }
+    }
+
+async def build_map_snapshot(db: AsyncSession) -> dict:
+    """Повний стан карти: кур'єри на зміні + активні замовлення (два запити, без N+1)."""
+    # 1. Активні замовлення -- з них же беремо, хто з кур'єрів зайнятий
+    jobs = (await db.execute(
         select(DeliveryJob)
         .options(joinedload(DeliveryJob.partner))
         .options(joinedload(DeliveryJob.courier))
         .where(DeliveryJob.status.notin_(["delivered", "cancelled"]))
-    )
-    jobs = jobs_query.scalars().all()
-    
-    jobs_list = []
-    for j in jobs:
-        p_lat, p_lon = None, None
-        if j.partner:
-            # Кешований геокодинг адреси закладу
-            p_lat, p_lon = await get_coords(j.partner.address)
-            
-        jobs_list.append({
-            "id": j.id,
-            "status": j.status,
-            "created_at": j.created_at.isoformat() + "Z" if j.created_at else None,
-            "order_price": j.order_price,
-            "delivery_fee": j.delivery_fee,
-            "partner": {
-                "id": j.partner.id if j.partner else None,
-                "name": j.partner.name if j.partner else "Невідомо",
-                "address": j.partner.address if j.partner else "",
-                "lat": p_lat,
-                "lon": p_lon
-            },
-            "dropoff": {
-                "address": j.dropoff_address,
-                "lat": j.dropoff_lat,
-                "lon": j.dropoff_lon,
-                "customer_phone": j.customer_phone
-            },
-            "courier": {
-                "id": j.courier.id if j.courier else None,
-                "name": j.courier.name if j.courier else None
-            }
-        })
-        
-    return JSONResponse({"couriers": courier_list, "jobs": jobs_list})
+    )).scalars().all()
+    job_by_courier = {j.courier_id: j.id for j in jobs if j.courier_id}
+
+    # 2. Онлайн кур'єри (з реєстру присутності)
+    online_ids = presence.registry.on_shift_ids()
+    couriers = (await db.execute(select(Courier).where(Courier.id.in_(online_ids)))).scalars().all() if online_ids else []
+
+    return {
+        "couriers": [courier_map_entry(c, job_by_courier.get(c.id)) for c in couriers],
+        "jobs": [job_map_entry(j) for j in jobs],
+    }
+
+# --- НОВИЙ АПІ ЕНДПОІНТ ДЛЯ ОТРИМАННЯ ДАНИХ ДЛЯ КАРТИ ---
+@router.get("/api/admin/delivery/map_data")
+async def get_map_data(user: str = Depends(check_admin_auth), db: AsyncSession = Depends(get_db)):
+    return JSONResponse(await build_map_snapshot(db))
+
+
+# --- REAL-TIME КАРТА ОПЕРАЦІЙ (/ws/admin/map): знімок + інкрементальні зміни ---
+# Зміни накопичуються і розсилаються пачкою не частіше, ніж раз на N секунд
+OPS_MAP_FLUSH_SECONDS = 2.0
+# Максимум сутностей в одному кадрі (щоб влізти в NOTIFY між воркерами)
+OPS_MAP_CHUNK = 40
+
+class OpsMapHub:
+    """
+    Розсилає адмінам знімок карти при підключенні, а далі лише зміни:
+    переміщення кур'єрів (без БД), зміни/створення замовлень та вихід кур'єрів на зміну
+    (одним запитом на пачку). Зміни з інших воркерів приходять через шину ConnectionManager.
+    """
+
+    def __init__(self):
+        self._viewers: Dict[ClientConnection, int] = {}
+        self._ids = itertools.count(1)
+        self._moved: Dict[int, tuple] = {}
+        self._couriers_changed: Set[int] = set()
+        self._jobs_changed: Set[int] = set()
+        self._manager = None
+        self._task = None
+
+    def start(self, ws_manager):
+        self._manager = ws_manager
+        ws_manager.subscribe("ops_map", self._on_remote_diff)
+        self._task = asyncio.create_task(self._run())
+
+    # --- Події (гарячий шлях -- лише запис у словник) ---
+    def courier_moved(self, courier_id: int, lat: float, lon: float, at: datetime = None):
+        self._moved[courier_id] = (lat, lon, at or datetime.utcnow())
+
+    def courier_changed(self, courier_id: int):
+        self._couriers_changed.add(courier_id)
+
+    def job_changed(self, job_id: int):
+        self._jobs_changed.add(job_id)
+
+    # --- Глядачі ---
+    async def add_viewer(self, websocket: WebSocket) -> ClientConnection:
+        # Спершу будуємо знімок, потім реєструємо глядача: зміни під час запиту вже є в знімку
+        async with async_session_maker() as db:
+            snapshot = await build_map_snapshot(db)
+        conn = ClientConnection(websocket, "admin", next(self._ids), self._on_viewer_broken)
+        self._viewers[conn] = 0
+        conn.enqueue(json.dumps({"type": "ops_snapshot", **snapshot}, ensure_ascii=False))
+        return conn
+
+    def remove_viewer(self, conn: ClientConnection):
+        if self._viewers.pop(conn, None) is not None:
+            conn.stop()
+
+    def _on_viewer_broken(self, conn: ClientConnection):
+        self._viewers.pop(conn, None)
+        asyncio.create_task(conn.close())
+
+    async def _resnapshot(self, conn: ClientConnection):
+        """Черга вкладки переповнилась і частину змін втрачено -- шлемо свіжий знімок."""
+        async with async_session_maker() as db:
+            snapshot = await build_map_snapshot(db)
+        conn.enqueue(json.dumps({"type": "ops_snapshot", **snapshot}, ensure_ascii=False))
+
+    def _send_local(self, frames: List[str]):
+        for conn, seen_dropped in list(self._viewers.items()):
+            for text in frames:
+                conn.enqueue(text)
+            if conn.dropped > seen_dropped:
+                self._viewers[conn] = conn.dropped
+                asyncio.create_task(self._resnapshot(conn))
+
+    async def _on_remote_diff(self, diff: dict):
+        self._send_local([json.dumps(diff, ensure_ascii=False)])
+
+    # --- Пачка змін ---
+    async def _run(self):
+        while True:
+            await asyncio.sleep(OPS_MAP_FLUSH_SECONDS)
+            try:
+                await self._flush()
+            except Exception as e:
+                logging.error(f"Ops map flush error: {e}")
+
+    def _has_audience(self) -> bool:
+        # В одному процесі без глядачів зміни нікому не потрібні; з кількома воркерами глядачі можуть бути деінде
+        return bool(self._viewers) or not isinstance(self._manager.broker, InMemoryBroker)
+
+    async def _flush(self):
+        if not (self._moved or self._couriers_changed or self._jobs_changed):
+            return
+        if not self._manager or not self._has_audience():
+            self._moved, self._couriers_changed, self._jobs_changed = {}, set(), set()
+            return
+        moved, self._moved = self._moved, {}
+        couriers_changed, self._couriers_changed = self._couriers_changed, set()
+        jobs_changed, self._jobs_changed = self._jobs_changed, set()
+
+        couriers, removed_couriers, jobs, removed_jobs = [], [], [], []
+        if couriers_changed or jobs_changed:
+            async with async_session_maker() as db:
+                if jobs_changed:
+                    rows = (await db.execute(
+                        select(DeliveryJob)
+                        .options(joinedload(DeliveryJob.partner))
+                        .options(joinedload(DeliveryJob.courier))
+                        .where(DeliveryJob.id.in_(jobs_changed))
+                    )).scalars().all()
+                    found = set()
+                    for j in rows:
+                        found.add(j.id)
+                        if j.status in ("delivered", "cancelled"):
+                            removed_jobs.append(j.id)
+                        else:
+                            jobs.append(job_map_entry(j))
+                    removed_jobs.extend(jobs_changed - found)
+
+                if couriers_changed:
+                    on_shift = {c_id for c_id in couriers_changed if presence.registry.is_on_shift(c_id)}
+                    removed_couriers.extend(couriers_changed - on_shift)
+                    if on_shift:
+                        busy = dict((await db.execute(
+                            select(DeliveryJob.courier_id, DeliveryJob.id)
+                            .where(DeliveryJob.courier_id.in_(on_shift))
+                            .where(DeliveryJob.status.notin_(["delivered", "cancelled"]))
+                        )).all())
+                        rows = (await db.execute(select(Courier).where(Courier.id.in_(on_shift)))).scalars().all()
+                        couriers.extend(courier_map_entry(c, busy.get(c.id)) for c in rows)
+
+        for courier_id, (lat, lon, at) in moved.items():
+            if courier_id in couriers_changed or not presence.registry.is_on_shift(courier_id):
+                continue
+            couriers.append({"id": courier_id, "lat": lat, "lon": lon, "last_seen": at.isoformat() + "Z"})
+
+        diffs = []
+        for i in range(0, max(len(couriers), len(jobs), 1), OPS_MAP_CHUNK):
+            diffs.append({
+                "type": "ops_diff",
+                "couriers": couriers[i:i + OPS_MAP_CHUNK],
+                "jobs": jobs[i:i + OPS_MAP_CHUNK],
+                "removed_couriers": removed_couriers if i == 0 else [],
+                "removed_jobs": removed_jobs if i == 0 else [],
+            })
+        self._send_local([json.dumps(d, ensure_ascii=False) for d in diffs])
+        for d in diffs:
+            await self._manager.publish_event("ops_map", d)
+
+    def stats(self) -> dict:
+        return {"viewers": [c.stats() for c in self._viewers]}
+
+
+ops_hub = OpsMapHub()
+
+@event.listens_for(Session, "after_flush")
+def _collect_ops_map_changes(session, flush_context):
+    """Ловить створення/зміну замовлень і вихід кур'єрів на зміну з будь-якого місця коду."""
+    for obj in session.new:
+        if isinstance(obj, DeliveryJob):
+            ops_hub.job_changed(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, DeliveryJob):
+            state = inspect(obj)
+            if state.attrs.status.history.has_changes() or state.attrs.courier_id.history.has_changes():
+                ops_hub.job_changed(obj.id)
+        elif isinstance(obj, Courier):
+            state = inspect(obj)
+            if state.attrs.is_online.history.has_changes() or state.attrs.name.history.has_changes():
+                ops_hub.courier_changed(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, DeliveryJob):
+            ops_hub.job_changed(obj.id)
+        elif isinstance(obj, Courier):
+            ops_hub.courier_changed(obj.id)
+
+@event.listens_for(Session, "after_commit")
+def _apply_ops_map_bulk_changes(session):
+    """Замовлення, змінені Core UPDATE в обхід ORM (order_claim), -- after_flush їх не бачить."""
+    for job_id in session.info.pop("ops_map_jobs", ()):
+        ops_hub.job_changed(job_id)
+
+@event.listens_for(Session, "after_rollback")
+def _drop_ops_map_bulk_changes(session):
+    session.info.pop("ops_map_jobs", None)
+
+# Окремий ключ підпису і scope: звичайний токен входу (sub -- довільний email) сюди не підійде
+OPS_MAP_TOKEN_KEY = hashlib.sha256(f"{SECRET_KEY}|ops_map".encode()).hexdigest()
+OPS_MAP_TOKEN_MINUTES = 10
+
+def ops_map_token(user: str) -> str:
+    """Короткоживучий токен для /ws/admin/map (Basic Auth браузер у WebSocket не передає).
+    Протух -- сторінка карти перезавантажується і отримує новий."""
+    expire = datetime.utcnow() + timedelta(minutes=OPS_MAP_TOKEN_MINUTES)
+    return jwt.encode({"sub": f"admin:{user}", "scope": "ops_map", "exp": expire}, OPS_MAP_TOKEN_KEY, algorithm=ALGORITHM)
+
+@router.websocket("/ws/admin/map")
+async def admin_map_websocket(websocket: WebSocket):
+    try:
+        payload = jwt.decode(websocket.query_params.get("token") or "", OPS_MAP_TOKEN_KEY, algorithms=[ALGORITHM])
+        authorized = payload.get("scope") == "ops_map"
+    except JWTError:
+        authorized = False
+    if not authorized:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    conn = await ops_hub.add_viewer(websocket)
+    try:
+        while True:
+            data_text = await asyncio.wait_for(websocket.receive_text(), timeout=120.0)
+            if data_text == "ping":
+                conn.enqueue("pong", "pong")
+    except (asyncio.TimeoutError, WebSocketDisconnect):
+        pass
+    except Exception as e:
+        logging.error(f"Admin map WS error: {e}")
+    finally:
+        ops_hub.remove_viewer(conn)
+
+
+# --- ПРИСУТНІСТЬ КУР'ЄРІВ (на зміні / підключені / тип клієнта / останній heartbeat) ---
+@router.get("/api/admin/delivery/presence")
+async def get_presence_stats(user: str = Depends(check_admin_auth)):
+    return JSONResponse({**presence.registry.stats(), "location_ingest": location_ingest.ingest.stats()})
+
+
+# --- ГЕОКОДУВАННЯ (влучання кешу, черга, запити до Nominatim) ---
+@router.get("/api/admin/delivery/geocode_cache")
+async def get_geocode_cache_stats(user: str = Depends(check_admin_auth)):
+    return JSONResponse({**geocode_cache.cache.stats(), "service": geocoding.geocoder.stats()})
+
+# --- ДИСПЕТЧЕРИЗАЦІЯ (раунди пакетного диспетчера, хвилі розсилки) ---
+@router.get("/api/admin/delivery/dispatch")
+async def get_dispatch_stats(user: str = Depends(check_admin_auth)):
+    return JSONResponse({**dispatch_optimizer.dispatcher.stats(), "waves": order_waves.broadcaster.stats()})
+
+# --- ПРОГНОЗ ETA (розмір таблиці, скільки доставок враховано, коли перераховано) ---
+@router.get("/api/admin/delivery/eta_model")
+async def get_eta_model_stats(user: str = Depends(check_admin_auth)):
+    return JSONResponse(eta_model.model.stats())
+
+# --- СТАТИСТИКА WEBSOCKET-ЧЕРГ (відправлено / злито / відкинуто), FCM-ПУШІВ, ЧЕРГИ СПОВІЩЕНЬ І TELEGRAM ---
+@router.get("/api/admin/delivery/ws_stats")
+async def get_ws_stats(user: str = Depends(check_admin_auth)):
+    return JSONResponse({**manager.stats(), "ops_map": ops_hub.stats(), "push": push_service.push.stats(), "outbox": outbox.stats(),
+                         "telegram": bot_service.scheduler.stats()})
 
 
 # ==============================================================================
@@ -1501,14 +1804,12 @@ async def create_announcement(
     
     # Відправляємо WS повідомлення всім онлайн кур'єрам
     try:
-        from app import manager
         ws_data = {"type": "new_announcement", "data": {"id": new_ann.id, "title": title, "message": message, "style": style}}
         
         if target:
             await manager.notify_courier(target, ws_data)
         else:
-            for cid in manager.active_couriers.keys():
-                await manager.notify_courier(cid, ws_data)
+            await manager.notify_all_couriers(ws_data)
     except Exception as e:
         logging.error(f"Failed to send WS for announcement: {e}")
             
@@ -1606,6 +1907,8 @@ async def partner_update_info(
 ):
     partner = await db.get(DeliveryPartner, id)
     if partner:
+        if partner.address != address or partner.lat is None:
+            partner.lat, partner.lon = await get_coords(address)
         partner.address = address
         partner.notes = notes
         await db.commit()
@@ -1720,6 +2023,7 @@ async def courier_control(
     if action == "ban":
         courier.is_active = False
         courier.is_online = False
+        presence.registry.set_on_shift(courier.id, False)
         msg = f"Кур'єр {courier.name} заблокований."
     elif action == "unban":
         courier.is_active = True
@@ -1727,7 +2031,7 @@ async def courier_control(
         
         if courier.telegram_chat_id and not courier.telegram_chat_id.startswith("BLOCKED_"):
             tg_text = f"✅ <b>Ваш профіль успішно верифіковано!</b>\n\nТепер ви можете увійти в додаток і почати отримувати замовлення."
-            asyncio.create_task(bot_service.send_telegram_message(courier.telegram_chat_id, tg_text))
+            asyncio.create_task(bot_service.send_telegram_message(courier.telegram_chat_id, tg_text, bot_service.PRIORITY_BULK))
             
     elif action == "delete":
         # 1. Відв'язуємо кур'єра від усіх замовлень (щоб не було помилки ForeignKey)
@@ -1748,6 +2052,7 @@ async def courier_control(
         )
         # 4. Видаляємо самого кур'єра
         await db.delete(courier)
+        presence.registry.set_on_shift(courier.id, False)
         msg = "Кур'єр видалений."
     
     await db.commit()
@@ -8,9 +8,8 @@ import json
 import uuid
 import pytz
 import shutil
-from math import radians, cos, sin, asin, sqrt
 from contextlib import asynccontextmanager
-from typing import List, Dict 
+from typing import List
 from fastapi import FastAPI, Request, Form, Depends, HTTPException, status, Header, WebSocket, WebSocketDisconnect, Response, UploadFile, File
 from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, FileResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials, OAuth2PasswordBearer, OAuth2PasswordRequestForm
@@ -29,6 +28,19 @@ import templates_courier
 import admin_delivery
 import bot_service
 import order_monitor
+import presence
+import location_stream
+import location_ingest
+import order_board
+import dispatch_optimizer
+import route_planner
+import eta_model
+import order_waves
+import order_claim
+import push_service
+from notification_outbox import outbox
+import geo_distance
+import geocoding
 import admin_reports
 import account_deletion
 import admin_rating_reports
@@ -46,7 +58,7 @@ from crud_settings import get_setting, set_setting, get_all_settings
 
 # --- FIREBASE IMPORTS ---
 import firebase_admin
-from firebase_admin import credentials, messaging
+from firebase_admin import credentials
 
 # --- 2. Конфігурація ---
 TG_BOT_TOKEN = os.environ.get("TG_BOT_TOKEN")
@@ -68,66 +80,9 @@ if not firebase_admin._apps:
     except Exception as e:
         logging.warning(f"Firebase Init Error: {e}")
 
-# --- WebSocket Manager ---
-class ConnectionManager:
-    def __init__(self):
-        self.active_couriers: Dict[int, WebSocket] = {}
-        self.active_partners: Dict[int, WebSocket] = {}
-
-    # --- Методи для КУР'ЄРІВ ---
-    async def connect_courier(self, websocket: WebSocket, courier_id: int):
-        await websocket.accept()
-        # ЗАКРИВАЄМО СТАРЕ З'ЄДНАННЯ, ЯКЩО ВОНО ІСНУЄ
-        if courier_id in self.active_couriers:
-            try:
-                await self.active_couriers[courier_id].close()
-                logging.info(f"Closed previous WS for Courier {courier_id}")
-            except Exception:
-                pass
-                
-        self.active_couriers[courier_id] = websocket
-        logging.info(f"Courier {courier_id} connected to WS")
-
-    def disconnect_courier(self, courier_id: int):
-        if courier_id in self.active_couriers:
-            del self.active_couriers[courier_id]
-            logging.info(f"Courier {courier_id} disconnected from WS")
-
-    async def notify_courier(self, courier_id: int, message: dict):
-        if courier_id in self.active_couriers:
-            try:
-                await self.active_couriers[courier_id].send_json(message)
-            except Exception as e:
-                logging.error(f"WS Error (Courier {courier_id}): {e}")
-                self.disconnect_courier(courier_id)
-
-    # --- Методи для ПАРТНЕРІВ (Ресторанів) ---
-    async def connect_partner(self, websocket: WebSocket, partner_id: int):
-        await websocket.accept()
-        # ЗАКРИВАЄМО СТАРЕ З'ЄДНАННЯ, ЯКЩО ВОНО ІСНУЄ
-        if partner_id in self.active_partners:
-            try:
-                await self.active_partners[partner_id].close()
-                logging.info(f"Closed previous WS for Partner {partner_id}")
-            except Exception:
-                pass
-                
-        self.active_partners[partner_id] = websocket
-        logging.info(f"Partner {partner_id} connected to WS")
-
-    def disconnect_partner(self, partner_id: int):
-        if partner_id in self.active_partners:
-            del self.active_partners[partner_id]
-            logging.info(f"Partner {partner_id} disconnected from WS")
-
-    async def notify_partner(self, partner_id: int, message: dict):
-        if partner_id in self.active_partners:
-            try:
-                await self.active_partners[partner_id].send_json(message)
-            except Exception as e:
-                logging.error(f"WS Error (Partner {partner_id}): {e}")
-                self.disconnect_partner(partner_id)
-manager = ConnectionManager()    
+# --- WebSocket Manager (див. ws_manager.py) ---
+from ws_manager import manager
+import ws_codec
 
 # --- Налаштування за замовчуванням для Бази Даних ---
 DEFAULT_SETTINGS = {
@@ -160,11 +115,45 @@ async def lifespan(app: FastAPI):
     else:
         logging.warning("TG_BOT_TOKEN not set, bot disabled.")
     
+    # Реєстр присутності кур'єрів (стан у пам'яті замість SELECT по is_online)
+    async with async_session_maker() as session:
+        await presence.registry.load(session)
+    presence.registry.attach(manager)
+    # Живий потік координат кур'єрів для закладів (/ws/partner)
+    location_stream.stream.attach(manager)
+    # Real-time карта операцій для адмінів (/ws/admin/map)
+    admin_delivery.ops_hub.start(manager)
+    # Пакетний запис координат кур'єрів у БД
+    location_ingest.ingest.start()
+    # Дошка відкритих замовлень для /api/courier/open_orders
+    await order_board.board.load()
+    order_board.board.attach(manager)
+    # Пакетний диспетчер (DISPATCH_MODE=batch): пропозиції найближчим вільним кур'єрам замість розсилки всім
+    dispatch_optimizer.dispatcher.attach(manager)
+    # Прогноз часу забору/доставки з історії (таблиця eta_stats; на старті лише читання, перерахунок -- у фоні)
+    await eta_model.model.load()
+    asyncio.create_task(eta_model.model.run())
+    # Локальний газетир адрес (офлайн-геокодування) і координати закладів, яких ще немає в БД
+    await geocoding.geocoder.load_local()
+    asyncio.create_task(backfill_partner_coords())
+    
+    # Запуск шини WebSocket-повідомлень між воркерами
+    await manager.start()
+    logging.info(f"WS Broker started ({type(manager.broker).__name__}).")
+    
+    # Воркери черги сповіщень (notification_outbox): WS / FCM / Telegram з повторами
+    outbox.start()
+    
     # Запуск монітора замовлень
     asyncio.create_task(order_monitor.monitor_stale_orders(manager))
     logging.info("Order Monitor started.")
     
     yield
+    await outbox.stop()
+    await location_ingest.ingest.stop()
+    await geocoding.geocoder.stop()
+    push_service.push.shutdown()
+    await manager.stop()
     logging.info("Shutdown.")
 
 app = FastAPI(title="Restify SaaS Control Plane", lifespan=lifespan)
@@ -219,43 +208,47 @@ def format_local_time(utc_dt, tz_string='Europe/Kiev', fmt='%H:%M'):
         return utc_dt.strftime(fmt)
 
 # --- Геокодинг ---
-GEOCODE_CACHE = {}
+async def geocode_address(address: str, deadline: float = None):
+    """Geocoding via Nominatim (OSM): кеш, злиття однакових запитів і ліміт частоти -- у geocoding."""
+    return await geocoding.geocoder.geocode(address, deadline=deadline)
 
-async def geocode_address(address: str):
-    """Geocoding via Nominatim (OSM) with caching."""
-    if not address: return None, None
-    if address in GEOCODE_CACHE: return GEOCODE_CACHE[address]
+# --- ДОЗАПОВНЕННЯ КООРДИНАТ ЗАКЛАДІВ (фоново після старту) ---
+PARTNER_BACKFILL_BATCH = 20
 
-    url = "https://nominatim.openstreetmap.org/search"
-    headers = {"User-Agent": "RestifyDelivery/1.0 (admin@restify.site)"}
-    params = {"q": address, "format": "json", "limit": 1}
-    
-    async with httpx.AsyncClient() as client:
+async def backfill_partner_coords():
+    """Геокодує адреси закладів без координат пачками (старі записи, невдалі спроби при реєстрації)."""
+    last_id, filled, total = 0, 0, 0
+    while True:
         try:
-            resp = await client.get(url, params=params, headers=headers, timeout=5.0)
-            data = resp.json()
-            if data and len(data) > 0:
-                res = (float(data[0]["lat"]), float(data[0]["lon"]))
-                GEOCODE_CACHE[address] = res 
-                return res
+            async with async_session_maker() as session:
+                partners = (await session.execute(
+                    select(DeliveryPartner)
+                    .where(DeliveryPartner.lat.is_(None), DeliveryPartner.id > last_id)
+                    .order_by(DeliveryPartner.id)
+                    .limit(PARTNER_BACKFILL_BATCH)
+                )).scalars().all()
+                if not partners:
+                    break
+                for p in partners:
+                    p.lat, p.lon = await geocode_address(p.address)
+                    total += 1
+                    if p.lat is not None:
+                        filled += 1
+                last_id = partners[-1].id
+                await session.commit()
         except Exception as e:
-            logging.error(f"Geocoding Error: {e}")
-            
-    return None, None
+            logging.error(f"Partner coords backfill error: {e}")
+            break
+    if total:
+        logging.info(f"Partner coords backfill: {filled}/{total} geocoded")
+
+# Радіус (км) від закладу, в якому кур'єри отримують нове замовлення і можуть його взяти
+DISPATCH_RADIUS_KM = 20
 
 def calculate_distance(lat1, lon1, lat2, lon2):
-    """Haversine formula for distance in km."""
-    if lat1 is None or lon1 is None or lat2 is None or lon2 is None:
-        return None
-    try:
-        lon1, lat1, lon2, lat2 = map(radians, [float(lon1), float(lat1), float(lon2), float(lat2)])
-        dlon = lon2 - lon1 
-        dlat = lat2 - lat1 
-        a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-        c = 2 * asin(sqrt(a)) 
-        return round(c * 6371, 2)
-    except Exception:
-        return None
+    """Haversine formula for distance in km (пакетні варіанти -- у geo_distance)."""
+    dist = geo_distance.haversine_km(lat1, lon1, lat2, lon2)
+    return round(dist, 2) if dist is not None else None
 
 # --- ХЕЛПЕР ЗАСЧИТЫВАНИЯ ЗАКАЗА В ПРОГРЕСС (Вызывать при статусе 'delivered') ---
 async def process_courier_motivator_progress(db: AsyncSession, courier_id: int):
@@ -286,7 +279,7 @@ async def process_courier_motivator_progress(db: AsyncSession, courier_id: int):
                 # Уведомляем курьера!
                 if courier.telegram_chat_id:
                     tg_msg = f"🎉 <b>ЦІЛЬ ДОСЯГНУТА!</b>\nВи виконали ціль «{prog.motivator.title}».\nВаша нова комісія: <b>{prog.motivator.reward_commission}%</b> на {prog.motivator.reward_days} днів!"
-                    asyncio.create_task(bot_service.send_telegram_message(courier.telegram_chat_id, tg_msg))
+                    asyncio.create_task(bot_service.send_telegram_message(courier.telegram_chat_id, tg_msg, bot_service.PRIORITY_BULK))
                     
     await db.commit()
 
@@ -954,17 +947,24 @@ async def courier_toggle_status(
 ):
     courier.is_online = not courier.is_online
     await db.commit()
+    presence.registry.set_on_shift(courier.id, courier.is_online)
     return JSONResponse({"is_online": courier.is_online})
 
+def ingest_courier_position(courier_id: int, lat: float, lon: float, at: datetime = None):
+    # Нова позиція кур'єра: реєстр присутності, трекінг для закладів, карта адміна.
+    # У БД потрапляє пакетом (location_ingest), тут запитів немає.
+    at = at or datetime.utcnow()
+    location_ingest.ingest.accept(courier_id, lat, lon, at)
+    presence.registry.update_position(courier_id, lat, lon, at)
+    location_stream.stream.publish(courier_id, lat, lon, at)
+    admin_delivery.ops_hub.courier_moved(courier_id, lat, lon, at)
+
 @app.post("/api/courier/location")
 async def courier_update_location(
     lat: float = Form(...), lon: float = Form(...),
-    courier: Courier = Depends(auth.get_current_courier), db: AsyncSession = Depends(get_db)
+    courier: Courier = Depends(auth.get_current_courier)
 ):
-    courier.lat = lat
-    courier.lon = lon
-    courier.last_seen = datetime.utcnow()
-    await db.commit()
+    ingest_courier_position(courier.id, lat, lon)
     return JSONResponse({"status": "ok"})
 
 @app.post("/api/courier/fcm_token")
@@ -1016,60 +1016,17 @@ async def dismiss_announcement(
 
 # --- Helper for Push Couriers ---
 async def send_push_to_couriers(courier_tokens: List[str], title: str, body: str, job_id: int = None, fee: float = None):
-    if not courier_tokens: return
-    try:
-        for token in courier_tokens:
-            msg = messaging.Message(
-                token=token,
-                data={
-                    "title": title,
-                    "body": body,
-                    "url": "/courier/app",
-                    "job_id": str(job_id) if job_id else "",
-                    "fee": str(fee) if fee is not None else "0"
-                },
-                android=messaging.AndroidConfig(
-                    priority='high',
-                    ttl=0,
-                ),
-                apns=messaging.APNSConfig(
-                    headers={'apns-priority': '10'},
-                    payload=messaging.APNSPayload(
-                        aps=messaging.Aps(content_available=True)
-                    )
-                )
-            )
-            messaging.send(msg) 
-            logging.info(f"Push sent to {token}")
-    except Exception as e:
-        logging.error(f"Push Error: {e}")
+    if not courier_tokens: return []
+    results = await push_service.push.send_multicast(courier_tokens, push_service.courier_data(title, body, job_id, fee))
+    logging.info(f"Push sent to {sum(r['ok'] for r in results)}/{len(results)} couriers")
+    return results
 
 # --- Helper for Push Partners ---
 async def send_push_to_partners(partner_tokens: List[str], title: str, body: str, url: str = "/partner/dashboard", job_id: int = None):
-    if not partner_tokens: return
-    try:
-        for token in partner_tokens:
-            payload_data = {
-                "title": title,
-                "body": body,
-                "url": url
-            }
-            if job_id is not None:
-                payload_data["job_id"] = str(job_id)
-
-            msg = messaging.Message(
-                token=token,
-                data=payload_data,
-                android=messaging.AndroidConfig(priority='high', ttl=0),
-                apns=messaging.APNSConfig(
-                    headers={'apns-priority': '10'},
-                    payload=messaging.APNSPayload(aps=messaging.Aps(content_available=True))
-                )
-            )
-            messaging.send(msg)
-            logging.info(f"Push sent to partner {token}")
-    except Exception as e:
-        logging.error(f"Partner Push Error: {e}")
+    if not partner_tokens: return []
+    results = await push_service.push.send_multicast(partner_tokens, push_service.partner_data(title, body, url, job_id))
+    logging.info(f"Push sent to {sum(r['ok'] for r in results)}/{len(results)} partners")
+    return results
 
 # --- SERVICE WORKER ---
 @app.get("/firebase-messaging-sw.js")
@@ -1161,6 +1118,16 @@ async def get_firebase_sw(db: AsyncSession = Depends(get_db)):
 
 
 # --- WEBSOCKET COURIER ---
+@app.get("/api/ws/protocol")
+async def ws_protocol_description():
+    # Словник ключів для клієнтів з бінарним підпротоколом (див. ws_codec.py)
+    return JSONResponse(ws_codec.protocol_description())
+
+def drop_courier_ws(courier_id: int, websocket: WebSocket):
+    # Знімаємо присутність лише якщо відключається поточний (а не замінений) сокет
+    if manager.disconnect_courier(courier_id, websocket):
+        presence.registry.disconnect(courier_id)
+
 @app.websocket("/ws/courier")
 async def websocket_endpoint(websocket: WebSocket):
     token = websocket.cookies.get("courier_token")
@@ -1176,7 +1143,8 @@ async def websocket_endpoint(websocket: WebSocket):
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
             return
 
-    await manager.connect_courier(websocket, courier_id)
+    conn = await manager.connect_courier(websocket, courier_id)
+    presence.registry.connect(courier_id, presence.detect_client_type(websocket))
     
     try:
         while True:
@@ -1187,114 +1155,42 @@ async def websocket_endpoint(websocket: WebSocket):
                 data = json.loads(data_text)
                 
                 if data.get("type") == "init_location":
-                    lat = float(data.get("lat"))
-                    lon = float(data.get("lon"))
-                    
-                    async with async_session_maker() as session:
-                        db_courier = await session.get(Courier, courier_id)
-                        
-                        if db_courier:
-                            db_courier.lat = lat
-                            db_courier.lon = lon
-                            db_courier.last_seen = datetime.utcnow()
-                            await session.commit() 
-                            
-                            logging.info(f"Courier {courier_id} updated location via WS: {lat}, {lon}")
-                            
-                            active_job_check = await session.execute(
-                                select(DeliveryJob.id)
-                                .where(DeliveryJob.courier_id == courier_id) 
-                                .where(DeliveryJob.status.notin_(["delivered", "cancelled"]))
-                            )
-                            
-                            if active_job_check.scalar():
-                                 pass
-                            else:
-                                pass 
+                    ingest_courier_position(courier_id, float(data.get("lat")), float(data.get("lon")))
                 
                 elif data == "ping":
-                    await websocket.send_text("pong")
+                    presence.registry.heartbeat(courier_id)
+                    conn.enqueue("pong", "pong")
 
             except json.JSONDecodeError:
                 if data_text == "ping":
-                    await websocket.send_text("pong")
+                    presence.registry.heartbeat(courier_id)
+                    conn.enqueue("pong", "pong")
 
     except asyncio.TimeoutError:
         logging.warning(f"WS Timeout: Courier {courier_id} silently disconnected.")
-        manager.disconnect_courier(courier_id)
+        drop_courier_ws(courier_id, websocket)
         try: 
             await websocket.close() 
         except Exception: 
             pass
 
     except WebSocketDisconnect:
-        manager.disconnect_courier(courier_id) 
+        drop_courier_ws(courier_id, websocket) 
     except Exception as e:
         logging.error(f"WS Error: {e}")
-        manager.disconnect_courier(courier_id) 
+        drop_courier_ws(courier_id, websocket) 
 
 @app.get("/api/courier/open_orders")
 async def get_open_orders(
     lat: float, lon: float, 
-    courier: Courier = Depends(auth.get_current_courier),
-    db: AsyncSession = Depends(get_db)
+    courier: Courier = Depends(auth.get_current_courier)
 ):
-    active_check = await db.execute(
-        select(DeliveryJob.id)
-        .where(DeliveryJob.courier_id == courier.id)
-        .where(DeliveryJob.status.notin_(["delivered", "cancelled"]))
-    )
-    if active_check.scalar():
+    # Дошка відкритих замовлень у пам'яті (order_board): лише відстань до закладів і сортування
+    await order_board.board.ensure_loaded()
+    if order_board.board.has_active_job(courier.id):
         return JSONResponse([]) 
 
-    result = await db.execute(
-        select(DeliveryJob)
-        .options(joinedload(DeliveryJob.partner))
-        .where(DeliveryJob.status == "pending")
-        .where(DeliveryJob.target_courier_id == None)  # ТІЛЬКИ ТІ, ЩО БЕЗ ПЕРСОНАЛЬНОГО ПРИЗНАЧЕННЯ
-    )
-    jobs = result.scalars().all()
-    
-    response_data = []
-    
-    for job in jobs:
-        if not job.partner: continue
-        
-        rest_lat, rest_lon = await geocode_address(job.partner.address)
-        
-        dist_to_rest = None
-        if rest_lat and rest_lon:
-            dist_to_rest = calculate_distance(lat, lon, rest_lat, rest_lon)
-        
-        sort_dist = dist_to_rest if dist_to_rest is not None else 9999
-        
-        dist_trip = "?"
-        if job.dropoff_lat and job.dropoff_lon and rest_lat and rest_lon:
-            val = calculate_distance(rest_lat, rest_lon, job.dropoff_lat, job.dropoff_lon)
-            if val: dist_trip = val
-
-        payment_label = {"prepaid": "✅ Оплачено", "cash": "💵 Готівка", "buyout": "💰 Викуп", "buyout_paid": "✅ Оплачено"}.get(job.payment_type, "Оплата")
-
-        response_data.append({
-            "id": job.id,
-            "restaurant_name": job.partner.name,
-            "restaurant_address": job.partner.address,
-            "dropoff_address": job.dropoff_address,
-            "customer_name": job.customer_name,
-            "fee": job.delivery_fee,
-            "price": job.order_price,
-            "dist_to_rest": dist_to_rest, 
-            "dist_trip": dist_trip,       
-            "payment_type": job.payment_type,
-            "is_return": job.is_return_required,
-            "comment": job.comment,
-            "estimated_ready_at": job.estimated_ready_at.isoformat() + "Z" if job.estimated_ready_at else None,
-            "_sort_key": sort_dist
-        })
-
-    response_data.sort(key=lambda x: x["_sort_key"])
-    
-    return JSONResponse(response_data)
+    return Response(order_board.board.open_orders_json(lat, lon), media_type="application/json")
 
 
 @app.get("/api/courier/history")
@@ -1371,6 +1267,7 @@ async def get_active_job(
     
     server_status = job.status 
     is_ready = True if (job.ready_at or job.status == 'ready') else False
+    eta = eta_model.model.job_eta(job, job.partner)
 
     return JSONResponse({
         "active": True,
@@ -1398,7 +1295,11 @@ async def get_active_job(
             "assigned_at": job.accepted_at.isoformat() + "Z" if job.accepted_at else None,
             "picked_up_at": job.picked_up_at.isoformat() + "Z" if job.picked_up_at else None,
             "delivered_at": job.delivered_at.isoformat() + "Z" if job.delivered_at else None,
-            "completed_at": None 
+            "completed_at": None,
+
+            # --- ПРОГНОЗ З ІСТОРІЇ ДОСТАВОК (eta_model) ---
+            "eta_pickup_at": eta["pickup_at"].isoformat() + "Z" if eta["pickup_at"] else None,
+            "eta_delivered_at": eta["delivery_at"].isoformat() + "Z" if eta["delivery_at"] else None
         }
     })
 
@@ -1459,20 +1360,18 @@ async def update_job_status(
         job.delivered_at = datetime.utcnow()
         msg_text = f"💰 Кур'єр {courier.name} віддав замовлення клієнту і везе гроші назад у заклад!"
         color = "#fb923c" 
+        event_key = f"job:{job.id}:returning"
         
-        await manager.notify_partner(job.partner_id, {
+        outbox.ws(db, "partner", job.partner_id, {
             "type": "order_update", "job_id": job.id, "status": "returning",
             "status_text": "Повернення коштів", "status_color": color,
             "message": msg_text
-        })
+        }, event_key)
         
         partner = await db.get(DeliveryPartner, job.partner_id)
         if partner:
-            if partner.telegram_chat_id:
-                tg_text = f"💰 <b>Замовлення #{job.id}</b>\n{msg_text}"
-                asyncio.create_task(bot_service.send_telegram_message(partner.telegram_chat_id, tg_text))
-            if partner.fcm_token:
-                await send_push_to_partners([partner.fcm_token], "Повернення коштів", msg_text)
+            outbox.telegram(db, partner.telegram_chat_id, f"💰 <b>Замовлення #{job.id}</b>\n{msg_text}", event_key)
+            outbox.push(db, "partner", partner.fcm_token, "Повернення коштів", msg_text, event_key)
     else:
         job.status = status
         if status == "picked_up": 
@@ -1517,13 +1416,9 @@ async def update_job_status(
                 # --- ПЕРЕВІРКА БАЛАНСУ ---
                 if old_balance >= 30.0 and courier.balance < 30.0:
                     warn_msg = f"Ваш баланс опустився нижче 30 грн (Поточний: {courier.balance:.2f} грн). Будь ласка, поповніть його."
-                    if courier.fcm_token:
-                        await send_push_to_couriers([courier.fcm_token], "⚠️ Низький баланс!", warn_msg)
-                    if courier.telegram_chat_id:
-                        asyncio.create_task(bot_service.send_telegram_message(
-                            courier.telegram_chat_id, 
-                            f"⚠️ <b>Увага! Низький баланс!</b>\n{warn_msg}"
-                        ))
+                    warn_key = f"courier:{courier.id}:low_balance:job:{job.id}"
+                    outbox.push(db, "courier", courier.fcm_token, "⚠️ Низький баланс!", warn_msg, warn_key)
+                    outbox.telegram(db, courier.telegram_chat_id, f"⚠️ <b>Увага! Низький баланс!</b>\n{warn_msg}", warn_key)
             # -------------------------------
             
             
@@ -1532,19 +1427,20 @@ async def update_job_status(
              status_text = status
              color = "#e2e8f0"
 
-        await manager.notify_partner(job.partner_id, {
+        # Сповіщення -- у тій самій транзакції, що й зміна статусу (notification_outbox)
+        event_key = f"job:{job.id}:{status}"
+        outbox.ws(db, "partner", job.partner_id, {
             "type": "order_update", "job_id": job.id, "status": status,
             "status_text": status_text, "status_color": color,
             "courier_name": courier.name, "message": msg_text
-        })
+        }, event_key)
         
         partner = await db.get(DeliveryPartner, job.partner_id)
         if partner:
-            if partner.telegram_chat_id and status in ["picked_up", "delivered"]:
+            if status in ["picked_up", "delivered"]:
                 tg_text = f"📦 <b>Замовлення #{job.id}</b>\n{msg_text}\nКур'єр: {courier.name}"
-                asyncio.create_task(bot_service.send_telegram_message(partner.telegram_chat_id, tg_text))
-            if partner.fcm_token:
-                await send_push_to_partners([partner.fcm_token], f"Статус: {status_text}", msg_text)
+                outbox.telegram(db, partner.telegram_chat_id, tg_text, event_key)
+            outbox.push(db, "partner", partner.fcm_token, f"Статус: {status_text}", msg_text, event_key)
 
     await db.commit()
     return JSONResponse({"status": "ok", "new_status": job.status})
@@ -1555,39 +1451,47 @@ async def courier_accept_order(
     courier: Courier = Depends(auth.get_current_courier),
     db: AsyncSession = Depends(get_db)
 ):
-    result = await db.execute(
-        select(DeliveryJob).where(DeliveryJob.id == job_id).with_for_update()
-    )
-    job = result.scalar_one_or_none()
-
-    if not job or job.status != "pending":
-        return JSONResponse({"status": "error", "message": "Замовлення вже зайняте"}, status_code=409)
-
-    partner = await db.get(DeliveryPartner, job.partner_id)
-    partner_lat, partner_lon = await geocode_address(partner.address)
-    
-    if partner_lat and courier.lat:
-        dist = calculate_distance(courier.lat, courier.lon, partner_lat, partner_lon)
-        if dist and dist > 20:
+    # Перевірки -- до запису і без блокувань: координати закладу з дошки відкритих замовлень (у пам'яті),
+    # для персональних пропозицій -- простим SELECT
+    entry = order_board.board.entry(job_id)
+    if entry:
+        partner_lat, partner_lon = entry.rest_lat, entry.rest_lon
+    else:
+        row = (await db.execute(
+            select(DeliveryJob.status, DeliveryPartner.lat, DeliveryPartner.lon)
+            .join(DeliveryPartner, DeliveryJob.partner_id == DeliveryPartner.id)
+            .where(DeliveryJob.id == job_id)
+        )).first()
+        if not row or row.status != "pending":
+            return JSONResponse({"status": "error", "message": "Замовлення вже зайняте"}, status_code=409)
+        partner_lat, partner_lon = row.lat, row.lon
+    
+    # Свіжа позиція з пам'яті (у БД вона записується пакетами)
+    c_lat, c_lon, _ = presence.registry.position(courier.id)
+    if c_lat is None:
+        c_lat, c_lon = courier.lat, courier.lon
+    if partner_lat and c_lat:
+        dist = calculate_distance(c_lat, c_lon, partner_lat, partner_lon)
+        if dist and dist > DISPATCH_RADIUS_KM:
              return JSONResponse({"status": "error", "message": f"Занадто далеко ({dist} км)"}, status_code=400)
 
-    job.status = "assigned"
-    job.courier_id = courier.id
-    job.accepted_at = datetime.utcnow()
-    await db.commit()
+    # Саме прийняття -- один умовний UPDATE: з кількох одночасних кур'єрів замовлення отримає перший.
+    # Коміт -- разом зі сповіщеннями закладу (notification_outbox)
+    partner_id = await order_claim.claim_job(db, job_id, courier.id, commit=False)
+    if partner_id is None:
+        return JSONResponse({"status": "error", "message": "Замовлення вже зайняте"}, status_code=409)
+    partner = await db.get(DeliveryPartner, partner_id)
+    event_key = f"job:{job_id}:accepted:{courier.id}"
 
-    await manager.notify_partner(job.partner_id, {
-        "type": "order_update", "job_id": job.id, "status": "assigned",
+    outbox.ws(db, "partner", partner_id, {
+        "type": "order_update", "job_id": job_id, "status": "assigned",
         "status_text": "assigned", "status_color": "#fef08a", 
         "courier_name": courier.name, "message": f"🚴 Кур'єр {courier.name} прийняв замовлення!"
-    })
-
-    if partner.telegram_chat_id:
-        tg_text = f"🚴 <b>Замовлення #{job.id} прийнято!</b>\nКур'єр: {courier.name}\nТелефон: {courier.phone}"
-        asyncio.create_task(bot_service.send_telegram_message(partner.telegram_chat_id, tg_text))
-    
-    if partner.fcm_token:
-        await send_push_to_partners([partner.fcm_token], "Замовлення прийнято!", f"🚴 Кур'єр {courier.name} прямує до вас")
+    }, event_key)
+    tg_text = f"🚴 <b>Замовлення #{job_id} прийнято!</b>\nКур'єр: {courier.name}\nТелефон: {courier.phone}"
+    outbox.telegram(db, partner.telegram_chat_id, tg_text, event_key)
+    outbox.push(db, "partner", partner.fcm_token, "Замовлення прийнято!", f"🚴 Кур'єр {courier.name} прямує до вас", event_key)
+    await db.commit()
 
     return JSONResponse({"status": "ok", "message": "Замовлення прийнято!"})
 
@@ -1596,7 +1500,13 @@ async def courier_accept_order(
 async def decline_direct_order(job_id: int = Form(...), courier: Courier = Depends(auth.get_current_courier), db: AsyncSession = Depends(get_db)):
     """Якщо кур'єр відмовився від персонального замовлення - кидаємо його в загальний пул"""
     job = await db.get(DeliveryJob, job_id)
-    if job and job.target_courier_id == courier.id and job.status == "pending":
+    if job and job.target_courier_id == courier.id and job.status == "pending" and job.offered_at:
+        # Пропозиція диспетчера: замовлення повертається в наступний раунд без цього кур'єра
+        job.target_courier_id = None
+        job.offered_at = None
+        await db.commit()
+        dispatch_optimizer.dispatcher.record_decline(job.id, courier.id)
+    elif job and job.target_courier_id == courier.id and job.status == "pending":
         job.target_courier_id = None
         await db.commit()
         partner = await db.get(DeliveryPartner, job.partner_id)
@@ -1632,6 +1542,57 @@ async def get_all_active_jobs(courier: Courier = Depends(auth.get_current_courie
         })
     return JSONResponse({"active": len(response) > 0, "jobs": response})
 
+@app.get("/api/courier/route")
+async def get_courier_route(
+    lat: float = None, lon: float = None,
+    courier: Courier = Depends(auth.get_current_courier), db: AsyncSession = Depends(get_db)
+):
+    """Рекомендований порядок зупинок (заклади, клієнти, повернення коштів) для всіх активних замовлень кур'єра."""
+    if lat is None or lon is None:
+        lat, lon, _ = presence.registry.position(courier.id)
+        if lat is None:
+            lat, lon = courier.lat, courier.lon
+    if lat is None or lon is None:
+        return JSONResponse({"status": "error", "message": "Невідома позиція кур'єра"}, status_code=400)
+
+    result = await db.execute(
+        select(DeliveryJob).options(joinedload(DeliveryJob.partner))
+        .where(DeliveryJob.courier_id == courier.id)
+        .where(DeliveryJob.status.notin_(["delivered", "cancelled"]))
+        .order_by(DeliveryJob.accepted_at.asc())
+    )
+    now = datetime.utcnow()
+    stops, unplanned = [], []
+    for job in result.scalars().all():
+        partner = job.partner
+        has_rest = bool(partner and partner.lat and partner.lon)
+        chain = []
+        if job.status in ("assigned", "arrived_pickup", "ready"):
+            ready_in = 0.0
+            if job.estimated_ready_at and not job.ready_at and job.status != "ready":
+                ready_in = (job.estimated_ready_at - now).total_seconds() / 60
+            chain.append((route_planner.PICKUP, partner.lat if has_rest else None, partner.lon if has_rest else None, ready_in,
+                          {"name": partner.name if partner else "", "address": partner.address if partner else ""}))
+        if job.status in ("assigned", "arrived_pickup", "ready", "picked_up"):
+            chain.append((route_planner.DROPOFF, job.dropoff_lat, job.dropoff_lon, 0.0,
+                          {"name": job.customer_name, "address": job.dropoff_address}))
+        if job.status == "returning" or (job.is_return_required and chain):
+            chain.append((route_planner.RETURN, partner.lat if has_rest else None, partner.lon if has_rest else None, 0.0,
+                          {"name": partner.name if partner else "", "address": partner.address if partner else ""}))
+        if any(s_lat is None or s_lon is None for _, s_lat, s_lon, _, _ in chain):
+            unplanned.append(job.id)
+            continue
+        stops.extend(route_planner.Stop(job.id, kind, s_lat, s_lon, ready_in, info) for kind, s_lat, s_lon, ready_in, info in chain)
+
+    route = route_planner.route_cache.get(courier.id, stops, (lat, lon))
+    cached = route is not None
+    if not cached:
+        route = route_planner.plan_route((lat, lon), stops)
+        for stop in route["stops"]:
+            stop["eta"] = (now + timedelta(minutes=stop["eta_min"])).isoformat() + "Z"
+        route_planner.route_cache.put(courier.id, stops, (lat, lon), route)
+    return JSONResponse({**route, "unplanned": unplanned, "cached": cached})
+
 @app.get("/api/courier/direct_offers")
 async def get_direct_offers(
     courier: Courier = Depends(auth.get_current_courier),
@@ -1647,29 +1608,7 @@ async def get_direct_offers(
         .where(DeliveryJob.status == "pending")
     )
     offers = result.scalars().all()
-    
-    data = []
-    for job in offers:
-        payment_label = {"prepaid": "✅ Оплачено", "cash": "💵 Готівка", "buyout": "💰 Викуп", "buyout_paid": "✅ Оплачено"}.get(job.payment_type, "Оплата")
-        formatted_comment = f"[{payment_label}] {job.comment}" if job.comment else f"[{payment_label}]"
-        
-        data.append({
-            "id": job.id,
-            "fee": job.delivery_fee,
-            "price": job.order_price,
-            "estimated_ready_at": job.estimated_ready_at.isoformat() + "Z" if job.estimated_ready_at else None,
-            "payment_type": job.payment_type,
-            "is_return": job.is_return_required,
-            "comment": formatted_comment,
-            "dist_to_rest": None, 
-            "dist_trip": None,
-            # Ключі для сумісності з Android та PWA
-            "restaurant_name": job.partner.name if job.partner else "Невідомий заклад",
-            "restaurant_address": job.partner.address if job.partner else "Адреса не вказана",
-            "dropoff_address": job.dropoff_address,
-            "restaurant": job.partner.name if job.partner else "Невідомий заклад",
-            "address": job.dropoff_address
-        })
+    data = [direct_offer_data(job, job.partner) for job in offers]
     return JSONResponse(data)
 
 # ==============================================================================
@@ -1712,6 +1651,8 @@ async def send_chat_message(
 ):
     msg = ChatMessage(job_id=job_id, sender_role=role, message=message)
     db.add(msg)
+    await db.flush()
+    event_key = f"chat:{msg.id}"
     
     config = await get_all_settings(db)
     tz = config.get("timezone", "Europe/Kiev")
@@ -1735,27 +1676,20 @@ async def send_chat_message(
         
         # Якщо пише ЗАКЛАД (partner) -> сповіщаємо КУР'ЄРА
         if role == 'partner' and job.courier_id and job.courier:
-            await manager.notify_courier(job.courier_id, ws_msg)
+            outbox.ws(db, "courier", job.courier_id, ws_msg, event_key)
             
             tg_text = f"💬 <b>Повідомлення від закладу ({job.partner.name}):</b>\n{message}"
-            if job.courier.telegram_chat_id:
-                asyncio.create_task(bot_service.send_telegram_message(job.courier.telegram_chat_id, tg_text))
-            
-            if job.courier.fcm_token:
-                await send_push_to_couriers([job.courier.fcm_token], f"Чат: {job.partner.name}", message, job_id=job_id)
+            outbox.telegram(db, job.courier.telegram_chat_id, tg_text, event_key)
+            outbox.push(db, "courier", job.courier.fcm_token, f"Чат: {job.partner.name}", message, event_key, job_id=job_id)
 
         # Якщо пише КУР'ЄР (courier) -> сповіщаємо ЗАКЛАД
         elif role == 'courier' and job.partner:
-            await manager.notify_partner(job.partner_id, ws_msg)
+            outbox.ws(db, "partner", job.partner_id, ws_msg, event_key)
             
             courier_name = job.courier.name if job.courier else "Кур'єр"
             tg_text = f"💬 <b>Повідомлення від {courier_name}:</b>\n{message}\nЗамовлення #{job_id}"
-            
-            if job.partner.telegram_chat_id:
-                asyncio.create_task(bot_service.send_telegram_message(job.partner.telegram_chat_id, tg_text))
-                
-            if job.partner.fcm_token:
-                await send_push_to_partners([job.partner.fcm_token], f"Чат від {courier_name}", message, job_id=job_id)
+            outbox.telegram(db, job.partner.telegram_chat_id, tg_text, event_key)
+            outbox.push(db, "partner", job.partner.fcm_token, f"Чат від {courier_name}", message, event_key, job_id=job_id)
             
     await db.commit()
     return JSONResponse({"status": "ok"})
@@ -1873,9 +1807,11 @@ async def api_partner_register_native(
     if existing.scalar():
         return JSONResponse({"status": "error", "message": "Цей Email вже зайнятий"}, status_code=400)
     
+    partner_lat, partner_lon = await geocode_address(address)
     db.add(DeliveryPartner(
         name=name, phone=verif.phone, address=address, email=email, 
-        hashed_password=auth.get_password_hash(password), telegram_chat_id=verif.telegram_chat_id
+        hashed_password=auth.get_password_hash(password), telegram_chat_id=verif.telegram_chat_id,
+        lat=partner_lat, lon=partner_lon
     ))
     await db.delete(verif)
     await db.commit()
@@ -1905,6 +1841,7 @@ async def api_partner_orders_native(partner: DeliveryPartner = Depends(get_curre
     time_format = '%Y-%m-%d %H:%M:%S'
     
     for j in jobs:
+        eta = eta_model.model.job_eta(j, partner) if j.status not in ("delivered", "cancelled") else {"pickup_at": None, "delivery_at": None}
         c_data = None
         if j.courier:
             c_data = {
@@ -1920,6 +1857,8 @@ async def api_partner_orders_native(partner: DeliveryPartner = Depends(get_curre
             "arrived_at": format_local_time(j.arrived_at_pickup_at, tz, time_format) if j.arrived_at_pickup_at else None,
             "picked_up_at": format_local_time(j.picked_up_at, tz, time_format) if j.picked_up_at else None,
             "delivered_at": format_local_time(j.delivered_at, tz, time_format) if j.delivered_at else None,
+            "eta_pickup_at": format_local_time(eta["pickup_at"], tz, time_format) if eta["pickup_at"] else None,
+            "eta_delivered_at": format_local_time(eta["delivery_at"], tz, time_format) if eta["delivery_at"] else None,
             "dropoff_address": j.dropoff_address,
             "order_price": j.order_price, "delivery_fee": j.delivery_fee,
             "payment_type": j.payment_type, "is_return_required": j.is_return_required,
@@ -1945,60 +1884,108 @@ async def api_partner_min_fee_native(db: AsyncSession = Depends(get_db), partner
     })
 
 # --- ХЕЛПЕР ДЛЯ РОЗСИЛКИ ЗАМОВЛЕННЯ ВСІМ КУР'ЄРАМ ---
-async def broadcast_order_to_all(db: AsyncSession, job: DeliveryJob, partner: DeliveryPartner):
-    rest_lat, rest_lon = await geocode_address(partner.address)
+def offer_eta(job: DeliveryJob, partner: DeliveryPartner) -> dict:
+    """Прогноз для картки пропозиції: хвилини від прийняття до забору і від забору до доставки."""
+    rest_lat = partner.lat if partner else None
+    rest_lon = partner.lon if partner else None
+    return {
+        "eta_pickup_min": eta_model.model.pickup_minutes(rest_lat, rest_lon),
+        "eta_delivery_min": eta_model.model.delivery_minutes(rest_lat, rest_lon, job.dropoff_lat, job.dropoff_lon),
+    }
+
+def direct_offer_data(job: DeliveryJob, partner: DeliveryPartner, dist_to_rest=None) -> dict:
+    """Картка персональної пропозиції (direct_offer); ключі і для Android, і для PWA."""
     payment_label = {"prepaid": "✅ Оплачено", "cash": "💵 Готівка", "buyout": "💰 Викуп", "buyout_paid": "✅ Оплачено"}.get(job.payment_type, "Оплата")
+    return {
+        "id": job.id,
+        "fee": job.delivery_fee,
+        "price": job.order_price,
+        "estimated_ready_at": job.estimated_ready_at.isoformat() + "Z" if job.estimated_ready_at else None,
+        "payment_type": job.payment_type,
+        "is_return": job.is_return_required,
+        "comment": f"[{payment_label}] {job.comment}" if job.comment else f"[{payment_label}]",
+        "dist_to_rest": dist_to_rest,
+        "dist_trip": None,
+        **offer_eta(job, partner),
+        # Ключі для сумісності з Android та PWA
+        "restaurant_name": partner.name if partner else "Невідомий заклад",
+        "restaurant_address": partner.address if partner and partner.address else "Адреса не вказана",
+        "dropoff_address": job.dropoff_address,
+        "restaurant": partner.name if partner else "Невідомий заклад",
+        "address": job.dropoff_address
+    }
+
+async def send_direct_offer(db: AsyncSession, job: DeliveryJob, partner: DeliveryPartner, courier_id: int, dist_to_rest=None):
+    """Пропозиція від пакетного диспетчера: direct_offer у WS + push + Telegram обраному кур'єру."""
+    courier = await db.get(Courier, courier_id)
+    if not courier:
+        return
+    await manager.notify_courier(courier_id, {"type": "direct_offer", "data": direct_offer_data(job, partner, dist_to_rest)})
+    where = f"{partner.name}, {dist_to_rest} км від вас" if dist_to_rest is not None else partner.name
+    if courier.fcm_token:
+        asyncio.create_task(send_push_to_couriers(
+            [courier.fcm_token], "⚡ Замовлення для вас!", f"💰 {job.delivery_fee} грн · {where}",
+            job_id=job.id, fee=job.delivery_fee
+        ))
+    if courier.telegram_chat_id:
+        tg_msg = (
+            f"⚡ <b>Замовлення для вас!</b>\n"
+            f"📍 {where}\n"
+            f"💰 Вартість доставки: <b>{job.delivery_fee} грн</b>"
+        )
+        asyncio.create_task(bot_service.send_telegram_message(courier.telegram_chat_id, tg_msg, bot_service.PRIORITY_OFFER))
 
-    busy_couriers_res = await db.execute(
-        select(DeliveryJob.courier_id)
-        .where(DeliveryJob.status.notin_(["delivered", "cancelled"]))
-        .where(DeliveryJob.courier_id.is_not(None))
-    )
-    busy_ids = set(busy_couriers_res.scalars().all())
-
-    res = await db.execute(select(Courier).where(Courier.is_online == True))
-    online_couriers = res.scalars().all()
+async def broadcast_order_to_all(db: AsyncSession, job: DeliveryJob, partner: DeliveryPartner):
+    """
+    Розсилка нового замовлення вільним кур'єрам хвилями (order_waves): спершу найближчим,
+    далі ширше, поки замовлення не приймуть. Перша хвиля -- одразу, наступні -- у фоні.
+    """
+    payment_label = {"prepaid": "✅ Оплачено", "cash": "💵 Готівка", "buyout": "💰 Викуп", "buyout_paid": "✅ Оплачено"}.get(job.payment_type, "Оплата")
+    base_payload = {"type": "new_order", "data": {
+        "id": job.id, "address": job.dropoff_address, 
+        "customer_name": job.customer_name, 
+        "restaurant": partner.name if partner else "", 
+        "restaurant_address": partner.address if partner else "",
+        "fee": job.delivery_fee, "price": job.order_price, "comment": f"[{payment_label}] {job.comment}",
+        "dist_to_rest": "?",
+        "is_return": job.is_return_required,
+        "payment_type": job.payment_type,
+        "estimated_ready_at": job.estimated_ready_at.isoformat() + "Z" if job.estimated_ready_at else None,
+        **offer_eta(job, partner)
+    }}
 
-    async def notify_courier_async(courier):
-        is_location_fresh = True
-        if courier.last_seen:
-            diff = datetime.utcnow() - courier.last_seen
-            if diff.total_seconds() > 1800: 
-                is_location_fresh = False
-        
-        dist_to_rest = None
-        if is_location_fresh and courier.lat and courier.lon and rest_lat and rest_lon:
-            dist_to_rest = calculate_distance(courier.lat, courier.lon, rest_lat, rest_lon)
-        
-        if is_location_fresh and dist_to_rest is not None and dist_to_rest > 20: 
-            return 
-            
-        display_dist = dist_to_rest if (is_location_fresh and dist_to_rest is not None) else "?"
-
-        personal_data = {
-            "id": job.id, "address": job.dropoff_address, 
-            "customer_name": job.customer_name, 
-            "restaurant": partner.name if partner else "", 
-            "restaurant_address": partner.address if partner else "",
-            "fee": job.delivery_fee, "price": job.order_price, "comment": f"[{payment_label}] {job.comment}",
-            "dist_to_rest": display_dist,
-            "is_return": job.is_return_required,
-            "payment_type": job.payment_type,
-            "estimated_ready_at": job.estimated_ready_at.isoformat() + "Z" if job.estimated_ready_at else None
-        }
-        
-        await manager.notify_courier(courier.id, {"type": "new_order", "data": personal_data})
-        
+    async def send_wave(recipients):
+        # Хвилі після першої йдуть уже після завершення запиту -- окрема сесія
+        async with async_session_maker() as wave_db:
+            await notify_couriers_new_order(wave_db, job, partner, base_payload, recipients)
+
+    await order_waves.broadcaster.start(job.id, partner.lat if partner else None, partner.lon if partner else None, send_wave)
+
+async def notify_couriers_new_order(db: AsyncSession, job: DeliveryJob, partner: DeliveryPartner, base_payload: dict, recipients):
+    """new_order у WS + push + Telegram для [(courier_id, відстань_до_закладу або "?")]."""
+    res = await db.execute(select(Courier).where(Courier.id.in_([cid for cid, _ in recipients])))
+    couriers = res.scalars().all()
+
+    # Персональна частина повідомлення -- лише відстань до закладу
+    patches = {}
+    push_tokens = []
+    by_id = {c.id: c for c in couriers}
+    for cid, dist_to_rest in recipients:
+        courier = by_id.get(cid)
+        if not courier:
+            continue
+        patches[cid] = {"dist_to_rest": dist_to_rest}
         if courier.fcm_token:
-            await send_push_to_couriers([courier.fcm_token], "🔥 Нове замовлення!", f"💰 {job.delivery_fee} грн", job_id=job.id, fee=job.delivery_fee)
+            push_tokens.append(courier.fcm_token)
+
+    outcomes = await manager.broadcast_to_couriers(list(patches), base_payload, patches)
+    logging.info(f"Order #{job.id}: WS broadcast queued for {sum(1 for o in outcomes.values() if o != 'remote')}/{len(outcomes)} local couriers")
 
-    for c in online_couriers:
-        if c.id in busy_ids: continue
-        asyncio.create_task(notify_courier_async(c))
+    if push_tokens:
+        asyncio.create_task(send_push_to_couriers(push_tokens, "🔥 Нове замовлення!", f"💰 {job.delivery_fee} грн", job_id=job.id, fee=job.delivery_fee))
 
-    res_tg = await db.execute(select(Courier).where(Courier.is_online == True, Courier.telegram_chat_id != None))
-    for c in res_tg.scalars().all():
-        if c.id in busy_ids: continue
+    for c in couriers:
+        if not c.telegram_chat_id: continue
         asyncio.create_task(bot_service.send_telegram_message(c.telegram_chat_id, f"🔥 <b>Нове замовлення!</b>\n💰 {job.delivery_fee} грн\n📍 {partner.name}"))
 
 @app.post("/api/partner/create_order_native")
@@ -2042,7 +2029,7 @@ async def api_create_order_native(
         search_address = dropoff_address
 
     # Ищем координаты по чистой строке
-    client_lat, client_lon = await geocode_address(search_address)
+    client_lat, client_lon = await geocode_address(search_address, deadline=geocoding.GEOCODE_REQUEST_DEADLINE)
 
     full_comment = comment
     if change_from:
@@ -2122,8 +2109,9 @@ async def api_create_order_native(
                     f"Заклад <b>{partner.name}</b> пропонує вам ще одне замовлення попутно.\n"
                     f"💰 Вартість доставки: <b>{delivery_fee} грн</b>"
                 )
-                asyncio.create_task(bot_service.send_telegram_message(target_courier.telegram_chat_id, tg_msg))
-    else:
+                asyncio.create_task(bot_service.send_telegram_message(target_courier.telegram_chat_id, tg_msg, bot_service.PRIORITY_OFFER))
+    elif not dispatch_optimizer.dispatcher.handles(partner):
+        # У пакетному режимі замовлення підхопить найближчий раунд диспетчера
         await broadcast_order_to_all(db, job, partner)
 
     return JSONResponse({"status": "ok", "job_id": job.id})
@@ -2161,9 +2149,11 @@ async def partner_register_action(
          # ДОДАНО HTMLResponse
         return HTMLResponse(content=templates_partner.get_partner_auth_html(is_register=True, message="Email вже зайнятий"))
     
+    partner_lat, partner_lon = await geocode_address(address)
     db.add(DeliveryPartner(
         name=name, phone=verif.phone, address=address, email=email, 
-        hashed_password=auth.get_password_hash(password), telegram_chat_id=verif.telegram_chat_id
+        hashed_password=auth.get_password_hash(password), telegram_chat_id=verif.telegram_chat_id,
+        lat=partner_lat, lon=partner_lon
     ))
     await db.delete(verif)
     await db.commit()
@@ -2373,7 +2363,7 @@ async def create_partner_order(
     
     if not client_lat or not client_lon:
         # Ищем координаты по чистой строке
-        client_lat, client_lon = await geocode_address(search_address)
+        client_lat, client_lon = await geocode_address(search_address, deadline=geocoding.GEOCODE_REQUEST_DEADLINE)
 
     full_comment = comment
     if change_from:
@@ -2452,8 +2442,9 @@ async def create_partner_order(
                     f"Заклад <b>{partner.name}</b> пропонує вам ще одне замовлення попутно.\n"
                     f"💰 Вартість доставки: <b>{delivery_fee} грн</b>"
                 )
-                asyncio.create_task(bot_service.send_telegram_message(target_courier.telegram_chat_id, tg_msg))
-    else:
+                asyncio.create_task(bot_service.send_telegram_message(target_courier.telegram_chat_id, tg_msg, bot_service.PRIORITY_OFFER))
+    elif not dispatch_optimizer.dispatcher.handles(partner):
+        # У пакетному режимі замовлення підхопить найближчий раунд диспетчера
         await broadcast_order_to_all(db, job, partner)
 
     return RedirectResponse("/partner/dashboard", status_code=303)
@@ -2563,7 +2554,7 @@ async def partner_boost_order(
     
     # ЕСЛИ заказ еще в поиске - уведомляем всех курьеров
     if job.status == "pending":
-        rest_lat, rest_lon = await geocode_address(job.partner.address)
+        rest_lat, rest_lon = job.partner.lat, job.partner.lon
         payment_label = {"prepaid": "✅ Оплачено", "cash": "💵 Готівка", "buyout": "💰 Викуп", "buyout_paid": "✅ Оплачено"}.get(job.payment_type, "Оплата")
         
         full_job_data = {
@@ -2588,30 +2579,40 @@ async def partner_boost_order(
         )
         busy_ids = set(busy_couriers_res.scalars().all())
 
-        online_couriers = (await db.execute(select(Courier).where(Courier.is_online == True))).scalars().all()
+        online_couriers = []
+        candidate_ids = presence.registry.on_shift_ids() - busy_ids
+        if candidate_ids:
+            online_couriers = (await db.execute(select(Courier).where(Courier.id.in_(candidate_ids)))).scalars().all()
         
-        for c in online_couriers:
-            if c.id in busy_ids: continue
-            
-            current_dist = "?"
-            if c.lat and c.lon and rest_lat and rest_lon:
-                d = calculate_distance(c.lat, c.lon, rest_lat, rest_lon)
-                if d: current_dist = d
+        # Відстані всіх кур'єрів до закладу одним векторним викликом
+        positions = [presence.registry.position(c.id) for c in online_couriers]
+        dists = [None] * len(online_couriers)
+        if rest_lat and rest_lon:
+            dists = geo_distance.to_km_list(geo_distance.distances_from(
+                rest_lat, rest_lon,
+                [p_lat or None for p_lat, _, _ in positions], [p_lon or None for _, p_lon, _ in positions],
+            ))
+
+        patches = {}
+        push_tokens = []
+        for c, d in zip(online_couriers, dists):
+            current_dist = d if d else "?"
             
-            courier_specific_data = full_job_data.copy()
-            courier_specific_data["dist_to_rest"] = current_dist
-
-            await manager.notify_courier(c.id, {"type": "new_order", "data": courier_specific_data })
-
+            patches[c.id] = {"dist_to_rest": current_dist}
             if c.fcm_token:
-                 await send_push_to_couriers(
-                     [c.fcm_token], "🔥 Ціна зросла!", f"💰 {job.delivery_fee} грн\n📍 {job.dropoff_address}", 
-                     job_id=job.id, fee=job.delivery_fee
-                 )
+                push_tokens.append(c.fcm_token)
                  
             if c.telegram_chat_id:
                 tg_msg = f"🔥 <b>Ціна зросла!</b>\nНова ціна: 💰 {job.delivery_fee} грн\n📍 {job.dropoff_address}"
                 asyncio.create_task(bot_service.send_telegram_message(c.telegram_chat_id, tg_msg))
+
+        await manager.broadcast_to_couriers(list(patches), {"type": "new_order", "data": full_job_data}, patches)
+
+        if push_tokens:
+            await send_push_to_couriers(
+                push_tokens, "🔥 Ціна зросла!", f"💰 {job.delivery_fee} грн\n📍 {job.dropoff_address}", 
+                job_id=job.id, fee=job.delivery_fee
+            )
     
     # ЕСЛИ курьер уже назначен (assigned, arrived_pickup, ready) - уведомляем лично его в качестве "чаевых" или бонуса
     else:
@@ -2643,8 +2644,9 @@ async def track_courier_location(
     if not job or job.partner_id != partner.id: return JSONResponse({"status": "error"}, status_code=403)
     if not job.courier_id: return JSONResponse({"status": "waiting"})
     courier = await db.get(Courier, job.courier_id)
+    lat, lon, _ = presence.registry.position(courier.id)
     return JSONResponse({
-        "status": "ok", "lat": courier.lat, "lon": courier.lon, 
+        "status": "ok", "lat": lat if lat is not None else courier.lat, "lon": lon if lon is not None else courier.lon, 
         "name": courier.name, "phone": courier.phone, "job_status": job.status
     })
 
@@ -2658,17 +2660,26 @@ async def websocket_partner_endpoint(websocket: WebSocket):
     pid = None 
     try:
         pid = int(auth.jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])["sub"].split(":")[1])
-        await manager.connect_partner(websocket, pid)
+        conn = await manager.connect_partner(websocket, pid)
         while True: 
             # Встановлюємо таймаут 120 секунд
             data_text = await asyncio.wait_for(websocket.receive_text(), timeout=120.0)
             if data_text == "ping":
-                await websocket.send_text("pong")
+                conn.enqueue("pong", "pong")
+                continue
+            try:
+                data = json.loads(data_text)
+            except json.JSONDecodeError:
+                continue
+            if data.get("type") == "track_courier":
+                await start_partner_tracking(pid, data.get("job_id"))
+            elif data.get("type") == "untrack_courier":
+                location_stream.stream.unsubscribe(pid)
                 
     except asyncio.TimeoutError:
         logging.warning(f"WS Timeout: Partner {pid} silently disconnected.")
         if pid: 
-            manager.disconnect_partner(pid)
+            drop_partner_ws(pid, websocket)
         try: 
             await websocket.close() 
         except Exception: 
@@ -2677,7 +2688,42 @@ async def websocket_partner_endpoint(websocket: WebSocket):
     except Exception as e: 
         logging.error(f"Partner WS Disconnected: {e}")
         if pid: 
-            manager.disconnect_partner(pid)
+            drop_partner_ws(pid, websocket)
+
+def drop_partner_ws(partner_id: int, websocket: WebSocket):
+    # Підписку на трекінг знімаємо лише якщо відключається поточний сокет
+    if manager.disconnect_partner(partner_id, websocket):
+        location_stream.stream.unsubscribe(partner_id)
+
+async def start_partner_tracking(partner_id: int, job_id):
+    """
+    Підписка закладу на позицію кур'єра замовлення (замість опитування track_courier).
+    БД читається один раз при підписці; далі позиції йдуть з location_stream.
+    """
+    try:
+        job_id = int(job_id)
+    except (TypeError, ValueError):
+        return
+    async with async_session_maker() as db:
+        job = await db.get(DeliveryJob, job_id)
+        if not job or job.partner_id != partner_id:
+            await manager.notify_partner(partner_id, {"type": "courier_track", "job_id": job_id, "status": "error"})
+            return
+        if job.status in location_stream.TRACK_FINAL_STATUSES:
+            await manager.notify_partner(partner_id, {"type": "courier_track", "job_id": job_id, "status": "finished"})
+            return
+        courier = await db.get(Courier, job.courier_id) if job.courier_id else None
+        if not courier:
+            await manager.notify_partner(partner_id, {"type": "courier_track", "job_id": job_id, "status": "waiting"})
+            return
+
+    location_stream.stream.subscribe(partner_id, job_id, courier.id)
+    lat, lon, _ = presence.registry.position(courier.id)
+    await manager.notify_partner(partner_id, {
+        "type": "courier_track", "job_id": job_id, "status": "ok",
+        "lat": lat if lat is not None else courier.lat, "lon": lon if lon is not None else courier.lon,
+        "name": courier.name, "phone": courier.phone, "job_status": job.status
+    })
 
 async def send_tg_notification(name, phone, plan, result_data):
     if not TG_BOT_TOKEN or not TG_CHAT_ID: return
@@ -0,0 +1,129 @@
+from typing import List, Optional, Sequence, Tuple
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # Опціональна залежність: без неї -- власна реалізація угорського алгоритму
+    linear_sum_assignment = None
+
+# ==============================================================================
+# ЗАДАЧА ПРИЗНАЧЕННЯ (замовлення x кур'єри)
+# ==============================================================================
+# Матриця вартостей: рядок -- замовлення, стовпець -- кур'єр, значення в хвилинах.
+# Неприпустима пара (далеко, кур'єр відмовився) -- None; такі пари ніколи не призначаються.
+# Угорський алгоритм дає мінімальну сумарну вартість, жадібний -- швидкий наближений варіант
+# для великих матриць.
+
+SPEED_KMH = 20.0
+# Скільки хвилин "коштує" хвилина очікування замовлення (чим старше замовлення, тим раніше воно отримає кур'єра)
+AGE_WEIGHT = 0.5
+
+# Вартість для неприпустимих пар усередині розв'язувача (далі відкидаються)
+_BLOCKED = 1e9
+
+
+def pickup_cost(distance_km: Optional[float], ready_in_min: float = 0.0, age_min: float = 0.0,
+                speed_kmh: float = SPEED_KMH, age_weight: float = AGE_WEIGHT) -> Optional[float]:
+    """
+    Хвилини до моменту, коли кур'єр забере замовлення: дорога до закладу + очікування готовності,
+    плюс хвилини, які готове замовлення простоїть до приходу кур'єра. Вік замовлення зменшує вартість.
+    """
+    if distance_km is None:
+        return None
+    travel = distance_km / speed_kmh * 60
+    courier_wait = max(0.0, ready_in_min - travel)
+    food_wait = max(0.0, travel - max(ready_in_min, 0.0))
+    return travel + courier_wait + food_wait - age_weight * age_min
+
+
+def greedy(costs: Sequence[Sequence[Optional[float]]]) -> List[Tuple[int, int]]:
+    """Найдешевші пари по черзі, поки є вільні рядки і стовпці."""
+    pairs = sorted(
+        (cost, i, j) for i, row in enumerate(costs) for j, cost in enumerate(row) if cost is not None
+    )
+    used_rows, used_cols, result = set(), set(), []
+    for _, i, j in pairs:
+        if i in used_rows or j in used_cols:
+            continue
+        used_rows.add(i)
+        used_cols.add(j)
+        result.append((i, j))
+    return result
+
+
+def _hungarian(matrix: List[List[float]]) -> List[int]:
+    """
+    Мінімальне призначення для n <= m (потенціали + найкоротші доповнювальні шляхи, O(n^2 m)).
+    Повертає для кожного рядка номер стовпця.
+    """
+    n, m = len(matrix), len(matrix[0])
+    inf = float("inf")
+    u, v = [0.0] * (n + 1), [0.0] * (m + 1)
+    match = [0] * (m + 1)  # match[j] -- рядок (з 1), за яким закріплено стовпець j
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        match[0] = i
+        j0 = 0
+        min_v = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = match[j0]
+            row = matrix[i0 - 1]
+            u_i0 = u[i0]
+            delta, j1 = inf, 0
+            for j in range(1, m + 1):
+                if used[j]:
+                    continue
+                cur = row[j - 1] - u_i0 - v[j]
+                if cur < min_v[j]:
+                    min_v[j] = cur
+                    way[j] = j0
+                if min_v[j] < delta:
+                    delta, j1 = min_v[j], j
+            for j in range(m + 1):
+                if used[j]:
+                    u[match[j]] += delta
+                    v[j] -= delta
+                else:
+                    min_v[j] -= delta
+            j0 = j1
+            if match[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+    result = [0] * n
+    for j in range(1, m + 1):
+        if match[j]:
+            result[match[j] - 1] = j - 1
+    return result
+
+
+def hungarian(costs: Sequence[Sequence[Optional[float]]]) -> List[Tuple[int, int]]:
+    """Оптимальне призначення (мінімальна сума) для прямокутної матриці; пари з None не повертаються."""
+    if not costs or not costs[0]:
+        return []
+    n, m = len(costs), len(costs[0])
+    transposed = n > m
+    matrix = [[_BLOCKED if c is None else c for c in row] for row in costs]
+    if transposed:
+        matrix = [list(col) for col in zip(*matrix)]
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(matrix)
+        pairs = list(zip(rows.tolist(), cols.tolist()))
+    else:
+        pairs = list(enumerate(_hungarian(matrix)))
+    if transposed:
+        pairs = [(j, i) for i, j in pairs]
+    return sorted((i, j) for i, j in pairs if costs[i][j] is not None)
+
+
+def solve(costs: Sequence[Sequence[Optional[float]]], solver: str = "hungarian",
+          max_cells: int = 40000) -> List[Tuple[int, int]]:
+    """[(рядок, стовпець)]. Угорський алгоритм, якщо матриця не більша за max_cells, інакше жадібний."""
+    if not costs or not costs[0]:
+        return []
+    if solver == "greedy" or len(costs) * len(costs[0]) > max_cells:
+        return greedy(costs)
+    return hungarian(costs)
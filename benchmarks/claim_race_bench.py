@@ -0,0 +1,117 @@
+"""
+Бенчмарк прийняття замовлення: 200 кур'єрів одночасно тиснуть "Прийняти" на одне замовлення.
+
+    DATABASE_URL=postgresql+asyncpg://... python benchmarks/claim_race_bench.py [кур'єрів] [раундів] [мс_перевірок]
+
+Два варіанти:
+  locked      -- як було: SELECT ... FOR UPDATE, перевірки під блокуванням (тут -- пауза мс_перевірок,
+                 що імітує завантаження закладу / мережевий запит), потім UPDATE;
+  conditional -- перевірки до запису, потім один UPDATE ... WHERE status='pending' RETURNING (order_claim).
+Рахуються переможці (має бути рівно 1), час до відповіді кожному кур'єру (p50/p99) і до останньої відповіді.
+Без DATABASE_URL -- тимчасова SQLite; вона не підтримує FOR UPDATE, тож у варіанті locked
+переможців може бути кілька (саме ту гонку блокування і закривало). Реалістичні цифри -- на PostgreSQL.
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.gettempdir()}/claim_race_bench.db")
+
+from sqlalchemy import select, delete
+
+import order_board
+import order_claim
+from models import Courier, DeliveryPartner, DeliveryJob, async_session_maker, create_db_tables, engine
+
+PARTNER_ID = 900001
+COURIER_BASE = 900000
+
+
+async def setup(n_couriers: int):
+    await create_db_tables()
+    async with async_session_maker() as db:
+        await db.execute(delete(DeliveryJob).where(DeliveryJob.partner_id == PARTNER_ID))
+        await db.execute(delete(Courier).where(Courier.id > COURIER_BASE, Courier.id <= COURIER_BASE + n_couriers))
+        await db.execute(delete(DeliveryPartner).where(DeliveryPartner.id == PARTNER_ID))
+        db.add(DeliveryPartner(id=PARTNER_ID, name="Bench", email="bench@claim.race", phone="0", address="-",
+                               hashed_password="-", lat=46.48, lon=30.73))
+        db.add_all([Courier(id=COURIER_BASE + i, name=f"bench{i}", phone=f"+bench{i}", hashed_password="-")
+                    for i in range(1, n_couriers + 1)])
+        await db.commit()
+
+
+async def new_job() -> int:
+    async with async_session_maker() as db:
+        job = DeliveryJob(partner_id=PARTNER_ID, customer_phone="0", dropoff_address="-", status="pending")
+        db.add(job)
+        await db.commit()
+        return job.id
+
+
+async def claim_locked(job_id: int, courier_id: int, check_s: float) -> bool:
+    async with async_session_maker() as db:
+        job = (await db.execute(select(DeliveryJob).where(DeliveryJob.id == job_id).with_for_update())).scalar_one()
+        if job.status != "pending":
+            await db.rollback()
+            return False
+        await db.get(DeliveryPartner, job.partner_id)
+        await asyncio.sleep(check_s)
+        job.status = "assigned"
+        job.courier_id = courier_id
+        await db.commit()
+        return True
+
+
+async def claim_conditional(job_id: int, courier_id: int, check_s: float) -> bool:
+    await asyncio.sleep(check_s)
+    async with async_session_maker() as db:
+        return await order_claim.claim_job(db, job_id, courier_id) is not None
+
+
+async def race(claim, n_couriers: int, rounds: int, check_s: float):
+    latencies, winners, walls = [], [], []
+    for _ in range(rounds):
+        job_id = await new_job()
+        start = time.perf_counter()
+
+        async def one(courier_id):
+            try:
+                won = await claim(job_id, courier_id, check_s)
+            except Exception:
+                won = False
+            latencies.append(time.perf_counter() - start)
+            return won
+
+        results = await asyncio.gather(*(one(COURIER_BASE + i) for i in range(1, n_couriers + 1)))
+        walls.append(time.perf_counter() - start)
+        winners.append(sum(results))
+    latencies.sort()
+    return {
+        "winners": f"{min(winners)}..{max(winners)}",
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "last_ms": sum(walls) / len(walls) * 1000,
+    }
+
+
+async def main():
+    n_couriers = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    check_s = (float(sys.argv[3]) if len(sys.argv) > 3 else 20) / 1000
+    # Дошка відкритих замовлень тут не потрібна -- без фонових оновлень після кожного UPDATE
+    order_board.board.job_changed = lambda job_id: None
+
+    await setup(n_couriers)
+    print(f"{n_couriers} couriers x {rounds} rounds, checks {check_s * 1000:.0f} ms, {engine.dialect.name}\n")
+    print(f"{'':<14}{'winners':>9}{'p50 ms':>10}{'p99 ms':>10}{'last ms':>10}")
+    for name, claim in (("locked", claim_locked), ("conditional", claim_conditional)):
+        r = await race(claim, n_couriers, rounds, check_s)
+        print(f"{name:<14}{r['winners']:>9}{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['last_ms']:>10.1f}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
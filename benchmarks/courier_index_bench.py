@@ -0,0 +1,86 @@
+"""
+Бенчмарк просторового індексу кур'єрів (courier_index.CourierGrid).
+
+    python benchmarks/courier_index_bench.py
+
+Порівнює запит "вільні кур'єри в радіусі R км від закладу, найближчі першими"
+через сітку з лінійним переглядом усіх кур'єрів на зміні (як раніше у broadcast_order_to_all)
+для 100 / 1k / 10k кур'єрів, розкиданих по Одесі та передмістю. Результати звіряються.
+"""
+import os
+import sys
+import random
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from courier_index import CourierGrid
+from geo_distance import haversine_km
+
+# Прямокутник ~50x40 км навколо Одеси
+LAT_RANGE = (46.25, 46.70)
+LON_RANGE = (30.45, 30.95)
+SIZES = [100, 1000, 10000]
+RADII = [3, 20]
+
+
+def make_couriers(n: int, rnd: random.Random):
+    now = datetime.utcnow()
+    return [(i, rnd.uniform(*LAT_RANGE), rnd.uniform(*LON_RANGE), now) for i in range(1, n + 1)]
+
+
+def linear_scan(couriers, busy, lat, lon, radius_km):
+    found = []
+    for courier_id, c_lat, c_lon, _ in couriers:
+        if courier_id in busy:
+            continue
+        dist = haversine_km(c_lat, c_lon, lat, lon)
+        if dist <= radius_km:
+            found.append((dist, courier_id))
+    found.sort()
+    return [(courier_id, round(dist, 2)) for dist, courier_id in found]
+
+
+def main():
+    rnd = random.Random(42)
+    restaurants = [(rnd.uniform(46.40, 46.52), rnd.uniform(30.65, 30.78)) for _ in range(200)]
+
+    print(f"{'couriers':>9}{'radius km':>11}{'avg hits':>10}{'scan us':>10}{'grid us':>10}{'grid top5 us':>14}{'speedup':>9}")
+    for n in SIZES:
+        couriers = make_couriers(n, rnd)
+        busy = {c[0] for c in couriers if rnd.random() < 0.3}
+        grid = CourierGrid()
+        for courier_id, lat, lon, at in couriers:
+            grid.update(courier_id, lat, lon, at)
+
+        for radius in RADII:
+            hits = 0
+            for lat, lon in restaurants:
+                expected = linear_scan(couriers, busy, lat, lon, radius)
+                got = grid.within(lat, lon, radius, exclude=busy)
+                assert [c for c, _ in got] == [c for c, _ in expected], "grid result differs from linear scan"
+                top = grid.within(lat, lon, radius, limit=5, exclude=busy)
+                assert [c for c, _ in top] == [c for c, _ in expected[:5]], "grid top-5 differs from linear scan"
+                hits += len(got)
+
+            t_scan = min(timeit.repeat(
+                lambda: [linear_scan(couriers, busy, lat, lon, radius) for lat, lon in restaurants], number=1, repeat=3))
+            t_grid = min(timeit.repeat(
+                lambda: [grid.within(lat, lon, radius, exclude=busy) for lat, lon in restaurants], number=1, repeat=3))
+            t_top = min(timeit.repeat(
+                lambda: [grid.within(lat, lon, radius, limit=5, exclude=busy) for lat, lon in restaurants], number=1, repeat=3))
+            q = len(restaurants)
+            print(f"{n:>9}{radius:>11}{hits / q:>10.0f}{t_scan / q * 1e6:>10.0f}{t_grid / q * 1e6:>10.0f}"
+                  f"{t_top / q * 1e6:>14.0f}{t_scan / t_grid:>8.1f}x")
+
+    # Вартість оновлення позиції (гарячий шлях прийому локації)
+    grid = CourierGrid()
+    moves = [(rnd.randint(1, 10000), rnd.uniform(*LAT_RANGE), rnd.uniform(*LON_RANGE)) for _ in range(100000)]
+    now = datetime.utcnow()
+    t_upd = min(timeit.repeat(lambda: [grid.update(c, lat, lon, now) for c, lat, lon in moves], number=1, repeat=3))
+    print(f"\nupdate: {t_upd / len(moves) * 1e6:.2f} us/position")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Симуляція диспетчеризації: розсилка всім (broadcast) проти пакетних раундів (dispatch_optimizer).
+
+    python benchmarks/dispatch_sim_bench.py [кур'єрів] [замовлень_на_годину] [годин]
+
+Місто ~16x16 км, 40 закладів, однаковий потік замовлень для обох режимів, крок 5 с.
+broadcast -- кожне замовлення отримують усі вільні кур'єри в радіусі, забирає той, хто першим
+натисне (без урахування відстані); через 5 хв "гаряча" розсилка всім на зміні.
+batch -- кожні DISPATCH_BATCH_SECONDS задача призначення (assignment.solve) і персональна
+пропозиція; відмова/мовчання -- наступний раунд без цього кур'єра; через DISPATCH_FALLBACK_SECONDS
+без кур'єра -- розсилка всім, як у broadcast.
+Рахуються повідомлення на замовлення, відстань кур'єра до закладу, час до призначення та час,
+який готова їжа чекає на кур'єра, і тривалість одного раунду розв'язувача.
+"""
+import os
+import sys
+import time
+import random
+from statistics import mean
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import assignment
+from geo_distance import haversine_km
+
+STEP_S = 5
+RADIUS_KM = 20
+CANDIDATES = 8
+OFFER_S = 30
+FALLBACK_S = 120
+HOT_BLAST_S = 300
+# Кур'єр погоджується на конкретне замовлення з такою ймовірністю; реакція ~ 25 с
+P_WILLING = 0.8
+REACTION_S = 25
+SPEED_KMH = assignment.SPEED_KMH
+
+
+def make_world(n_couriers, per_hour, hours, seed=7):
+    rnd = random.Random(seed)
+    restaurants = [(46.40 + rnd.random() * 0.15, 30.62 + rnd.random() * 0.2) for _ in range(40)]
+    couriers = [(46.40 + rnd.random() * 0.15, 30.62 + rnd.random() * 0.2) for _ in range(n_couriers)]
+    orders, t = [], 0.0
+    while True:
+        t += rnd.expovariate(per_hour / 3600)
+        if t > hours * 3600:
+            break
+        r_lat, r_lon = rnd.choice(restaurants)
+        orders.append({
+            "created": t, "ready": t + rnd.uniform(8, 20) * 60, "rest": (r_lat, r_lon),
+            "drop": (r_lat + rnd.uniform(-0.03, 0.03), r_lon + rnd.uniform(-0.04, 0.04)),
+        })
+    return couriers, orders
+
+
+class Sim:
+    def __init__(self, couriers, orders, mode, seed=11):
+        self.rnd = random.Random(seed)
+        self.mode = mode
+        self.pos = list(couriers)
+        self.free_at = [0.0] * len(couriers)
+        self.orders = [dict(o, assigned=None, pickup_km=None, notified=0, offer=None, declined=set(),
+                            broadcast=False, hot=False) for o in orders]
+        self.solve_ms = []
+
+    def free(self, now):
+        return [c for c, t in enumerate(self.free_at) if t <= now]
+
+    def dist(self, c, o):
+        return haversine_km(*self.pos[c], *o["rest"])
+
+    def assign(self, o, c, now):
+        km = self.dist(c, o)
+        o["assigned"], o["pickup_km"], o["offer"] = now, km, None
+        arrive = now + km / SPEED_KMH * 3600
+        o["food_wait"] = max(0.0, arrive - o["ready"]) / 60
+        leave = max(arrive, o["ready"])
+        self.free_at[c] = leave + haversine_km(*o["rest"], *o["drop"]) / SPEED_KMH * 3600
+        self.pos[c] = o["drop"]
+
+    def broadcast(self, o, now, everyone=False):
+        o["broadcast"] = True
+        targets = [c for c in self.free(now) if everyone or self.dist(c, o) <= RADIUS_KM]
+        o["notified"] += len(targets) if not everyone else len(self.pos)
+
+    def race(self, pending, now):
+        """Розіслані замовлення: хто з вільних першим натиснув, той і забрав."""
+        p_tick = P_WILLING * STEP_S / REACTION_S
+        taken = set()
+        for o in pending:
+            if not o["broadcast"] or o["assigned"] is not None:
+                continue
+            takers = [c for c in self.free(now) if c not in taken and self.dist(c, o) <= RADIUS_KM
+                      and self.rnd.random() < p_tick]
+            if takers:
+                c = self.rnd.choice(takers)
+                taken.add(c)
+                self.assign(o, c, now)
+
+    def batch_round(self, pending, now):
+        offered = {o["offer"][0] for o in pending if o["offer"]}
+        free = [c for c in self.free(now) if c not in offered]
+        open_orders = [o for o in pending if o["offer"] is None]
+        columns, rows = {}, []
+        for o in open_orders:
+            near = sorted((self.dist(c, o), c) for c in free if c not in o["declined"])
+            near = [(c, d) for d, c in near if d <= RADIUS_KM][:CANDIDATES]
+            rows.append(near)
+            for c, _ in near:
+                columns.setdefault(c, len(columns))
+        ids = list(columns)
+        costs = []
+        for o, near in zip(open_orders, rows):
+            row = [None] * len(ids)
+            for c, d in near:
+                row[columns[c]] = assignment.pickup_cost(d, (o["ready"] - now) / 60, (now - o["created"]) / 60)
+            costs.append(row)
+        t = time.perf_counter()
+        pairs = assignment.solve(costs) if ids else []
+        self.solve_ms.append((time.perf_counter() - t) * 1000)
+        for i, j in pairs:
+            o, c = open_orders[i], ids[j]
+            o["notified"] += 1
+            willing = self.rnd.random() < P_WILLING
+            answer = now + self.rnd.expovariate(1 / REACTION_S)
+            o["offer"] = (c, answer if answer < now + OFFER_S else now + OFFER_S, willing and answer < now + OFFER_S)
+
+    def run(self):
+        end = max(o["created"] for o in self.orders) + 3600
+        now = 0.0
+        while now < end:
+            pending = [o for o in self.orders if o["created"] <= now and o["assigned"] is None]
+            for o in pending:
+                age = now - o["created"]
+                if self.mode == "broadcast" and not o["broadcast"]:
+                    self.broadcast(o, now)
+                if age >= HOT_BLAST_S and not o["hot"]:
+                    o["hot"] = True
+                    self.broadcast(o, now, everyone=True)
+                if self.mode == "batch" and o["offer"] and o["offer"][1] <= now:
+                    c, _, accepted = o["offer"]
+                    if accepted and self.free_at[c] <= now:
+                        self.assign(o, c, now)
+                    else:
+                        o["offer"] = None
+                        o["declined"].add(c)
+                if self.mode == "batch" and age >= FALLBACK_S and not o["broadcast"] and o["offer"] is None:
+                    self.broadcast(o, now)
+            pending = [o for o in pending if o["assigned"] is None]
+            if self.mode == "batch":
+                self.batch_round(pending, now)
+            self.race(pending, now)
+            now += STEP_S
+        done = [o for o in self.orders if o["assigned"] is not None]
+        return {
+            "orders": len(self.orders),
+            "assigned": len(done),
+            "notifications/order": mean(o["notified"] for o in self.orders),
+            "pickup km (mean)": mean(o["pickup_km"] for o in done),
+            "pickup km (p90)": sorted(o["pickup_km"] for o in done)[int(len(done) * 0.9)],
+            "time to courier, min": mean((o["assigned"] - o["created"]) / 60 for o in done),
+            "food waits, min": mean(o["food_wait"] for o in done),
+            "round ms (max)": max(self.solve_ms) if self.solve_ms else 0.0,
+        }
+
+
+def main():
+    n_couriers = int(sys.argv[1]) if len(sys.argv) > 1 else 120
+    per_hour = float(sys.argv[2]) if len(sys.argv) > 2 else 150
+    hours = float(sys.argv[3]) if len(sys.argv) > 3 else 3
+    couriers, orders = make_world(n_couriers, per_hour, hours)
+    print(f"{n_couriers} couriers, {len(orders)} orders over {hours:g}h "
+          f"(solver: {'scipy' if assignment.linear_sum_assignment else 'pure python'})\n")
+    results = {mode: Sim(couriers, orders, mode).run() for mode in ("broadcast", "batch")}
+    print(f"{'':<24}{'broadcast':>12}{'batch':>12}")
+    for key in results["broadcast"]:
+        b, o = results["broadcast"][key], results["batch"][key]
+        fmt = "{:>12.0f}" if isinstance(b, int) else "{:>12.2f}"
+        print(f"{key:<24}" + fmt.format(b) + fmt.format(o))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Бенчмарк локального газетиру (gazetteer.Gazetteer).
+
+    python benchmarks/gazetteer_bench.py [кількість_вулиць]
+
+Будує синтетичний газетир розміру міста (вулиці x ~60 будинків), міряє час завантаження,
+пам'ять індексу та час одного пошуку: точний збіг, рос. написання, одруківка (нечіткий збіг,
+перший і повторний раз), відсутній номер будинку та промах (далі пішов би запит до Nominatim).
+"""
+import os
+import sys
+import time
+import random
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from gazetteer import Gazetteer
+
+ROOTS = ["Дерибас", "Рішельє", "Канат", "Грець", "Пушкін", "Генуез", "Катерин", "Арнаут", "Фонтан", "Садов",
+         "Лермонтов", "Базар", "Троїц", "Успен", "Прохорів", "Спиридонів", "Єврей", "Польськ", "Маразліїв", "Бунін"]
+
+
+def street_names(n: int, rnd: random.Random):
+    names = set()
+    while len(names) < n:
+        root = rnd.choice(ROOTS) + "".join(rnd.choice("аоеиуклмнрст") for _ in range(rnd.randint(2, 4)))
+        names.add(f"{root}ська вулиця")
+    return sorted(names)
+
+
+def main():
+    n_streets = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    rnd = random.Random(42)
+    streets = street_names(n_streets, rnd)
+    rows = []
+    for street in streets:
+        lat, lon = rnd.uniform(46.35, 46.60), rnd.uniform(30.60, 30.80)
+        for number in range(1, rnd.randint(30, 90)):
+            rows.append((street, str(number), lat + number * 1e-5, lon))
+
+    t = time.perf_counter()
+    Gazetteer(rows)
+    load_s = time.perf_counter() - t
+    tracemalloc.start()
+    gazetteer = Gazetteer(rows)
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{gazetteer.addresses} addresses on {n_streets} streets: built in {load_s:.2f}s, "
+          f"{mem / 1024 / 1024:.1f} MB ({mem / gazetteer.addresses:.0f} B/address)\n")
+
+    sample = rnd.sample(streets, 200)
+    exact = [f"вул. {s.replace(' вулиця', '')}, 12, Одеса" for s in sample]
+    russian = [f"ул. {s.replace('ська вулиця', 'ская').replace('і', 'и')}, 14" for s in sample]
+    # Одна пропущена літера в назві -- нечіткий збіг через триграми і відстань редагування
+    typo = [f"{s[:4]}{s[5:]}, 16" for s in sample]
+    gap = [f"{s}, 13а" for s in sample]
+    miss = [f"вул. Неіснуюча{i}, 5" for i in range(200)]
+
+    def per_lookup(addresses, fresh=False):
+        def run():
+            if fresh:
+                gazetteer._fuzzy.clear()
+            for a in addresses:
+                gazetteer.lookup(a)
+        return min(timeit.repeat(run, number=1, repeat=5)) / len(addresses) * 1e6
+
+    found = sum(gazetteer.lookup(a) is not None for a in russian)
+    found_typo = sum(gazetteer.lookup(a) is not None for a in typo)
+    print(f"{'lookup':<38}{'us':>8}")
+    print(f"{'exact street + house':<38}{per_lookup(exact):>8.1f}")
+    print(f"{'russian spelling':<38}{per_lookup(russian):>8.1f}")
+    print(f"{'typo (fuzzy, first time)':<38}{per_lookup(typo, fresh=True):>8.1f}")
+    print(f"{'typo (fuzzy, repeated)':<38}{per_lookup(typo):>8.1f}")
+    print(f"{'missing house (nearest number)':<38}{per_lookup(gap):>8.1f}")
+    print(f"{'unknown street (-> remote)':<38}{per_lookup(miss, fresh=True):>8.1f}")
+    print(f"\nresolved: russian spelling {found}/{len(russian)}, typo {found_typo}/{len(typo)}")
+
+
+if __name__ == "__main__":
+    main()
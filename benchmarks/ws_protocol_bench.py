@@ -0,0 +1,110 @@
+"""
+Бенчмарк протоколів WebSocket: байти на подію та вартість кодування.
+
+    python benchmarks/ws_protocol_bench.py [кількість_подій]
+
+Порівнює JSON (за замовчуванням) та restify.msgpack.v1 (ws_codec), кожен
+без стиснення та з permessage-deflate (із context takeover, як у websockets/uvicorn).
+"""
+import os
+import sys
+import json
+import zlib
+import random
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import ws_codec
+from ws_manager import SharedPayloadEncoder
+
+
+def sample_events(n: int):
+    rnd = random.Random(42)
+    streets = ["вул. Дерибасівська", "просп. Шевченка", "вул. Грецька", "Французький бульвар", "вул. Канатна"]
+    events = []
+    for i in range(n):
+        kind = i % 4
+        address = f"{rnd.choice(streets)}, {rnd.randint(1, 120)}, кв. {rnd.randint(1, 200)}"
+        if kind == 0:
+            base = {"type": "new_order", "data": {
+                "id": 1000 + i, "address": address, "customer_name": "Олександр",
+                "restaurant": "Піцерія «Смачна Одеса»", "restaurant_address": "вул. Рішельєвська, 12",
+                "fee": 95.0, "price": 640.0, "comment": "[💵 Готівка] Подзвонити за 5 хвилин до приїзду",
+                "dist_to_rest": "?", "is_return": False, "payment_type": "cash",
+                "estimated_ready_at": "2026-10-18T12:30:00Z",
+            }}
+            text = SharedPayloadEncoder(base, {"dist_to_rest"}).encode({"dist_to_rest": round(rnd.uniform(0.3, 9), 1)})
+        elif kind == 1:
+            text = json.dumps({"type": "direct_offer", "data": {
+                "id": 1000 + i, "fee": 120.0, "price": 820.0, "estimated_ready_at": None,
+                "payment_type": "prepaid", "is_return": False, "comment": "[✅ Оплачено] Не дзвонити у двері",
+                "dist_to_rest": None, "dist_trip": None,
+                "restaurant_name": "Піцерія «Смачна Одеса»", "restaurant_address": "вул. Рішельєвська, 12",
+                "dropoff_address": address, "restaurant": "Піцерія «Смачна Одеса»", "address": address,
+            }}, ensure_ascii=False)
+        elif kind == 2:
+            text = json.dumps({
+                "type": "order_update", "job_id": 1000 + i, "status": "picked_up",
+                "message": f"🚀 Кур'єр забрав замовлення #{1000 + i}", "status_text": "Кур'єр в дорозі",
+                "status_color": "#3b82f6", "courier_name": "Андрій",
+            }, ensure_ascii=False)
+        else:
+            text = json.dumps({
+                "type": "chat_message", "job_id": 1000 + i, "role": "partner",
+                "text": "Замовлення буде готове через 10 хвилин", "time": "12:20",
+            }, ensure_ascii=False)
+        events.append(f'{{"seq": {i + 1}, {text[1:]}')
+    return events
+
+
+def deflate_sizes(frames, takeover: bool):
+    """Розмір кадрів після permessage-deflate (raw deflate, SYNC_FLUSH без хвоста 00 00 ff ff)."""
+    total = 0
+    comp = zlib.compressobj(wbits=-15)
+    for frame in frames:
+        data = frame.encode("utf-8") if isinstance(frame, str) else frame
+        if not takeover:
+            comp = zlib.compressobj(wbits=-15)
+        out = comp.compress(data) + comp.flush(zlib.Z_SYNC_FLUSH)
+        total += len(out) - 4
+    return total
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    events = sample_events(n)
+    if not ws_codec.msgpack_available():
+        print("msgpack не встановлено: pip install msgpack")
+        return
+
+    json_frames = [e.encode("utf-8") for e in events]
+    mp_frames = [ws_codec.encode_frame(e) for e in events]
+    assert all(ws_codec.unpack(f) == ws_codec._expand(json.loads(e)) for f, e in zip(mp_frames[:50], events[:50]))
+
+    rows = [
+        ("json", sum(map(len, json_frames))),
+        ("json + deflate (no takeover)", deflate_sizes(json_frames, False)),
+        ("json + deflate", deflate_sizes(json_frames, True)),
+        ("msgpack", sum(map(len, mp_frames))),
+        ("msgpack + deflate (no takeover)", deflate_sizes(mp_frames, False)),
+        ("msgpack + deflate", deflate_sizes(mp_frames, True)),
+    ]
+    base = rows[0][1]
+    print(f"{n} events (new_order / direct_offer / order_update / chat_message)\n")
+    print(f"{'protocol':<34}{'bytes/event':>12}{'vs json':>10}")
+    for name, total in rows:
+        print(f"{name:<34}{total / n:>12.1f}{total / base:>10.0%}")
+
+    repeat = 5
+    t_json = min(timeit.repeat(lambda: [e.encode("utf-8") for e in events], number=1, repeat=repeat))
+    t_mp = min(timeit.repeat(lambda: [ws_codec.encode_frame(e) for e in events], number=1, repeat=repeat))
+    t_defl = min(timeit.repeat(lambda: deflate_sizes(json_frames, True), number=1, repeat=repeat))
+    print(f"\n{'encode cost':<34}{'us/event':>12}")
+    print(f"{'json (already serialized text)':<34}{t_json / n * 1e6:>12.2f}")
+    print(f"{'json -> msgpack (ws_codec)':<34}{t_mp / n * 1e6:>12.2f}")
+    print(f"{'deflate (per frame)':<34}{t_defl / n * 1e6:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
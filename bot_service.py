@@ -1,7 +1,13 @@
 import os
+import time
+import heapq
+import asyncio
 import logging
 import secrets
+import itertools
+from typing import Dict, List, Optional, Tuple
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.filters import CommandStart
 from aiogram.types import (
     ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove,
@@ -203,34 +209,236 @@ async def handle_contact(message: types.Message):
 
 # --- Допоміжні функції ---
 
-async def send_telegram_message(chat_id: str, text: str):
-    """
-    Функція для відправки повідомлень із інших частин програми.
-    """
-    if bot and chat_id:
-        # Якщо вже позначено як заблокований, не намагаємось відправляти
-        if str(chat_id).startswith("BLOCKED_"):
+# --- Планувальник відправки в Telegram ---
+# Ліміти Telegram: ~30 повідомлень/с на бота загалом і 1/с в один чат (у групу -- 20/хв).
+# Усі відправки йдуть через одну чергу: спільне відро токенів на TG_GLOBAL_RATE/с, кожен чат --
+# не частіше ніж раз на TG_CHAT_INTERVAL. Першими йдуть персональні пропозиції, потім замовлення
+# і службові повідомлення, останніми -- масові (бонуси, верифікація). На 429 (TelegramRetryAfter)
+# чат чекає retry_after, а повідомлення повертається в чергу. Черга обмежена TG_QUEUE_MAX: коли вона
+# повна, витісняється найменш важливе з найновіших повідомлень.
+
+PRIORITY_OFFER, PRIORITY_ORDER, PRIORITY_BULK = 0, 1, 2
+PRIORITY_NAMES = ("offer", "order", "bulk")
+
+TG_GLOBAL_RATE = float(os.environ.get("TG_GLOBAL_RATE", "25"))
+TG_CHAT_INTERVAL = 1.0
+TG_GROUP_INTERVAL = 3.0
+TG_QUEUE_MAX = int(os.environ.get("TG_QUEUE_MAX", "5000"))
+TG_SEND_CONCURRENCY = 10
+# Скільки разів повідомлення повертається в чергу після 429
+TG_MAX_RETRY_AFTER = 3
+
+
+class TelegramQueueFull(Exception):
+    """Черга відправки переповнена -- повідомлення не прийняте або витіснене важливішим."""
+
+
+class _Outgoing:
+    __slots__ = ("priority", "seq", "chat_id", "text", "future", "queued_at", "retries")
+
+    def __init__(self, priority: int, seq: int, chat_id: str, text: str, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.text = text
+        self.future = future
+        self.queued_at = time.monotonic()
+        self.retries = 0
+
+    def __lt__(self, other: "_Outgoing") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class TelegramScheduler:
+    def __init__(self, rate: float, queue_max: int):
+        self.rate = rate
+        self.queue_max = queue_max
+        self._heap: List[_Outgoing] = []
+        self._seq = itertools.count()
+        self._tokens = rate
+        self._refilled = time.monotonic()
+        # chat_id -> момент (monotonic), коли в чат можна писати знову
+        self._chat_ready: Dict[str, float] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._sending: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self.counters = {name: {"sent": 0, "failed": 0, "dropped": 0, "wait_ms": 0.0} for name in PRIORITY_NAMES}
+        self.retry_after_hits = 0
+
+    async def send(self, chat_id, text: str, priority: int = PRIORITY_ORDER) -> bool:
+        """Ставить повідомлення в чергу і чекає, поки воно піде. Помилка Telegram -- виняток."""
+        self._ensure_running()
+        item = _Outgoing(priority, next(self._seq), str(chat_id), text, asyncio.get_running_loop().create_future())
+        if len(self._heap) >= self.queue_max:
+            worst = max(self._heap)
+            if not item < worst:
+                self.counters[PRIORITY_NAMES[priority]]["dropped"] += 1
+                raise TelegramQueueFull(f"queue full ({len(self._heap)})")
+            self._heap.remove(worst)
+            heapq.heapify(self._heap)
+            self._drop(worst)
+        heapq.heappush(self._heap, item)
+        self._wake.set()
+        return await item.future
+
+    def _drop(self, item: _Outgoing):
+        self.counters[PRIORITY_NAMES[item.priority]]["dropped"] += 1
+        if not item.future.done():
+            item.future.set_exception(TelegramQueueFull("pushed out by a higher priority message"))
+
+    def _ensure_running(self):
+        if self._task and not self._task.done():
             return
-            
+        self._wake = asyncio.Event()
+        self._sending = asyncio.Semaphore(TG_SEND_CONCURRENCY)
+        self._task = asyncio.create_task(self._run())
+
+    def _interval(self, chat_id: str) -> float:
+        # Від'ємні id -- групи і канали (адмінський чат)
+        return TG_GROUP_INTERVAL if chat_id.startswith("-") else TG_CHAT_INTERVAL
+
+    async def _run(self):
+        while True:
+            try:
+                await self._acquire_token()
+                item, wait = self._next_ready()
+                if item is None:
+                    self._tokens += 1
+                    self._wake.clear()
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                self._chat_ready[item.chat_id] = time.monotonic() + self._interval(item.chat_id)
+                await self._sending.acquire()
+                asyncio.create_task(self._deliver(item))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Telegram scheduler error: {e}")
+                await asyncio.sleep(1)
+
+    async def _acquire_token(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def _next_ready(self) -> Tuple[Optional[_Outgoing], Optional[float]]:
+        """Найважливіше повідомлення, чий чат уже можна; інакше -- скільки чекати до найближчого."""
+        now = time.monotonic()
+        deferred, chosen = [], None
+        while self._heap:
+            item = heapq.heappop(self._heap)
+            if item.future.done():  # відправник скасований або витіснений
+                continue
+            if self._chat_ready.get(item.chat_id, 0.0) <= now:
+                chosen = item
+                break
+            deferred.append(item)
+        for item in deferred:
+            heapq.heappush(self._heap, item)
+        if len(self._chat_ready) > 10000:
+            self._chat_ready = {c: t for c, t in self._chat_ready.items() if t > now}
+        wait = min((self._chat_ready[i.chat_id] - now for i in deferred), default=None)
+        return chosen, wait
+
+    async def _deliver(self, item: _Outgoing):
+        counters = self.counters[PRIORITY_NAMES[item.priority]]
         try:
-            await bot.send_message(chat_id, text, parse_mode="HTML")
+            await bot.send_message(item.chat_id, item.text, parse_mode="HTML")
+        except TelegramRetryAfter as e:
+            self.retry_after_hits += 1
+            self._chat_ready[item.chat_id] = time.monotonic() + e.retry_after
+            # 429 зазвичай означає загальне перевищення -- пригальмовуємо й решту на ~1 с
+            self._tokens = min(self._tokens, 0.0) - self.rate
+            if item.retries < TG_MAX_RETRY_AFTER and not item.future.done():
+                item.retries += 1
+                heapq.heappush(self._heap, item)
+                self._wake.set()
+            else:
+                counters["failed"] += 1
+                if not item.future.done():
+                    item.future.set_exception(e)
         except Exception as e:
-            err_msg = str(e)
-            logging.error(f"Помилка відправки в Telegram ({chat_id}): {err_msg}")
-            
-            # Якщо користувач заблокував бота — помічаємо це в базі даних
-            if "bot was blocked" in err_msg.lower():
-                try:
-                    async with async_session_maker() as db:
-                        blocked_id = f"BLOCKED_{chat_id}"
-                        # Оновлюємо у кур'єрів
-                        await db.execute(update(Courier).where(Courier.telegram_chat_id == str(chat_id)).values(telegram_chat_id=blocked_id))
-                        # Оновлюємо у закладів (на всякий випадок)
-                        await db.execute(update(DeliveryPartner).where(DeliveryPartner.telegram_chat_id == str(chat_id)).values(telegram_chat_id=blocked_id))
-                        await db.commit()
-                        logging.info(f"Статус Telegram для {chat_id} змінено на 'Заблокований' у БД.")
-                except Exception as db_err:
-                    logging.error(f"Помилка оновлення статусу блокування в БД: {db_err}")
+            counters["failed"] += 1
+            if not item.future.done():
+                item.future.set_exception(e)
+        else:
+            counters["sent"] += 1
+            counters["wait_ms"] += (time.monotonic() - item.queued_at) * 1000
+            if not item.future.done():
+                item.future.set_result(True)
+        finally:
+            self._sending.release()
+
+    def stats(self) -> dict:
+        queued = {name: 0 for name in PRIORITY_NAMES}
+        for item in self._heap:
+            queued[PRIORITY_NAMES[item.priority]] += 1
+        return {
+            "rate_per_s": self.rate,
+            "queue_max": self.queue_max,
+            "queued": queued,
+            "retry_after": self.retry_after_hits,
+            "by_priority": {
+                name: {
+                    "sent": c["sent"], "failed": c["failed"], "dropped": c["dropped"],
+                    "avg_wait_ms": round(c["wait_ms"] / c["sent"], 1) if c["sent"] else 0.0,
+                }
+                for name, c in self.counters.items()
+            },
+        }
+
+
+scheduler = TelegramScheduler(TG_GLOBAL_RATE, TG_QUEUE_MAX)
+
+async def deliver_telegram_message(chat_id: str, text: str, priority: int = PRIORITY_ORDER) -> bool:
+    """
+    Відправка з результатом (для черги сповіщень): True -- відправлено, False -- адресат недосяжний
+    (бота немає, користувач заблокував бота). Інші помилки (мережа, ліміти, переповнена черга) -- виняток,
+    щоб повторити пізніше.
+    """
+    if not bot or not chat_id:
+        return False
+    # Якщо вже позначено як заблокований, не намагаємось відправляти
+    if str(chat_id).startswith("BLOCKED_"):
+        return False
+    try:
+        await scheduler.send(chat_id, text, priority)
+        return True
+    except Exception as e:
+        # Якщо користувач заблокував бота — помічаємо це в базі даних
+        if "bot was blocked" not in str(e).lower():
+            raise
+        logging.error(f"Помилка відправки в Telegram ({chat_id}): {e}")
+        try:
+            async with async_session_maker() as db:
+                blocked_id = f"BLOCKED_{chat_id}"
+                # Оновлюємо у кур'єрів
+                await db.execute(update(Courier).where(Courier.telegram_chat_id == str(chat_id)).values(telegram_chat_id=blocked_id))
+                # Оновлюємо у закладів (на всякий випадок)
+                await db.execute(update(DeliveryPartner).where(DeliveryPartner.telegram_chat_id == str(chat_id)).values(telegram_chat_id=blocked_id))
+                await db.commit()
+                logging.info(f"Статус Telegram для {chat_id} змінено на 'Заблокований' у БД.")
+        except Exception as db_err:
+            logging.error(f"Помилка оновлення статусу блокування в БД: {db_err}")
+        return False
+
+async def send_telegram_message(chat_id: str, text: str, priority: int = PRIORITY_ORDER):
+    """
+    Функція для відправки повідомлень із інших частин програми.
+    priority: PRIORITY_OFFER (персональні пропозиції), PRIORITY_ORDER, PRIORITY_BULK (бонуси, масові).
+    """
+    try:
+        await deliver_telegram_message(chat_id, text, priority)
+    except Exception as e:
+        logging.error(f"Помилка відправки в Telegram ({chat_id}): {e}")
 
 async def start_bot():
     """Запуск поллінгу бота"""
@@ -0,0 +1,155 @@
+from math import radians, cos, sin, asin, sqrt, floor
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import geo_distance
+
+# Розмір комірки сітки в градусах широти (~2.2 км)
+GRID_CELL_DEG = 0.02
+
+# Позиція старша за цей час вважається невідомою (як у broadcast_order_to_all)
+POSITION_FRESH_SECONDS = 1800
+
+_KM_PER_DEG_LAT = 111.32
+
+
+class CourierGrid:
+    """
+    Просторовий індекс кур'єрів на зміні (рівномірна сітка lat/lon).
+    Запит "хто в радіусі R км, найближчі першими" переглядає лише комірки навколо точки,
+    тому вартість залежить від щільності кур'єрів поруч, а не від їхньої загальної кількості.
+    """
+
+    def __init__(self, cell_deg: float = GRID_CELL_DEG, fresh_seconds: int = POSITION_FRESH_SECONDS):
+        self.cell_deg = cell_deg
+        self.fresh_seconds = fresh_seconds
+        self._cells: Dict[Tuple[int, int], Set[int]] = {}
+        self._points: Dict[int, Tuple[float, float, datetime, Tuple[int, int]]] = {}
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return floor(lat / self.cell_deg), floor(lon / self.cell_deg)
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, courier_id: int):
+        return courier_id in self._points
+
+    # --- Оновлення (з реєстру присутності) ---
+    def update(self, courier_id: int, lat: float, lon: float, at: datetime):
+        cell = self._cell(lat, lon)
+        old = self._points.get(courier_id)
+        if old and old[3] != cell:
+            self._discard_from_cell(courier_id, old[3])
+        self._points[courier_id] = (lat, lon, at, cell)
+        self._cells.setdefault(cell, set()).add(courier_id)
+
+    def remove(self, courier_id: int):
+        old = self._points.pop(courier_id, None)
+        if old:
+            self._discard_from_cell(courier_id, old[3])
+
+    def _discard_from_cell(self, courier_id: int, cell):
+        members = self._cells.get(cell)
+        if members:
+            members.discard(courier_id)
+            if not members:
+                del self._cells[cell]
+
+    # --- Запити ---
+    def is_fresh(self, courier_id: int, now: datetime = None) -> bool:
+        point = self._points.get(courier_id)
+        if not point:
+            return False
+        return (now or datetime.utcnow()) - point[2] <= timedelta(seconds=self.fresh_seconds)
+
+    def fresh_ids(self, now: datetime = None) -> Set[int]:
+        limit = (now or datetime.utcnow()) - timedelta(seconds=self.fresh_seconds)
+        return {courier_id for courier_id, point in self._points.items() if point[2] >= limit}
+
+    def within(self, lat: float, lon: float, radius_km: float, limit: Optional[int] = None,
+               exclude: Iterable[int] = (), now: datetime = None) -> List[Tuple[int, float]]:
+        """
+        [(courier_id, відстань_км)] кур'єрів зі свіжою позицією в радіусі radius_km, найближчі першими.
+        З limit пошук іде кільцями комірок від центру і зупиняється, щойно далі ближчих не буде.
+        """
+        exclude = exclude if isinstance(exclude, (set, frozenset, dict)) else set(exclude)
+        fresh_after = (now or datetime.utcnow()) - timedelta(seconds=self.fresh_seconds)
+        cell_km_lat = self.cell_deg * _KM_PER_DEG_LAT
+        cell_km_lon = cell_km_lat * max(cos(radians(lat)), 0.01)
+        rings_lat = int(radius_km / cell_km_lat) + 1
+        rings_lon = int(radius_km / cell_km_lon) + 1
+        c_lat, c_lon = self._cell(lat, lon)
+
+        r_lat, cos_lat = radians(lat), cos(radians(lat))
+        r_lon = radians(lon)
+        # Поріг на sin²(d/2R) замість asin для кожної точки
+        max_a = sin(radius_km / 6371 / 2) ** 2
+        cells, points = self._cells, self._points
+        found: List[Tuple[float, int]] = []
+
+        def scan(cell):
+            for courier_id in cells.get(cell, ()):
+                if courier_id in exclude:
+                    continue
+                p_lat, p_lon, at, _ = points[courier_id]
+                if at < fresh_after:
+                    continue
+                p_lat, p_lon = radians(p_lat), radians(p_lon)
+                a = sin((p_lat - r_lat) / 2) ** 2 + cos_lat * cos(p_lat) * sin((p_lon - r_lon) / 2) ** 2
+                if a <= max_a:
+                    found.append((a, courier_id))
+
+        if not limit:
+            # Увесь прямокутник комірок: кандидатів збираємо, відстані рахуємо одним пакетом
+            ids, lats, lons = [], [], []
+            for d_lat in range(-rings_lat, rings_lat + 1):
+                for d_lon in range(-rings_lon, rings_lon + 1):
+                    for courier_id in cells.get((c_lat + d_lat, c_lon + d_lon), ()):
+                        if courier_id in exclude:
+                            continue
+                        p_lat, p_lon, at, _ = points[courier_id]
+                        if at >= fresh_after:
+                            ids.append(courier_id)
+                            lats.append(p_lat)
+                            lons.append(p_lon)
+            dists = geo_distance.distances_from(lat, lon, lats, lons)
+            if hasattr(dists, "tolist"):
+                dists = dists.tolist()
+            found = sorted((dist, courier_id) for dist, courier_id in zip(dists, ids) if dist <= radius_km)
+            return [(courier_id, round(dist, 2)) for dist, courier_id in found]
+        else:
+            step_km = min(cell_km_lat, cell_km_lon)
+            for ring in range(max(rings_lat, rings_lon) + 1):
+                for cell in self._ring_cells(c_lat, c_lon, ring, rings_lat, rings_lon):
+                    if cell in cells:
+                        scan(cell)
+                # Точки за межами кільця ring не ближчі за ring * (менша сторона комірки)
+                if len(found) >= limit:
+                    found.sort()
+                    if 2 * asin(sqrt(found[limit - 1][0])) * 6371 <= ring * step_km:
+                        break
+
+        found.sort()
+        if limit:
+            found = found[:limit]
+        return [(courier_id, round(2 * asin(sqrt(a)) * 6371, 2)) for a, courier_id in found]
+
+    @staticmethod
+    def _ring_cells(c_lat: int, c_lon: int, ring: int, max_lat: int, max_lon: int):
+        """Комірки на периметрі квадрата ring навколо центру (обрізані до max_lat/max_lon)."""
+        if ring == 0:
+            yield c_lat, c_lon
+            return
+        lon_lo, lon_hi = -min(ring, max_lon), min(ring, max_lon)
+        if ring <= max_lat:
+            for d_lon in range(lon_lo, lon_hi + 1):
+                yield c_lat - ring, c_lon + d_lon
+                yield c_lat + ring, c_lon + d_lon
+        if ring <= max_lon:
+            for d_lat in range(-min(ring - 1, max_lat), min(ring - 1, max_lat) + 1):
+                yield c_lat + d_lat, c_lon - ring
+                yield c_lat + d_lat, c_lon + ring
+
+    def stats(self) -> dict:
+        return {"indexed": len(self._points), "cells": len(self._cells), "cell_deg": self.cell_deg}
@@ -0,0 +1,229 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Set, Tuple
+
+from sqlalchemy import select, update, exists
+from sqlalchemy.orm import aliased, joinedload
+
+import assignment
+import presence
+import order_board
+from models import DeliveryJob, async_session_maker
+
+# ==============================================================================
+# ПАКЕТНИЙ ДИСПЕТЧЕР (DISPATCH_MODE=batch)
+# ==============================================================================
+# Замість розсилки кожного замовлення всім кур'єрам: кожні DISPATCH_BATCH_SECONDS розв'язується
+# задача призначення "відкриті замовлення x вільні кур'єри поруч" (вартість -- хвилини до того,
+# як замовлення заберуть, див. assignment.pickup_cost), і кожен обраний кур'єр отримує персональну
+# пропозицію (target_courier_id + direct_offer). Не відповів за DISPATCH_OFFER_SECONDS або відмовився --
+# замовлення повертається в наступний раунд без цього кур'єра. Якщо кур'єра не знайшлося
+# за DISPATCH_FALLBACK_SECONDS, замовлення один раз розсилається всім, як у режимі broadcast.
+# Пропозиції робляться умовним UPDATE, тому раунди в кількох воркерах не видадуть одне замовлення
+# двом кур'єрам і двох пропозицій одному кур'єру.
+
+DISPATCH_MODE = os.environ.get("DISPATCH_MODE", "broadcast")
+DISPATCH_BATCH_SECONDS = float(os.environ.get("DISPATCH_BATCH_SECONDS", "5"))
+DISPATCH_OFFER_SECONDS = int(os.environ.get("DISPATCH_OFFER_SECONDS", "30"))
+DISPATCH_FALLBACK_SECONDS = int(os.environ.get("DISPATCH_FALLBACK_SECONDS", "120"))
+# Скільки найближчих вільних кур'єрів розглядати для кожного замовлення
+DISPATCH_CANDIDATES = 8
+DISPATCH_SOLVER = os.environ.get("DISPATCH_SOLVER", "hungarian")
+
+
+class Dispatcher:
+    def __init__(self, mode: str = DISPATCH_MODE):
+        self.enabled = mode == "batch"
+        self._manager = None
+        # job_id -> кур'єри, які відмовились або не відповіли
+        self._declined: Dict[int, Set[int]] = {}
+        self._broadcasted: Set[int] = set()
+        self.rounds = 0
+        self.offers = 0
+        self.declines = 0
+        self.timeouts = 0
+        self.fallbacks = 0
+        self.last_round_ms = 0.0
+        self.last_matrix = (0, 0)
+
+    # --- Старт ---
+    def attach(self, ws_manager):
+        self._manager = ws_manager
+        ws_manager.subscribe("dispatch", self.apply)
+        if self.enabled:
+            asyncio.create_task(self._run())
+
+    def handles(self, partner) -> bool:
+        """Чи піде нове замовлення цього закладу через раунди (без координат закладу -- лише розсилка)."""
+        return self.enabled and bool(partner and partner.lat and partner.lon)
+
+    # --- Відмови (реплікуються між воркерами) ---
+    def record_decline(self, job_id: int, courier_id: int):
+        self.declines += 1
+        self._exclude(job_id, courier_id)
+
+    def _exclude(self, job_id: int, courier_id: int):
+        self._declined.setdefault(job_id, set()).add(courier_id)
+        if self._manager:
+            asyncio.create_task(self._manager.publish_event(
+                "dispatch", {"event": "decline", "job_id": job_id, "courier_id": courier_id}
+            ))
+
+    async def apply(self, event: dict):
+        if event.get("event") == "decline":
+            self._declined.setdefault(event["job_id"], set()).add(event["courier_id"])
+
+    # --- Раунд ---
+    async def _run(self):
+        logging.info(f"Batch dispatcher started (every {DISPATCH_BATCH_SECONDS:.0f}s, solver={DISPATCH_SOLVER})")
+        while True:
+            await asyncio.sleep(DISPATCH_BATCH_SECONDS)
+            try:
+                await self.run_round()
+            except Exception as e:
+                logging.error(f"Dispatch round error: {e}")
+
+    async def run_round(self):
+        # Локальний імпорт для уникнення циркулярної залежності (як в order_monitor)
+        from app import DISPATCH_RADIUS_KM, send_direct_offer, broadcast_order_to_all
+
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        async with async_session_maker() as db:
+            jobs = (await db.execute(
+                select(DeliveryJob).options(joinedload(DeliveryJob.partner))
+                .where(DeliveryJob.status == "pending")
+            )).scalars().all()
+
+            pending_ids = {job.id for job in jobs}
+            self._declined = {k: v for k, v in self._declined.items() if k in pending_ids}
+            self._broadcasted &= pending_ids
+
+            # 1. Прострочені пропозиції диспетчера -> назад у пул
+            offered: Set[int] = set()
+            expired: Set[int] = set()
+            expire_before = now - timedelta(seconds=DISPATCH_OFFER_SECONDS)
+            for job in jobs:
+                if job.target_courier_id is None:
+                    continue
+                if job.offered_at is None or job.offered_at > expire_before:
+                    offered.add(job.target_courier_id)
+                    continue
+                if await self._expire_offer(db, job):
+                    expired.add(job.id)
+                else:
+                    offered.add(job.target_courier_id)
+
+            # 2. Матриця "відкриті замовлення x вільні кур'єри поруч"
+            busy = order_board.board.busy_courier_ids() | offered
+            unassigned = [job for job in jobs if job.target_courier_id is None or job.id in expired]
+            open_jobs = [job for job in unassigned if job.partner and job.partner.lat and job.partner.lon]
+            candidates: List[List[Tuple[int, float]]] = []
+            columns: Dict[int, int] = {}
+            for job in open_jobs:
+                declined = self._declined.get(job.id, ())
+                near = presence.registry.couriers_near(
+                    job.partner.lat, job.partner.lon, DISPATCH_RADIUS_KM,
+                    exclude=busy, limit=DISPATCH_CANDIDATES + len(declined),
+                )
+                near = [(cid, dist) for cid, dist in near if cid not in declined][:DISPATCH_CANDIDATES]
+                candidates.append(near)
+                for cid, _ in near:
+                    columns.setdefault(cid, len(columns))
+
+            courier_ids = list(columns)
+            costs = []
+            for job, near in zip(open_jobs, candidates):
+                row = [None] * len(courier_ids)
+                ready_in = (job.estimated_ready_at - now).total_seconds() / 60 if job.estimated_ready_at else 0.0
+                age = (now - job.created_at).total_seconds() / 60 if job.created_at else 0.0
+                for cid, dist in near:
+                    row[columns[cid]] = assignment.pickup_cost(dist, ready_in, age)
+                costs.append(row)
+            pairs = assignment.solve(costs, DISPATCH_SOLVER) if courier_ids else []
+            self.last_matrix = (len(open_jobs), len(courier_ids))
+
+            # 3. Пропозиції
+            matched = set()
+            for i, j in pairs:
+                job, courier_id = open_jobs[i], courier_ids[j]
+                dist = dict(candidates[i])[courier_id]
+                if await self._make_offer(db, job, courier_id, now):
+                    matched.add(job.id)
+                    self.offers += 1
+                    await send_direct_offer(db, job, job.partner, courier_id, dist_to_rest=dist)
+
+            # 4. Довго без кур'єра -- одноразова розсилка всім
+            # (лише замовлення раундів: заклад без координат отримав розсилку ще при створенні)
+            fallback_before = now - timedelta(seconds=DISPATCH_FALLBACK_SECONDS)
+            for job in open_jobs:
+                if job.id in matched or job.id in self._broadcasted:
+                    continue
+                if job.created_at and job.created_at <= fallback_before:
+                    self._broadcasted.add(job.id)
+                    self.fallbacks += 1
+                    await broadcast_order_to_all(db, job, job.partner)
+
+        self.rounds += 1
+        self.last_round_ms = (time.perf_counter() - started) * 1000
+
+    async def _make_offer(self, db, job: DeliveryJob, courier_id: int, now: datetime) -> bool:
+        """Закріплює пропозицію, лише якщо замовлення досі вільне, а в кур'єра немає іншої пропозиції."""
+        other = aliased(DeliveryJob)
+        res = await db.execute(
+            update(DeliveryJob)
+            .where(
+                DeliveryJob.id == job.id,
+                DeliveryJob.status == "pending",
+                DeliveryJob.target_courier_id.is_(None),
+                ~exists().where(other.target_courier_id == courier_id, other.status == "pending"),
+            )
+            .values(target_courier_id=courier_id, offered_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        if res.rowcount != 1:
+            return False
+        # UPDATE в обхід ORM -- дошці відкритих замовлень треба сказати явно
+        order_board.board.job_changed(job.id)
+        return True
+
+    async def _expire_offer(self, db, job: DeliveryJob) -> bool:
+        courier_id = job.target_courier_id
+        res = await db.execute(
+            update(DeliveryJob)
+            .where(
+                DeliveryJob.id == job.id,
+                DeliveryJob.status == "pending",
+                DeliveryJob.target_courier_id == courier_id,
+            )
+            .values(target_courier_id=None, offered_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        if res.rowcount != 1:
+            return False
+        self.timeouts += 1
+        self._exclude(job.id, courier_id)
+        order_board.board.job_changed(job.id)
+        if self._manager:
+            await self._manager.notify_courier(courier_id, {"type": "direct_offer_timeout", "job_id": job.id})
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "rounds": self.rounds,
+            "offers": self.offers,
+            "declines": self.declines,
+            "timeouts": self.timeouts,
+            "fallback_broadcasts": self.fallbacks,
+            "last_round_ms": round(self.last_round_ms, 1),
+            "last_matrix": {"jobs": self.last_matrix[0], "couriers": self.last_matrix[1]},
+        }
+
+
+dispatcher = Dispatcher()
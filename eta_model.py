@@ -0,0 +1,230 @@
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import pytz
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import geo_distance
+from models import DeliveryJob, DeliveryPartner, EtaStat, async_session_maker
+
+# ==============================================================================
+# ПРОГНОЗ ЧАСУ (ETA) З ІСТОРІЇ ДОСТАВОК
+# ==============================================================================
+# Фонова задача раз на ETA_REFIT_HOURS бере доставлені замовлення за ETA_HISTORY_DAYS і рахує
+# для кожної зони закладу (комірка ETA_CELL_DEG) і години тижня:
+#   pickup   -- хвилини від прийняття до "забрав" (accepted_at -> picked_up_at);
+#   delivery -- хвилини від "забрав" до "доставив" як base + per_km * км поїздки (лінійна регресія).
+# Результат -- невелика таблиця eta_stats (спільна для воркерів) і словник у пам'яті; запит до прогнозу --
+# кілька звернень до словника. Там, де даних мало, береться ширший рівень: зона за всі години,
+# усі зони в цю годину, усе разом.
+
+ETA_CELL_DEG = 0.02
+ETA_HISTORY_DAYS = int(os.environ.get("ETA_HISTORY_DAYS", "56"))
+ETA_REFIT_HOURS = float(os.environ.get("ETA_REFIT_HOURS", "6"))
+# Менше прикладів на рівні -- прогноз береться з ширшого рівня
+ETA_MIN_SAMPLES = 5
+# Тривалості понад це (забуті статуси) не враховуються, хвилини
+ETA_MAX_MINUTES = 180
+ETA_TIMEZONE = pytz.timezone("Europe/Kiev")
+# Рядків в одному upsert (5 параметрів на рядок): asyncpg -- до 32767 параметрів, старі SQLite -- до 999
+ETA_UPSERT_BATCH = {"postgresql": 1000, "sqlite": 150}
+
+PICKUP, DELIVERY = "pickup", "delivery"
+ANY = "*"
+
+Key = Tuple[str, object, object, object]
+
+
+def zone(lat: float, lon: float) -> Tuple[int, int]:
+    return int(lat // ETA_CELL_DEG), int(lon // ETA_CELL_DEG)
+
+
+def hour_of_week(at: datetime) -> int:
+    """0 -- понеділок 00:00-01:00 за київським часом."""
+    local = pytz.UTC.localize(at).astimezone(ETA_TIMEZONE)
+    return local.weekday() * 24 + local.hour
+
+
+def _levels(kind: str, cell: Tuple[int, int], how: int) -> List[Key]:
+    """Від найточнішого до найширшого."""
+    return [(kind, cell[0], cell[1], how), (kind, cell[0], cell[1], ANY), (kind, ANY, ANY, how), (kind, ANY, ANY, ANY)]
+
+
+def _encode(key: Key) -> str:
+    return ":".join(str(part) for part in key)
+
+
+def _decode(text: str) -> Key:
+    kind, *parts = text.split(":")
+    return (kind, *(ANY if p == ANY else int(p) for p in parts))
+
+
+def _fit(points: List[Tuple[float, float]]) -> Tuple[float, float]:
+    """(base_min, per_km_min): мінімальні квадрати, нахил не від'ємний; без розкиду відстаней -- середнє."""
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var_x = sum((x - mean_x) ** 2 for x, _ in points) / n
+    slope = 0.0
+    if var_x > 0.25:
+        slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / n / var_x
+        slope = min(max(slope, 0.0), 15.0)
+    return max(mean_y - slope * mean_x, 0.0), slope
+
+
+class EtaModel:
+    def __init__(self):
+        # ключ -> (base_min, per_km_min, samples)
+        self._table: Dict[Key, Tuple[float, float, int]] = {}
+        self.fitted_at: Optional[datetime] = None
+        self.samples = 0
+
+    # --- Старт і фонове оновлення ---
+    async def load(self):
+        """Лише читає таблицю з БД (на старті -- без перерахунку, щоб помилка не зупиняла застосунок)."""
+        try:
+            async with async_session_maker() as db:
+                rows = (await db.execute(select(EtaStat))).scalars().all()
+            self._table = {_decode(r.key): (r.base_min, r.per_km_min, r.samples) for r in rows}
+            self.fitted_at = min((r.updated_at for r in rows), default=None)
+        except Exception as e:
+            logging.error(f"ETA model load error: {e}")
+
+    def _stale(self) -> bool:
+        return not self.fitted_at or datetime.utcnow() - self.fitted_at > timedelta(hours=ETA_REFIT_HOURS)
+
+    async def run(self):
+        """Фонова задача: перший перерахунок (якщо таблиця порожня/застаріла) і далі щогодинна перевірка."""
+        while True:
+            try:
+                # Інший воркер міг уже перерахувати -- тоді просто перечитуємо
+                await self.load()
+                if self._stale():
+                    await self.refit()
+            except Exception as e:
+                logging.error(f"ETA model refresh error: {e}")
+            await asyncio.sleep(3600)
+
+    async def refit(self):
+        since = datetime.utcnow() - timedelta(days=ETA_HISTORY_DAYS)
+        async with async_session_maker() as db:
+            rows = (await db.execute(
+                select(
+                    DeliveryPartner.lat, DeliveryPartner.lon, DeliveryJob.dropoff_lat, DeliveryJob.dropoff_lon,
+                    DeliveryJob.accepted_at, DeliveryJob.picked_up_at, DeliveryJob.delivered_at,
+                )
+                .join(DeliveryPartner, DeliveryJob.partner_id == DeliveryPartner.id)
+                .where(
+                    DeliveryJob.delivered_at >= since,
+                    DeliveryJob.picked_up_at.is_not(None),
+                    DeliveryPartner.lat.is_not(None),
+                )
+            )).all()
+
+        trip_km = geo_distance.paired_distances(
+            [r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows], [r[3] for r in rows]
+        )
+        groups: Dict[Key, List[Tuple[float, float]]] = {}
+        for (r_lat, r_lon, _, _, accepted_at, picked_up_at, delivered_at), km in zip(rows, trip_km):
+            cell = zone(r_lat, r_lon)
+            if accepted_at:
+                minutes = (picked_up_at - accepted_at).total_seconds() / 60
+                if 0 < minutes <= ETA_MAX_MINUTES:
+                    for key in _levels(PICKUP, cell, hour_of_week(accepted_at)):
+                        groups.setdefault(key, []).append((0.0, minutes))
+            minutes = (delivered_at - picked_up_at).total_seconds() / 60
+            if 0 < minutes <= ETA_MAX_MINUTES and km == km:  # km == km: не NaN
+                for key in _levels(DELIVERY, cell, hour_of_week(picked_up_at)):
+                    groups.setdefault(key, []).append((float(km), minutes))
+
+        table = {}
+        for key, points in groups.items():
+            # Найширший рівень зберігається завжди -- це запасний прогноз
+            if len(points) >= ETA_MIN_SAMPLES or key[1:] == (ANY, ANY, ANY):
+                base, per_km = _fit(points)
+                table[key] = (round(base, 2), round(per_km, 3), len(points))
+
+        now = datetime.utcnow()
+        async with async_session_maker() as db:
+            # Upsert замість delete + insert: кілька воркерів можуть перераховувати одночасно,
+            # і однакові ключі не мають давати IntegrityError. Потім -- ключі, яких цей перерахунок не дав.
+            # Пачками, в одній транзакції
+            dialect = db.bind.dialect.name
+            insert = pg_insert if dialect == "postgresql" else sqlite_insert
+            batch = ETA_UPSERT_BATCH.get(dialect, 150)
+            values = [
+                {"key": _encode(key), "base_min": base, "per_km_min": per_km, "samples": n, "updated_at": now}
+                for key, (base, per_km, n) in table.items()
+            ]
+            for i in range(0, len(values), batch):
+                stmt = insert(EtaStat).values(values[i:i + batch])
+                await db.execute(stmt.on_conflict_do_update(
+                    index_elements=[EtaStat.key],
+                    set_={c: stmt.excluded[c] for c in ("base_min", "per_km_min", "samples", "updated_at")},
+                ))
+            await db.execute(delete(EtaStat).where(EtaStat.updated_at < now))
+            await db.commit()
+        self._table = table
+        self.fitted_at = now
+        self.samples = len(rows)
+        logging.info(f"ETA model: {len(table)} entries from {len(rows)} delivered jobs")
+
+    # --- Прогноз ---
+    def _lookup(self, kind: str, lat, lon, at: datetime) -> Optional[Tuple[float, float]]:
+        if lat is None or lon is None:
+            keys = [(kind, ANY, ANY, hour_of_week(at)), (kind, ANY, ANY, ANY)]
+        else:
+            keys = _levels(kind, zone(lat, lon), hour_of_week(at))
+        for key in keys:
+            entry = self._table.get(key)
+            if entry:
+                return entry[0], entry[1]
+        return None
+
+    def pickup_minutes(self, rest_lat, rest_lon, at: datetime = None) -> Optional[float]:
+        """Хвилини від прийняття замовлення до того, як кур'єр його забере."""
+        fit = self._lookup(PICKUP, rest_lat, rest_lon, at or datetime.utcnow())
+        return round(fit[0], 1) if fit else None
+
+    def delivery_minutes(self, rest_lat, rest_lon, drop_lat, drop_lon, at: datetime = None) -> Optional[float]:
+        """Хвилини від "забрав" до "доставив"; без координат клієнта -- без поправки на відстань."""
+        fit = self._lookup(DELIVERY, rest_lat, rest_lon, at or datetime.utcnow())
+        if not fit:
+            return None
+        km = geo_distance.haversine_km(rest_lat, rest_lon, drop_lat, drop_lon) or 0.0
+        return round(fit[0] + fit[1] * km, 1)
+
+    def job_eta(self, job: DeliveryJob, partner: DeliveryPartner, now: datetime = None) -> dict:
+        """Очікувані моменти (UTC) "забере" і "доставить" для незавершеного замовлення."""
+        now = now or datetime.utcnow()
+        rest_lat = partner.lat if partner else None
+        rest_lon = partner.lon if partner else None
+        pickup_at = job.picked_up_at
+        if pickup_at is None:
+            start = job.accepted_at or now
+            minutes = self.pickup_minutes(rest_lat, rest_lon, start)
+            if minutes is not None:
+                pickup_at = max(start + timedelta(minutes=minutes), now)
+                if job.estimated_ready_at and job.estimated_ready_at > pickup_at:
+                    pickup_at = job.estimated_ready_at
+        delivery_at = None
+        if pickup_at is not None:
+            minutes = self.delivery_minutes(rest_lat, rest_lon, job.dropoff_lat, job.dropoff_lon, pickup_at)
+            if minutes is not None:
+                delivery_at = max(pickup_at + timedelta(minutes=minutes), now)
+        return {"pickup_at": pickup_at if job.picked_up_at is None else None, "delivery_at": delivery_at}
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._table),
+            "jobs_used": self.samples,
+            "fitted_at": self.fitted_at.isoformat() + "Z" if self.fitted_at else None,
+        }
+
+
+model = EtaModel()
@@ -0,0 +1,363 @@
+import os
+import re
+import sys
+import bz2
+import gzip
+import logging
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# ==============================================================================
+# ЛОКАЛЬНИЙ ГАЗЕТИР АДРЕС (з OSM-вибірки): вулиця + номер будинку -> координати
+# ==============================================================================
+# Збірка файлу (один раз, офлайн) з OSM XML (.osm / .osm.gz / .osm.bz2, напр. вибірка міста з Geofabrik/Overpass):
+#     python gazetteer.py build odesa.osm.bz2 data/gazetteer.tsv.gz
+# Формат файлу: gzip TSV "вулиця<TAB>будинок<TAB>lat<TAB>lon" (назви як в OSM, нормалізація -- при завантаженні).
+# Сервіс геокодування (geocoding) спершу шукає тут і йде до Nominatim лише при промаху.
+
+GAZETTEER_PATH = os.environ.get("GAZETTEER_PATH", "data/gazetteer.tsv.gz")
+# Нечіткий збіг назви вулиці: кожне слово може відрізнятися не більше ніж на 1 правку (2 для довгих слів)
+GAZETTEER_LONG_WORD = 9
+# Скільки найсхожіших за триграмами вулиць перевіряти відстанню редагування
+GAZETTEER_FUZZY_CANDIDATES = 20
+# Якщо точного номера немає -- беремо найближчий номер тієї ж парності на цій вулиці, не далі ніж на N
+GAZETTEER_MAX_HOUSE_GAP = 6
+
+_COORD_SCALE = 1_000_000
+
+Coords = Tuple[float, float]
+
+# Типи вулиць (укр./рос./лат.) -> нормалізований тип. У ключ назви не входять, але вулиці різних типів
+# з однією назвою (Грецька вулиця / Грецька площа) -- різні місця з різними будинками
+_STREET_TYPES = {
+    **dict.fromkeys(("вул", "вулиця", "улиця", "ул", "улица", "street", "st", "str"), "вул"),
+    **dict.fromkeys(("просп", "проспект", "пр", "avenue", "ave"), "просп"),
+    **dict.fromkeys(("пров", "провулок", "пер", "переулок", "lane"), "пров"),
+    **dict.fromkeys(("бул", "бульв", "бульвар"), "бул"),
+    **dict.fromkeys(("пл", "площа", "площадь"), "пл"),
+    **dict.fromkeys(("узвіз", "спуск"), "узвіз"),
+    **dict.fromkeys(("шосе", "шоссе"), "шосе"),
+    **dict.fromkeys(("дорога",), "дорога"),
+    **dict.fromkeys(("алея", "аллея"), "алея"),
+    **dict.fromkeys(("тупик",), "тупик"),
+    **dict.fromkeys(("набережна", "наб"), "наб"),
+}
+# Назви міста/країни та службові частини адреси, які пропускаємо при розборі
+_PLACE_WORDS = {"одеса", "одесса", "odesa", "odessa", "україна", "украина", "ukraine", "одеська обл", "одесская обл"}
+_APARTMENT = re.compile(r"^(кв|квартира|под|під'їзд|підїзд|поверх|эт|этаж|офіс|офис)\b")
+_HOUSE = re.compile(r"^(?:буд\.?|будинок|д\.?|дом|№)?\s*(\d+[а-яіїєa-z]?(?:\s*/\s*\d+[а-яіїєa-z]?)?)$")
+_TRAILING_HOUSE = re.compile(r"^(.*\D)\s+(\d+[а-яіїєa-z]?(?:/\d+[а-яіїєa-z]?)?)$")
+_FOLD = str.maketrans({
+    "і": "и", "ї": "и", "є": "е", "ы": "и", "э": "е", "ё": "е", "ъ": None, "ь": None,
+    "'": None, "’": None, "ʼ": None, "`": None, "-": " ", ".": " ",
+})
+# Рос. -> укр. для слів, що розрізняють вулиці (Велика/Мала Арнаутська тощо); після _FOLD
+_SYNONYMS = {"большая": "велика", "малая": "мала", "средняя": "середня", "новая": "нова", "старая": "стара"}
+# Відмінкові закінчення (рос./укр.), що відкидаються: Дерибасовская ~ Дерибасівська, Шевченка ~ Шевченко
+_ENDINGS = ("ая", "яя", "ий", "ый", "ій", "ой", "ое", "ей", "ої", "а", "я", "о", "и", "і", "ї", "е", "у", "ю", "ь")
+_NON_WORD = re.compile(r"[^\w ]+")
+_SPACES = re.compile(r"\s+")
+
+
+def _stem(word: str) -> str:
+    word = _SYNONYMS.get(word, word)
+    if word.isdigit() or len(word) <= 4:
+        return word
+    for ending in _ENDINGS:
+        if word.endswith(ending):
+            return word[:-len(ending)]
+    return word
+
+
+def _street_words(name: str) -> List[str]:
+    name = _NON_WORD.sub(" ", (name or "").lower().replace("ё", "е"))
+    return [w for w in _SPACES.split(name) if w]
+
+
+def street_key(name: str) -> str:
+    """Нормалізована назва вулиці: без типу, регістру, порядку слів та різниці укр./рос. написання."""
+    words = [_stem(w).translate(_FOLD) for w in _street_words(name) if w not in _STREET_TYPES]
+    return " ".join(sorted(w for w in words if w))
+
+
+def street_type(name: str) -> str:
+    """Нормалізований тип вулиці ('вул', 'пл', ...) або '' -- якщо в назві його немає."""
+    return next((_STREET_TYPES[w] for w in _street_words(name) if w in _STREET_TYPES), "")
+
+
+def _edits(a: str, b: str, limit: int) -> int:
+    """Відстань Левенштейна з раннім виходом (> limit -> limit + 1)."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _words_distance(query: List[str], candidate: List[str]) -> Optional[int]:
+    """Сумарна кількість правок між назвами, якщо кожне слово збігається в межах допуску, інакше None."""
+    if len(query) != len(candidate):
+        return None
+    total, unused = 0, list(candidate)
+    for word in query:
+        # Номери та короткі слова (Мала/Велика, 1-а/2-а) -- лише точно
+        limit = 0 if word.isdigit() or len(word) <= 4 else (2 if len(word) >= GAZETTEER_LONG_WORD else 1)
+        best, best_edits = None, limit + 1
+        for other in unused:
+            edits = _edits(word, other, limit)
+            if edits < best_edits:
+                best, best_edits = other, edits
+        if best is None:
+            return None
+        unused.remove(best)
+        total += best_edits
+    return total
+
+
+def house_key(house: str) -> str:
+    return _SPACES.sub("", (house or "").lower()).replace("буд", "").strip(".")
+
+
+def _house_number(house: str) -> Optional[int]:
+    digits = re.match(r"\d+", house)
+    return int(digits.group()) if digits else None
+
+
+def parse_address(address: str) -> Optional[Tuple[str, str]]:
+    """
+    "вул. Дерибасівська, 12, Одеса" / "Дерибасовская 12а, кв. 5" -> (вулиця, будинок) або None.
+    """
+    street, house = None, None
+    for part in (address or "").split(","):
+        part = _SPACES.sub(" ", part.strip().lower())
+        if not part or part in _PLACE_WORDS or _APARTMENT.match(part):
+            continue
+        match = _HOUSE.match(part)
+        if match and street and not house:
+            house = match.group(1).replace(" ", "")
+            continue
+        if street is None:
+            trailing = _TRAILING_HOUSE.match(part)
+            if trailing and not house:
+                street, house = trailing.group(1), trailing.group(2)
+            else:
+                street = part
+    if not street or not house:
+        return None
+    return street, house
+
+
+def _trigrams(key: str) -> Set[str]:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _Street:
+    """Будинки однієї вулиці: відсортовані ключі + координати в мікроградусах (array, без об'єктів на точку)."""
+    __slots__ = ("houses", "lats", "lons")
+
+    def __init__(self, items: List[Tuple[str, float, float]]):
+        items.sort()
+        self.houses = [h for h, _, _ in items]
+        self.lats = array("i", (round(lat * _COORD_SCALE) for _, lat, _ in items))
+        self.lons = array("i", (round(lon * _COORD_SCALE) for _, _, lon in items))
+
+    def coords(self, i: int) -> Coords:
+        return self.lats[i] / _COORD_SCALE, self.lons[i] / _COORD_SCALE
+
+    def find(self, house: str) -> Optional[Coords]:
+        i = bisect_left(self.houses, house)
+        if i < len(self.houses) and self.houses[i] == house:
+            return self.coords(i)
+        # Точного номера немає (новобудова, літера, дріб) -- найближчий номер тієї ж парності
+        number = _house_number(house)
+        if number is None:
+            return None
+        best, best_gap = None, GAZETTEER_MAX_HOUSE_GAP + 1
+        for j, other in enumerate(self.houses):
+            other_number = _house_number(other)
+            if other_number is None or other_number % 2 != number % 2:
+                continue
+            gap = abs(other_number - number)
+            if gap < best_gap:
+                best, best_gap = j, gap
+        return self.coords(best) if best is not None else None
+
+
+class Gazetteer:
+    """Індекс адрес у пам'яті з нечітким пошуком вулиці (триграми)."""
+
+    def __init__(self, rows: Iterable[Tuple[str, str, float, float]] = ()):
+        grouped: Dict[str, Dict[str, List[Tuple[str, float, float]]]] = {}
+        for street, house, lat, lon in rows:
+            key = street_key(street)
+            if key:
+                grouped.setdefault(key, {}).setdefault(street_type(street), []).append((house_key(house), lat, lon))
+        # ключ назви -> тип -> будинки
+        self._streets: Dict[str, Dict[str, _Street]] = {
+            key: {kind: _Street(items) for kind, items in kinds.items()} for key, kinds in grouped.items()
+        }
+        self._by_trigram: Dict[str, List[str]] = {}
+        for key in self._streets:
+            for gram in _trigrams(key):
+                self._by_trigram.setdefault(gram, []).append(key)
+        self._fuzzy: Dict[str, Optional[str]] = {}
+        self.streets = sum(len(kinds) for kinds in self._streets.values())
+        self.addresses = sum(len(s.houses) for kinds in self._streets.values() for s in kinds.values())
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, path: str) -> "Gazetteer":
+        def rows():
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t")
+                    if len(parts) == 4:
+                        yield parts[0], parts[1], float(parts[2]), float(parts[3])
+        return cls(rows())
+
+    def _match_street(self, street: str) -> Optional[str]:
+        key = street_key(street)
+        if key in self._streets:
+            return key
+        if key in self._fuzzy:
+            return self._fuzzy[key]
+        # Кандидати -- вулиці з достатньою кількістю спільних триграм, далі перевірка по словах
+        grams = _trigrams(key)
+        postings = [self._by_trigram.get(gram, ()) for gram in grams]
+        # Триграми, що є в кожній десятій вулиці ("ськ", "вул"), майже не розрізняють і лише гальмують
+        selective = [p for p in postings if len(p) <= max(50, len(self._streets) // 10)]
+        if len(selective) * 2 >= len(postings):
+            grams_needed = len(selective)
+            postings = selective
+        else:
+            grams_needed = len(grams)
+        counts: Dict[str, int] = {}
+        for posting in postings:
+            for candidate in posting:
+                counts[candidate] = counts.get(candidate, 0) + 1
+        words = key.split()
+        best, best_edits, ambiguous = None, None, False
+        # Одна правка змінює не більше 3 триграм -- справжній збіг завжди серед найбільш схожих
+        top = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:GAZETTEER_FUZZY_CANDIDATES]
+        for candidate, common in top:
+            if common * 2 < grams_needed:
+                break
+            edits = _words_distance(words, candidate.split())
+            if edits is None:
+                continue
+            if best_edits is None or edits < best_edits:
+                best, best_edits, ambiguous = candidate, edits, False
+            elif edits == best_edits:
+                ambiguous = True
+        # Дві однаково схожі вулиці -- краще промах (Nominatim), ніж не та адреса
+        if ambiguous:
+            best = None
+        if len(self._fuzzy) < 10000:
+            self._fuzzy[key] = best
+        return best
+
+    def _street(self, key: str, kind: str) -> Optional[_Street]:
+        kinds = self._streets[key]
+        if kind in kinds:
+            return kinds[kind]
+        # Тип не вказано або він інший -- лише якщо вулиця з такою назвою одна, інакше промах (Nominatim)
+        if len(kinds) == 1:
+            return next(iter(kinds.values()))
+        return None
+
+    def lookup(self, address: str) -> Optional[Coords]:
+        """(lat, lon) або None, якщо адреси немає в газетирі (тоді -- віддалений геокодер)."""
+        parsed = parse_address(address)
+        result = None
+        if parsed:
+            key = self._match_street(parsed[0])
+            street = self._street(key, street_type(parsed[0])) if key else None
+            if street:
+                result = street.find(house_key(parsed[1]))
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def stats(self) -> dict:
+        return {"streets": self.streets, "addresses": self.addresses, "hits": self.hits, "misses": self.misses}
+
+
+def load_default() -> Optional[Gazetteer]:
+    if not GAZETTEER_PATH or not os.path.exists(GAZETTEER_PATH):
+        return None
+    gazetteer = Gazetteer.load(GAZETTEER_PATH)
+    logging.info(f"Gazetteer: loaded {gazetteer.addresses} addresses on {gazetteer.streets} streets")
+    return gazetteer
+
+
+# --- Збірка з OSM XML ---
+def _open_osm(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def extract_addresses(path: str):
+    """(вулиця, будинок, lat, lon) з вузлів і контурів будівель, що мають addr:street + addr:housenumber."""
+    import xml.etree.ElementTree as ET
+
+    nodes: Dict[int, Tuple[float, float]] = {}
+    refs: List[int] = []
+    tags: Dict[str, str] = {}
+    with _open_osm(path) as f:
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                if elem.tag in ("node", "way"):
+                    refs, tags = [], {}
+                continue
+            if elem.tag == "tag":
+                tags[elem.get("k")] = elem.get("v")
+            elif elem.tag == "nd":
+                refs.append(int(elem.get("ref")))
+            elif elem.tag == "node":
+                lat, lon = float(elem.get("lat")), float(elem.get("lon"))
+                nodes[int(elem.get("id"))] = (lat, lon)
+                if "addr:street" in tags and "addr:housenumber" in tags:
+                    yield tags["addr:street"], tags["addr:housenumber"], lat, lon
+                elem.clear()
+            elif elem.tag == "way":
+                points = [nodes[r] for r in refs if r in nodes]
+                if points and "addr:street" in tags and "addr:housenumber" in tags:
+                    # Центр контуру будівлі
+                    yield (tags["addr:street"], tags["addr:housenumber"],
+                           sum(p[0] for p in points) / len(points), sum(p[1] for p in points) / len(points))
+                elem.clear()
+            elif elem.tag == "relation":
+                elem.clear()
+
+
+def build(osm_path: str, out_path: str) -> int:
+    count = 0
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with gzip.open(out_path, "wt", encoding="utf-8") as out:
+        for street, house, lat, lon in extract_addresses(osm_path):
+            # Будинок може мати кілька номерів через ";" -- кожен окремим рядком
+            for number in house.split(";"):
+                out.write(f"{street.replace(chr(9), ' ')}\t{number.strip()}\t{lat:.6f}\t{lon:.6f}\n")
+                count += 1
+    return count
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "build":
+        print("Usage: python gazetteer.py build <extract.osm[.gz|.bz2]> <out.tsv.gz>")
+        sys.exit(1)
+    print(f"Written {build(sys.argv[2], sys.argv[3])} addresses to {sys.argv[3]}")
@@ -0,0 +1,93 @@
+from math import radians, cos, sin, asin, sqrt, isnan
+from typing import List, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # Опціональна залежність: без неї ті самі функції рахуються циклом
+    np = None
+
+# ==============================================================================
+# ВІДСТАНІ (HAVERSINE), ПАКЕТНО
+# ==============================================================================
+# Координати передаються послідовностями; None (невідомо) -> NaN у результаті.
+# З numpy обчислення векторне (одна операція на весь масив), без нього -- звичайний цикл
+# з тим самим результатом. Для відповіді клієнту значення проганяються через to_km_list().
+
+EARTH_RADIUS_KM = 6371.0
+
+_NAN = float("nan")
+
+
+def haversine_km(lat1, lon1, lat2, lon2) -> Optional[float]:
+    """Відстань між двома точками в км (без округлення) або None, якщо координати невідомі."""
+    if lat1 is None or lon1 is None or lat2 is None or lon2 is None:
+        return None
+    try:
+        lon1, lat1, lon2, lat2 = map(radians, [float(lon1), float(lat1), float(lon2), float(lat2)])
+    except (TypeError, ValueError):
+        return None
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return 2 * asin(sqrt(min(a, 1.0))) * EARTH_RADIUS_KM
+
+
+def _as_array(values: Sequence):
+    return np.array([_NAN if v is None else v for v in values], dtype=float)
+
+
+def _haversine_np(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def distance_matrix(lats_a: Sequence, lons_a: Sequence, lats_b: Sequence, lons_b: Sequence):
+    """
+    Матриця відстаней len(a) x len(b) в км (напр. кур'єри x заклади).
+    numpy.ndarray, або список списків без numpy.
+    """
+    if np is not None:
+        return _haversine_np(
+            _as_array(lats_a)[:, None], _as_array(lons_a)[:, None],
+            _as_array(lats_b)[None, :], _as_array(lons_b)[None, :],
+        )
+    return [
+        [_nan_if_none(haversine_km(la, lo, lb, ob)) for lb, ob in zip(lats_b, lons_b)]
+        for la, lo in zip(lats_a, lons_a)
+    ]
+
+
+def distances_from(lat, lon, lats: Sequence, lons: Sequence):
+    """Відстані від однієї точки до кожної з точок (напр. кур'єр -> всі заклади)."""
+    if lat is None or lon is None:
+        return _nan_vector(len(lats))
+    if np is not None:
+        return _haversine_np(float(lat), float(lon), _as_array(lats), _as_array(lons))
+    return [_nan_if_none(haversine_km(lat, lon, la, lo)) for la, lo in zip(lats, lons)]
+
+
+def paired_distances(lats_a: Sequence, lons_a: Sequence, lats_b: Sequence, lons_b: Sequence):
+    """Поелементні відстані a[i] -> b[i] (напр. заклад -> адреса доставки кожного замовлення)."""
+    if np is not None:
+        return _haversine_np(_as_array(lats_a), _as_array(lons_a), _as_array(lats_b), _as_array(lons_b))
+    return [
+        _nan_if_none(haversine_km(la, lo, lb, ob))
+        for la, lo, lb, ob in zip(lats_a, lons_a, lats_b, lons_b)
+    ]
+
+
+def to_km_list(values) -> List[Optional[float]]:
+    """Вектор відстаней -> список float (округлення до 0.01 км) з None замість NaN, для JSON."""
+    if np is not None and isinstance(values, np.ndarray):
+        rounded = np.round(values, 2)
+        return [None if isnan(v) else v for v in rounded.tolist()]
+    return [None if isnan(v) else round(v, 2) for v in values]
+
+
+def _nan_if_none(value: Optional[float]) -> float:
+    return _NAN if value is None else value
+
+
+def _nan_vector(n: int):
+    if np is not None:
+        return np.full(n, _NAN)
+    return [_NAN] * n
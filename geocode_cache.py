@@ -0,0 +1,124 @@
+import os
+import re
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from models import GeocodeCacheEntry, async_session_maker
+
+# Розмір LRU у пам'яті воркера (адрес)
+GEOCODE_LRU_SIZE = int(os.environ.get("GEOCODE_LRU_SIZE", "5000"))
+# Скільки живе знайдена адреса (дні) та "не знайдено" (години) -- після цього шукаємо знову
+GEOCODE_TTL_DAYS = float(os.environ.get("GEOCODE_TTL_DAYS", "90"))
+GEOCODE_NEGATIVE_TTL_HOURS = float(os.environ.get("GEOCODE_NEGATIVE_TTL_HOURS", "12"))
+
+Coords = Tuple[Optional[float], Optional[float]]
+
+_SPACES = re.compile(r"\s+")
+_COMMAS = re.compile(r"\s*,\s*")
+
+
+def normalize_address(address: str) -> str:
+    """Ключ кешу: регістр, зайві пробіли та коми не мають значення."""
+    key = _SPACES.sub(" ", (address or "").strip().lower())
+    key = _COMMAS.sub(", ", key).strip(" ,.")
+    return key[:500]
+
+
+class GeocodeCache:
+    """
+    Кеш геокодування: LRU з TTL у пам'яті перед таблицею geocode_cache.
+    get() -> (lat, lon), (None, None) для закешованого "не знайдено", або None, якщо треба шукати.
+    Помилки БД не ламають геокодування -- кеш лише пропускається.
+    """
+
+    def __init__(self, max_size: int = GEOCODE_LRU_SIZE):
+        self.max_size = max_size
+        # key -> (lat, lon, expires_at)
+        self._lru: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+
+    @staticmethod
+    def _expires_at(fetched_at: datetime, negative: bool) -> datetime:
+        if negative:
+            return fetched_at + timedelta(hours=GEOCODE_NEGATIVE_TTL_HOURS)
+        return fetched_at + timedelta(days=GEOCODE_TTL_DAYS)
+
+    def _remember(self, key: str, lat, lon, expires_at: datetime):
+        self._lru[key] = (lat, lon, expires_at)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def _result(self, lat, lon) -> Coords:
+        if lat is None or lon is None:
+            self.negative_hits += 1
+            return None, None
+        return lat, lon
+
+    async def get(self, address: str) -> Optional[Coords]:
+        key = normalize_address(address)
+        if not key:
+            return None, None
+        now = datetime.utcnow()
+
+        entry = self._lru.get(key)
+        if entry:
+            if entry[2] > now:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return self._result(entry[0], entry[1])
+            del self._lru[key]
+
+        try:
+            async with async_session_maker() as session:
+                row = await session.get(GeocodeCacheEntry, key)
+        except Exception as e:
+            logging.error(f"Geocode cache read error: {e}")
+            row = None
+
+        if row and row.fetched_at:
+            expires_at = self._expires_at(row.fetched_at, bool(row.is_negative))
+            if expires_at > now:
+                lat, lon = (None, None) if row.is_negative else (row.lat, row.lon)
+                self._remember(key, lat, lon, expires_at)
+                self.db_hits += 1
+                return self._result(lat, lon)
+
+        self.misses += 1
+        return None
+
+    async def put(self, address: str, lat: Optional[float], lon: Optional[float], provider: str):
+        """Зберігає результат; lat/lon = None -- адресу не знайдено (негативний запис)."""
+        key = normalize_address(address)
+        if not key:
+            return
+        negative = lat is None or lon is None
+        now = datetime.utcnow()
+        self._remember(key, lat, lon, self._expires_at(now, negative))
+        try:
+            async with async_session_maker() as session:
+                await session.merge(GeocodeCacheEntry(
+                    address=key, lat=lat, lon=lon, provider=provider,
+                    is_negative=negative, fetched_at=now,
+                ))
+                await session.commit()
+        except Exception as e:
+            logging.error(f"Geocode cache write error: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "lru_size": len(self._lru),
+            "lru_max": self.max_size,
+            "hits": self.hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "negative_hits": self.negative_hits,
+        }
+
+
+cache = GeocodeCache()
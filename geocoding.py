@@ -0,0 +1,225 @@
+import os
+import asyncio
+import logging
+from typing import Dict, Optional
+
+import httpx
+
+import geocode_cache
+import gazetteer
+from geocode_cache import Coords, normalize_address
+
+# ==============================================================================
+# ГЕОКОДУВАННЯ (Nominatim): один пул з'єднань, single-flight, ліміт частоти
+# ==============================================================================
+# Усі запити до Nominatim йдуть через чергу: однакові адреси зливаються в один запит,
+# частота обмежена token bucket (політика OSM -- 1 запит/с; ліміт діє на процес-воркер).
+# Виклик на гарячому шляху передає deadline і при його перевищенні отримує (None, None).
+# Запит, що вже пішов до Nominatim, усе одно завершиться і потрапить у кеш для наступних викликів;
+# а адреса, на яку до її черги вже ніхто не чекає, з черги викидається без запиту (лічильник dropped) --
+# ліміт частоти не витрачається, адресу геокодує наступний виклик.
+# Якщо завантажено локальний газетир (gazetteer), адреса спершу шукається в ньому, без I/O.
+
+NOMINATIM_URL = os.environ.get("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search")
+GEOCODE_USER_AGENT = "RestifyDelivery/1.0 (admin@restify.site)"
+GEOCODE_RATE_PER_SECOND = float(os.environ.get("GEOCODE_RATE_PER_SECOND", "1.0"))
+GEOCODE_HTTP_TIMEOUT = 5.0
+# Скільки різних адрес може чекати в черзі; понад це -- одразу "невідомо"
+GEOCODE_MAX_QUEUE = int(os.environ.get("GEOCODE_MAX_QUEUE", "200"))
+# Пауза після 429/503 від Nominatim (секунди)
+GEOCODE_BACKOFF_SECONDS = 30.0
+# Deadline для викликів з HTTP-запитів (створення замовлення тощо)
+GEOCODE_REQUEST_DEADLINE = float(os.environ.get("GEOCODE_REQUEST_DEADLINE", "3.0"))
+
+
+class TokenBucket:
+    """Token bucket: acquire() чекає, доки з'явиться токен (rate токенів на секунду, до capacity)."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = None
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        loop = asyncio.get_running_loop()
+        self._paused_until = max(self._paused_until, loop.time() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                if self._updated is not None:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self._tokens) / self.rate)
+
+
+class _Lookup:
+    """Одна адреса в черзі; waiters -- скільки викликів ще чекають на результат."""
+    __slots__ = ("key", "address", "future", "waiters")
+
+    def __init__(self, key: str, address: str, future: asyncio.Future):
+        self.key = key
+        self.address = address
+        self.future = future
+        self.waiters = 0
+
+
+class GeocodingService:
+    def __init__(self, rate: float = GEOCODE_RATE_PER_SECOND, max_queue: int = GEOCODE_MAX_QUEUE):
+        self.rate = rate
+        self.max_queue = max_queue
+        self._client: Optional[httpx.AsyncClient] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._bucket: Optional[TokenBucket] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: Dict[str, _Lookup] = {}
+        # Локальний бекенд (газетир з OSM-вибірки); None -- лише кеш + Nominatim
+        self.local: Optional[gazetteer.Gazetteer] = None
+        self.upstream = 0
+        self.coalesced = 0
+        self.deadline_misses = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def _ensure_started(self):
+        if self._worker and not self._worker.done():
+            return
+        self._client = httpx.AsyncClient(
+            headers={"User-Agent": GEOCODE_USER_AGENT},
+            timeout=GEOCODE_HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=4, max_keepalive_connections=2),
+        )
+        self._queue = asyncio.Queue()
+        self._bucket = TokenBucket(self.rate)
+        self._worker = asyncio.create_task(self._run())
+
+    async def load_local(self):
+        """Завантажує газетир з GAZETTEER_PATH (якщо файл є) в окремому потоці."""
+        try:
+            self.local = await asyncio.to_thread(gazetteer.load_default)
+        except Exception as e:
+            logging.error(f"Gazetteer load error: {e}")
+
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+        for lookup in self._inflight.values():
+            if not lookup.future.done():
+                lookup.future.set_result((None, None))
+        self._inflight.clear()
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    async def geocode(self, address: str, deadline: Optional[float] = None) -> Coords:
+        """
+        (lat, lon) або (None, None). deadline -- скільки секунд готовий чекати виклик
+        (None -- до результату, напр. фонове дозаповнення).
+        """
+        if not address:
+            return None, None
+        if self.local:
+            found = self.local.lookup(address)
+            if found:
+                return found
+        cached = await geocode_cache.cache.get(address)
+        if cached is not None:
+            return cached
+
+        self._ensure_started()
+        key = normalize_address(address)
+        lookup = self._inflight.get(key)
+        if lookup is None:
+            if len(self._inflight) >= self.max_queue:
+                self.rejected += 1
+                return None, None
+            lookup = self._inflight[key] = _Lookup(key, address, asyncio.get_running_loop().create_future())
+            self._queue.put_nowait(lookup)
+        else:
+            self.coalesced += 1
+
+        lookup.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(lookup.future), deadline)
+        except asyncio.TimeoutError:
+            self.deadline_misses += 1
+            return None, None
+        finally:
+            lookup.waiters -= 1
+
+    async def _run(self):
+        while True:
+            lookup = await self._queue.get()
+            try:
+                await self._process(lookup)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Geocoding worker error: {e}")
+            finally:
+                self._inflight.pop(lookup.key, None)
+                if not lookup.future.done():
+                    lookup.future.set_result((None, None))
+
+    async def _process(self, lookup: _Lookup):
+        # Усі, хто чекав, уже пішли по deadline -- не витрачаємо ліміт (адресу спитають знову)
+        if lookup.waiters == 0:
+            self.dropped += 1
+            return
+        await self._bucket.acquire()
+
+        self.upstream += 1
+        try:
+            resp = await self._client.get(NOMINATIM_URL, params={"q": lookup.address, "format": "json", "limit": 1})
+        except httpx.HTTPError as e:
+            self.errors += 1
+            logging.error(f"Geocoding Error: {e}")
+            return
+        if resp.status_code in (429, 503):
+            self.errors += 1
+            self._bucket.pause(GEOCODE_BACKOFF_SECONDS)
+            logging.warning(f"Geocoding throttled by upstream ({resp.status_code}), pausing {GEOCODE_BACKOFF_SECONDS:.0f}s")
+            return
+        if resp.status_code != 200:
+            self.errors += 1
+            logging.error(f"Geocoding Error: HTTP {resp.status_code}")
+            return
+
+        data = resp.json()
+        if data:
+            res = (float(data[0]["lat"]), float(data[0]["lon"]))
+        else:
+            # Адресу не знайдено -- кешується як негативний результат
+            res = (None, None)
+        await geocode_cache.cache.put(lookup.address, res[0], res[1], "nominatim")
+        lookup.future.set_result(res)
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._inflight),
+            "rate_per_second": self.rate,
+            "upstream_requests": self.upstream,
+            "coalesced": self.coalesced,
+            "deadline_misses": self.deadline_misses,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "local": self.local.stats() if self.local else None,
+        }
+
+
+geocoder = GeocodingService()
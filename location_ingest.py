@@ -0,0 +1,86 @@
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Tuple
+from sqlalchemy import update, bindparam
+
+from models import Courier, async_session_maker
+
+# Як часто останні позиції кур'єрів записуються в таблицю couriers (секунди)
+LOCATION_FLUSH_SECONDS = float(os.environ.get("LOCATION_FLUSH_SECONDS", "3.0"))
+
+
+class LocationIngest:
+    """
+    Прийом координат кур'єрів (WS init_location, POST /api/courier/location).
+    Позиції лише складаються в пам'ять (остання на кур'єра), а раз на LOCATION_FLUSH_SECONDS
+    записуються в couriers одним bulk UPDATE замість транзакції на кожен кадр.
+    Актуальну позицію читаємо з presence.registry, БД -- для звітів і після рестарту.
+    """
+
+    def __init__(self, interval: float = LOCATION_FLUSH_SECONDS):
+        self.interval = interval
+        self._pending: Dict[int, Tuple[float, float, datetime]] = {}
+        self._task = None
+        self.received = 0
+        self.written = 0
+        self.flushes = 0
+
+    def accept(self, courier_id: int, lat: float, lon: float, at: datetime):
+        # Нова позиція кур'єра замінює ще не записану попередню
+        self._pending[courier_id] = (lat, lon, at)
+        self.received += 1
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Location flush error: {e}")
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        rows = [
+            {"b_id": courier_id, "lat": lat, "lon": lon, "last_seen": at}
+            for courier_id, (lat, lon, at) in batch.items()
+        ]
+        try:
+            async with async_session_maker() as session:
+                # Core executemany без перевірки кількості рядків: видалений кур'єр просто нічого не оновлює
+                # (ORM bulk UPDATE кидав би StaleDataError і блокував запис позицій для всіх)
+                await session.execute(
+                    update(Courier.__table__).where(Courier.__table__.c.id == bindparam("b_id")),
+                    rows,
+                )
+                await session.commit()
+        except Exception:
+            # Не втрачаємо позиції: повертаємо ті, що не були перезаписані новішими
+            for courier_id, value in batch.items():
+                self._pending.setdefault(courier_id, value)
+            raise
+        self.written += len(rows)
+        self.flushes += 1
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "received": self.received,
+            "written": self.written,
+            "flushes": self.flushes,
+            "interval": self.interval,
+        }
+
+
+ingest = LocationIngest()
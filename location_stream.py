@@ -0,0 +1,167 @@
+import asyncio
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import DeliveryJob
+
+# Мінімальний інтервал між оновленнями позиції для одного підписника (секунди)
+TRACK_MIN_INTERVAL = 3.0
+# Після цих статусів трекінг замовлення закінчується
+TRACK_FINAL_STATUSES = ("delivered", "cancelled")
+
+
+class TrackSubscription:
+    """Підписка закладу на позицію кур'єра, що везе його замовлення."""
+    __slots__ = ("partner_id", "job_id", "courier_id", "last_sent", "pending", "_timer")
+
+    def __init__(self, partner_id: int, job_id: int, courier_id: int):
+        self.partner_id = partner_id
+        self.job_id = job_id
+        self.courier_id = courier_id
+        self.last_sent: float = 0.0
+        self.pending: Optional[tuple] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def cancel(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+
+class LocationStream:
+    """
+    Живий потік координат кур'єра для закладів через /ws/partner.
+    Позиції надходять зі шляху прийому локації (WS init_location, POST /api/courier/location)
+    і розсилаються підписникам з обмеженням частоти, без запитів до БД.
+    Підписки реплікуються між воркерами через шину ConnectionManager.
+    """
+
+    def __init__(self, min_interval: float = TRACK_MIN_INTERVAL):
+        self.min_interval = min_interval
+        # courier_id -> {partner_id: підписка}
+        self._by_courier: Dict[int, Dict[int, TrackSubscription]] = {}
+        # partner_id -> підписка (один відкритий трекінг на заклад)
+        self._by_partner: Dict[int, TrackSubscription] = {}
+        self._manager = None
+
+    def attach(self, ws_manager):
+        self._manager = ws_manager
+        ws_manager.subscribe("tracking", self.apply)
+
+    # --- Підписки ---
+    def subscribe(self, partner_id: int, job_id: int, courier_id: int):
+        self._apply_subscribe(partner_id, job_id, courier_id)
+        self._replicate({"event": "subscribe", "partner_id": partner_id, "job_id": job_id, "courier_id": courier_id})
+
+    def unsubscribe(self, partner_id: int):
+        if partner_id not in self._by_partner:
+            return
+        self._apply_unsubscribe(partner_id)
+        self._replicate({"event": "unsubscribe", "partner_id": partner_id})
+
+    def end_job(self, job_id: int):
+        """Замовлення завершене / скасоване / передане іншому кур'єру -- знімаємо підписки на нього."""
+        self._apply_end_job(job_id)
+        self._replicate({"event": "end_job", "job_id": job_id})
+
+    def _apply_subscribe(self, partner_id: int, job_id: int, courier_id: int):
+        self._apply_unsubscribe(partner_id)
+        sub = TrackSubscription(partner_id, job_id, courier_id)
+        self._by_partner[partner_id] = sub
+        self._by_courier.setdefault(courier_id, {})[partner_id] = sub
+
+    def _apply_unsubscribe(self, partner_id: int):
+        sub = self._by_partner.pop(partner_id, None)
+        if not sub:
+            return
+        sub.cancel()
+        subs = self._by_courier.get(sub.courier_id)
+        if subs:
+            subs.pop(partner_id, None)
+            if not subs:
+                del self._by_courier[sub.courier_id]
+
+    def _apply_end_job(self, job_id: int):
+        for partner_id in [pid for pid, sub in self._by_partner.items() if sub.job_id == job_id]:
+            self._apply_unsubscribe(partner_id)
+
+    async def apply(self, event: dict):
+        """Обробник підписок з інших воркерів."""
+        if event.get("event") == "subscribe":
+            self._apply_subscribe(event["partner_id"], event["job_id"], event["courier_id"])
+        elif event.get("event") == "unsubscribe":
+            self._apply_unsubscribe(event["partner_id"])
+        elif event.get("event") == "end_job":
+            self._apply_end_job(event["job_id"])
+
+    def _replicate(self, event: dict):
+        if not self._manager:
+            return
+        try:
+            asyncio.get_running_loop().create_task(self._manager.publish_event("tracking", event))
+        except RuntimeError:
+            pass
+
+    # --- Гарячий шлях: нова позиція кур'єра ---
+    def publish(self, courier_id: int, lat: float, lon: float, at: datetime = None):
+        subs = self._by_courier.get(courier_id)
+        if not subs or not self._manager:
+            return
+        at = at or datetime.utcnow()
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        for sub in list(subs.values()):
+            sub.pending = (lat, lon, at)
+            wait = sub.last_sent + self.min_interval - now
+            if wait <= 0:
+                self._flush(sub)
+            elif sub._timer is None:
+                # Остання позиція за інтервал все одно дійде (trailing edge)
+                sub._timer = loop.call_later(wait, self._flush, sub)
+
+    def _flush(self, sub: TrackSubscription):
+        sub._timer = None
+        if sub.pending is None or self._by_partner.get(sub.partner_id) is not sub:
+            return
+        lat, lon, at = sub.pending
+        sub.pending = None
+        sub.last_sent = asyncio.get_running_loop().time()
+        asyncio.create_task(self._manager.notify_partner(sub.partner_id, {
+            "type": "courier_location", "job_id": sub.job_id,
+            "lat": lat, "lon": lon, "at": at.isoformat() + "Z",
+        }))
+
+    def stats(self) -> dict:
+        return {
+            "subscriptions": len(self._by_partner),
+            "tracked_couriers": len(self._by_courier),
+        }
+
+
+stream = LocationStream()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_finished_tracks(session, flush_context):
+    """Замовлення, трекінг яких більше не актуальний; підписки знімаються лише після коміту."""
+    for obj in session.dirty:
+        if isinstance(obj, DeliveryJob):
+            state = inspect(obj)
+            if (state.attrs.status.history.has_changes() and obj.status in TRACK_FINAL_STATUSES) \
+                    or state.attrs.courier_id.history.has_changes():
+                session.info.setdefault("track_finished_jobs", set()).add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, DeliveryJob):
+            session.info.setdefault("track_finished_jobs", set()).add(obj.id)
+
+@event.listens_for(Session, "after_commit")
+def _end_finished_tracks(session):
+    for job_id in session.info.pop("track_finished_jobs", ()):
+        stream.end_job(job_id)
+
+@event.listens_for(Session, "after_rollback")
+def _drop_finished_tracks(session):
+    session.info.pop("track_finished_jobs", None)
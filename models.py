@@ -1,5 +1,5 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Float, Boolean
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Float, Boolean, Text, inspect, text
 from sqlalchemy.orm import sessionmaker, relationship, DeclarativeBase
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from datetime import datetime
@@ -149,6 +149,10 @@ class DeliveryPartner(Base):
     phone = Column(String(50), nullable=False)
     address = Column(String(255), nullable=False) 
     hashed_password = Column(String(255), nullable=False)
+
+    # Координати адреси закладу (геокодуються при реєстрації/зміні адреси, а не на кожен запит)
+    lat = Column(Float, nullable=True)
+    lon = Column(Float, nullable=True)
     
     # ID чату в Telegram для сповіщень
     telegram_chat_id = Column(String(50), nullable=True, unique=True)
@@ -204,6 +208,8 @@ class DeliveryJob(Base):
     
     # --- НОВЕ ПОЛЕ ДЛЯ ПЕРСОНАЛЬНОГО ПРИЗНАЧЕННЯ ---
     target_courier_id = Column(Integer, ForeignKey("couriers.id", ondelete="SET NULL"), nullable=True)
+    # Коли пропозицію зробив диспетчер (пакетний режим); NULL -- персональне замовлення від закладу
+    offered_at = Column(DateTime, nullable=True)
     # -----------------------------------------------
     
     # --- ЧАСОВІ МІТКИ (TIMESTAMPS) ---
@@ -359,12 +365,77 @@ class CourierMotivatorProgress(Base):
     
     motivator = relationship("CourierMotivator")
 
+class GeocodeCacheEntry(Base):
+    """
+    Спільний кеш геокодування (для всіх воркерів і між рестартами).
+    Невдалі пошуки теж зберігаються (is_negative), щоб не питати Nominatim щоразу.
+    """
+    __tablename__ = "geocode_cache"
+    
+    address = Column(String(500), primary_key=True) # Нормалізована адреса (geocode_cache.normalize_address)
+    lat = Column(Float, nullable=True)
+    lon = Column(Float, nullable=True)
+    provider = Column(String(30), nullable=True)    # 'nominatim', ...
+    is_negative = Column(Boolean, default=False)    # Адресу не знайдено
+    fetched_at = Column(DateTime, default=datetime.utcnow)
+
+class EtaStat(Base):
+    """
+    Таблиця прогнозів тривалості (eta_model): хвилини = base_min + per_km_min * км
+    для зони закладу і години тижня. Перераховується фоновою задачею з історії доставок.
+    """
+    __tablename__ = "eta_stats"
+
+    key = Column(String(40), primary_key=True)      # 'pickup:2324:1536:37', '*' -- усі зони / години
+    samples = Column(Integer, default=0)
+    base_min = Column(Float, default=0.0)
+    per_km_min = Column(Float, default=0.0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class OutboxMessage(Base):
+    """
+    Черга сповіщень (notification_outbox): пишеться в тій самій транзакції, що й зміна замовлення,
+    відправляється воркерами notification_outbox з повторами. Після рестарту нічого не губиться.
+    """
+    __tablename__ = "notification_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    channel = Column(String(10), index=True)         # 'ws', 'fcm', 'tg'
+    role = Column(String(10), nullable=True)         # 'courier' / 'partner' (кому: для ws і fcm)
+    target = Column(String(255))                     # id (ws), FCM-токен (fcm), chat_id (tg)
+    payload = Column(Text)                           # JSON
+    idempotency_key = Column(String(150), index=True) # Одне й те саме сповіщення доставляється один раз
+    status = Column(String(10), default="pending", index=True) # pending / sent / failed / duplicate
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, index=True)
+    last_error = Column(String(300), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
 # --- 3. Функції для роботи з БД ---
 
+# Колонки, додані в уже існуючі таблиці (create_all їх не створює): (таблиця, колонка, тип)
+ADDED_COLUMNS = [
+    ("delivery_partners", "lat", "FLOAT"),
+    ("delivery_partners", "lon", "FLOAT"),
+    ("delivery_jobs", "offered_at", "TIMESTAMP"),
+]
+
+def _add_missing_columns(sync_conn):
+    inspector = inspect(sync_conn)
+    for table, column, ddl_type in ADDED_COLUMNS:
+        existing = {c["name"] for c in inspector.get_columns(table)}
+        if column not in existing:
+            # IF NOT EXISTS -- на випадок, коли кілька воркерів стартують одночасно
+            if_not_exists = "IF NOT EXISTS " if sync_conn.dialect.name == "postgresql" else ""
+            sync_conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {if_not_exists}{column} {ddl_type}"))
+            print(f"Додано колонку {table}.{column}")
+
 async def create_db_tables():
-    """Створює всі таблиці в БД (якщо їх немає)."""
+    """Створює всі таблиці в БД (якщо їх немає) та дописує нові колонки."""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
 
 async def get_db():
     """Залежність (Dependency) для FastAPI для отримання сесії БД."""
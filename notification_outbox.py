@@ -0,0 +1,293 @@
+import os
+import json
+import random
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from firebase_admin import messaging
+from sqlalchemy import select, update, delete, event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import bot_service
+import push_service
+from ws_manager import manager
+from models import OutboxMessage, async_session_maker
+
+# ==============================================================================
+# ЧЕРГА СПОВІЩЕНЬ (OUTBOX)
+# ==============================================================================
+# Обробник не відправляє сповіщення сам: він додає рядки notification_outbox у свою ж сесію,
+# і вони комітяться разом зі зміною замовлення (або не комітяться разом із нею). Після коміту
+# воркери цього процесу прокидаються одразу, інших -- протягом OUTBOX_POLL_SECONDS.
+#
+# Воркери -- окремо на кожен канал (ws / fcm / tg), по OUTBOX_WORKERS на канал. Рядок забирається
+# умовним UPDATE (next_attempt_at переноситься на OUTBOX_LEASE_SECONDS вперед), тож два воркери
+# не візьмуть один рядок, а рядок воркера, що впав посеред відправки, повернеться в чергу сам.
+# Невдача -- повтор з експоненційною затримкою, після OUTBOX_MAX_ATTEMPTS або при помилці,
+# яку повтор не виправить (токен застарів, бота заблоковано), -- status='failed'.
+#
+# idempotency_key: подія + канал + адресат ('job:12:picked_up:tg:partner'). Якщо сповіщення
+# з таким ключем уже відправлено (повторний запит, повторний статус), копія не йде (status='duplicate').
+
+WS, FCM, TG = "ws", "fcm", "tg"
+CHANNELS = (WS, FCM, TG)
+
+OUTBOX_WORKERS = int(os.environ.get("OUTBOX_WORKERS", "2"))
+OUTBOX_BATCH = 50
+OUTBOX_POLL_SECONDS = float(os.environ.get("OUTBOX_POLL_SECONDS", "1"))
+OUTBOX_LEASE_SECONDS = 60
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_SECONDS = 2.0
+OUTBOX_MAX_BACKOFF_SECONDS = 600.0
+# Скільки зберігаються відправлені рядки (це ж і вікно ідемпотентності), годин
+OUTBOX_KEEP_HOURS = float(os.environ.get("OUTBOX_KEEP_HOURS", "48"))
+
+# Помилки FCM, після яких повтор не допоможе
+FCM_PERMANENT_ERRORS = {"NOT_FOUND", "INVALID_ARGUMENT", "PERMISSION_DENIED", "FIREBASE_NOT_INITIALIZED"}
+
+
+class Undeliverable(Exception):
+    """Адресат недосяжний назавжди -- без повторів."""
+
+
+def backoff_seconds(attempts: int) -> float:
+    delay = min(OUTBOX_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0), OUTBOX_MAX_BACKOFF_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+class Outbox:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._wake: Dict[str, asyncio.Event] = {}
+        self._tasks: List[asyncio.Task] = []
+        self.counters = {ch: {"sent": 0, "retried": 0, "failed": 0, "duplicate": 0} for ch in CHANNELS}
+        self.lag_ms: Dict[str, float] = {ch: 0.0 for ch in CHANNELS}
+
+    # --- Постановка в чергу (у сесії обробника, до коміту) ---
+    def _add(self, db: AsyncSession, channel: str, role: Optional[str], target, payload, key: str):
+        if not target:
+            return
+        db.add(OutboxMessage(
+            channel=channel, role=role, target=str(target),
+            payload=json.dumps(payload, ensure_ascii=False),
+            idempotency_key=f"{key}:{channel}:{role or target}"[:150],
+        ))
+        db.sync_session.info.setdefault("outbox_channels", set()).add(channel)
+
+    def ws(self, db: AsyncSession, role: str, target_id: int, message: dict, key: str):
+        """WebSocket-повідомлення кур'єру / закладу (через шину ws_manager -- на будь-якому воркері)."""
+        self._add(db, WS, role, target_id, message, key)
+
+    def push(self, db: AsyncSession, role: str, token: str, title: str, body: str, key: str,
+             job_id: int = None, fee: float = None, url: str = None):
+        """FCM data-пуш; той самий вміст, що в send_push_to_couriers / send_push_to_partners."""
+        if role == "courier":
+            data = push_service.courier_data(title, body, job_id, fee)
+        else:
+            data = push_service.partner_data(title, body, url or "/partner/dashboard", job_id)
+        self._add(db, FCM, role, token, data, key)
+
+    def telegram(self, db: AsyncSession, chat_id: str, text: str, key: str):
+        self._add(db, TG, None, chat_id, {"text": text}, key)
+
+    def wake(self, channels):
+        for channel in channels:
+            if channel in self._wake:
+                self._wake[channel].set()
+
+    # --- Воркери ---
+    def start(self):
+        if self._tasks:
+            return
+        for channel in CHANNELS:
+            self._wake[channel] = asyncio.Event()
+            for _ in range(self.workers):
+                self._tasks.append(asyncio.create_task(self._worker(channel)))
+        self._tasks.append(asyncio.create_task(self._cleanup_loop()))
+        logging.info(f"Notification outbox started: {self.workers} workers per channel")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, channel: str):
+        wake = self._wake[channel]
+        while True:
+            try:
+                rows = await self._claim(channel)
+                if rows:
+                    await self._process(channel, rows)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Outbox {channel} worker error: {e}")
+            try:
+                await asyncio.wait_for(wake.wait(), OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            wake.clear()
+
+    async def _claim(self, channel: str) -> List[OutboxMessage]:
+        now = datetime.utcnow()
+        due = (
+            OutboxMessage.channel == channel,
+            OutboxMessage.status == "pending",
+            OutboxMessage.next_attempt_at <= now,
+        )
+        async with async_session_maker() as db:
+            ids = (await db.execute(
+                select(OutboxMessage.id).where(*due).order_by(OutboxMessage.id).limit(OUTBOX_BATCH)
+            )).scalars().all()
+            if not ids:
+                return []
+            # Рядки, які встиг забрати інший воркер, умову вже не пройдуть
+            rows = (await db.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.id.in_(ids), *due)
+                .values(next_attempt_at=now + timedelta(seconds=OUTBOX_LEASE_SECONDS),
+                        attempts=OutboxMessage.attempts + 1)
+                .returning(OutboxMessage)
+                .execution_options(synchronize_session=False)
+            )).scalars().all()
+            await db.commit()
+        return sorted(rows, key=lambda r: r.id)
+
+    async def _process(self, channel: str, rows: List[OutboxMessage]):
+        rows, duplicates, deferred = await self._drop_duplicates(rows)
+        results: List[Tuple[OutboxMessage, Optional[Exception]]] = []
+        if channel == FCM:
+            results = await self._send_fcm(rows)
+        else:
+            for row in rows:
+                try:
+                    await self._send_one(channel, row)
+                    results.append((row, None))
+                except Exception as e:
+                    results.append((row, e))
+        await self._finish(channel, results, duplicates, deferred)
+
+    async def _drop_duplicates(self, rows: List[OutboxMessage]) -> Tuple[List[OutboxMessage], List[int], List[int]]:
+        """Дублікат -- лише якщо рядок з таким ключем уже 'sent'. Двійник у тій самій пачці ще нічого
+        не відправив, тож другий рядок відкладається до наступного забору: або перший дійде
+        (і тоді другий -- дублікат), або ні (і тоді відправиться другий)."""
+        async with async_session_maker() as db:
+            sent_keys = set((await db.execute(
+                select(OutboxMessage.idempotency_key).where(
+                    OutboxMessage.idempotency_key.in_({r.idempotency_key for r in rows}),
+                    OutboxMessage.status == "sent",
+                )
+            )).scalars().all())
+        fresh, duplicates, deferred = [], [], []
+        batch_keys = set()
+        for row in rows:
+            if row.idempotency_key in sent_keys:
+                duplicates.append(row.id)
+            elif row.idempotency_key in batch_keys:
+                deferred.append(row.id)
+            else:
+                batch_keys.add(row.idempotency_key)
+                fresh.append(row)
+        return fresh, duplicates, deferred
+
+    async def _send_one(self, channel: str, row: OutboxMessage):
+        payload = json.loads(row.payload)
+        if channel == WS:
+            if row.role == "courier":
+                await manager.notify_courier(int(row.target), payload)
+            else:
+                await manager.notify_partner(int(row.target), payload)
+        elif channel == TG:
+            if not await bot_service.deliver_telegram_message(row.target, payload["text"]):
+                raise Undeliverable("telegram chat unavailable")
+
+    async def _send_fcm(self, rows: List[OutboxMessage]) -> List[Tuple[OutboxMessage, Optional[Exception]]]:
+        messages = [
+            messaging.Message(token=row.target, data=json.loads(row.payload),
+                              android=push_service.ANDROID_HIGH, apns=push_service.APNS_HIGH)
+            for row in rows
+        ]
+        results = await push_service.push.send_each(messages)
+        out = []
+        for row, r in zip(rows, results):
+            if r["ok"]:
+                out.append((row, None))
+            elif r["error"] in FCM_PERMANENT_ERRORS:
+                out.append((row, Undeliverable(r["error"])))
+            else:
+                out.append((row, Exception(r["error"])))
+        return out
+
+    async def _finish(self, channel: str, results: List[Tuple[OutboxMessage, Optional[Exception]]],
+                      duplicates: List[int], deferred: List[int]):
+        now = datetime.utcnow()
+        counters = self.counters[channel]
+        sent_ids = [row.id for row, error in results if error is None]
+        async with async_session_maker() as db:
+            if sent_ids:
+                await db.execute(update(OutboxMessage).where(OutboxMessage.id.in_(sent_ids)).values(status="sent", sent_at=now))
+            if duplicates:
+                await db.execute(update(OutboxMessage).where(OutboxMessage.id.in_(duplicates)).values(status="duplicate", sent_at=now))
+            if deferred:
+                # Знімаємо оренду без спроби: рядок повернеться в наступну пачку
+                await db.execute(update(OutboxMessage).where(OutboxMessage.id.in_(deferred))
+                                 .values(next_attempt_at=now, attempts=OutboxMessage.attempts - 1))
+            for row, error in results:
+                if error is None:
+                    continue
+                values = {"last_error": f"{type(error).__name__}: {error}"[:300]}
+                if isinstance(error, Undeliverable) or row.attempts >= OUTBOX_MAX_ATTEMPTS:
+                    values["status"] = "failed"
+                    counters["failed"] += 1
+                    logging.warning(f"Outbox #{row.id} ({channel}) failed after {row.attempts} attempts: {error}")
+                else:
+                    # Telegram сам каже, скільки чекати (TelegramRetryAfter.retry_after)
+                    delay = getattr(error, "retry_after", None) or backoff_seconds(row.attempts)
+                    values["next_attempt_at"] = now + timedelta(seconds=delay)
+                    counters["retried"] += 1
+                await db.execute(update(OutboxMessage).where(OutboxMessage.id == row.id).values(**values))
+            await db.commit()
+        counters["sent"] += len(sent_ids)
+        counters["duplicate"] += len(duplicates)
+        if sent_ids:
+            oldest = min(row.created_at for row, error in results if error is None)
+            self.lag_ms[channel] = round((now - oldest).total_seconds() * 1000, 1)
+
+    async def _cleanup_loop(self):
+        while True:
+            await asyncio.sleep(3600)
+            try:
+                async with async_session_maker() as db:
+                    await db.execute(delete(OutboxMessage).where(
+                        OutboxMessage.status != "pending",
+                        OutboxMessage.created_at < datetime.utcnow() - timedelta(hours=OUTBOX_KEEP_HOURS),
+                    ))
+                    await db.commit()
+            except Exception as e:
+                logging.error(f"Outbox cleanup error: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "workers_per_channel": self.workers,
+            "running": bool(self._tasks),
+            "channels": {ch: {**self.counters[ch], "last_lag_ms": self.lag_ms[ch]} for ch in CHANNELS},
+        }
+
+
+outbox = Outbox(OUTBOX_WORKERS)
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_outbox_workers(session):
+    channels = session.info.pop("outbox_channels", None)
+    if channels:
+        outbox.wake(channels)
+
+@event.listens_for(Session, "after_rollback")
+def _drop_outbox_channels(session):
+    session.info.pop("outbox_channels", None)
@@ -0,0 +1,267 @@
+import json
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import select
+from sqlalchemy import event
+from sqlalchemy.orm import Session, joinedload
+
+import geo_distance
+from models import DeliveryJob, DeliveryPartner, async_session_maker
+
+# Повне перечитування дошки з БД (страховка від масових UPDATE в обхід ORM), секунди
+BOARD_RESYNC_SECONDS = 300
+
+ACTIVE_STATUSES_EXCLUDED = ("delivered", "cancelled")
+
+
+def job_state(job: DeliveryJob) -> dict:
+    """Стан замовлення для дошки (job.partner має бути завантажений). Реплікується між воркерами як є."""
+    partner = job.partner
+    rest_lat = partner.lat if partner and partner.lat and partner.lon else None
+    rest_lon = partner.lon if partner and partner.lat and partner.lon else None
+    dist_trip = "?"
+    if rest_lat and job.dropoff_lat and job.dropoff_lon:
+        dist_trip = geo_distance.haversine_km(rest_lat, rest_lon, job.dropoff_lat, job.dropoff_lon)
+        dist_trip = round(dist_trip, 2) if dist_trip else "?"
+    return {
+        "id": job.id,
+        "status": job.status,
+        "courier_id": job.courier_id,
+        "target_courier_id": job.target_courier_id,
+        "partner_id": job.partner_id,
+        "rest_lat": rest_lat,
+        "rest_lon": rest_lon,
+        "card": {
+            "id": job.id,
+            "restaurant_name": partner.name if partner else "",
+            "restaurant_address": partner.address if partner else "",
+            "dropoff_address": job.dropoff_address,
+            "customer_name": job.customer_name,
+            "fee": job.delivery_fee,
+            "price": job.order_price,
+            "dist_trip": dist_trip,
+            "payment_type": job.payment_type,
+            "is_return": job.is_return_required,
+            "comment": job.comment,
+            "estimated_ready_at": job.estimated_ready_at.isoformat() + "Z" if job.estimated_ready_at else None,
+        },
+    }
+
+
+class BoardEntry:
+    """Відкрите замовлення на дошці: координати закладу і вже серіалізована картка без dist_to_rest."""
+    __slots__ = ("job_id", "partner_id", "rest_lat", "rest_lon", "card_prefix")
+
+    def __init__(self, state: dict):
+        self.job_id = state["id"]
+        self.partner_id = state["partner_id"]
+        self.rest_lat = state["rest_lat"]
+        self.rest_lon = state["rest_lon"]
+        # '{"id": 1, ..., "estimated_ready_at": null' -- dist_to_rest дописується для кожного кур'єра
+        self.card_prefix = json.dumps(state["card"], ensure_ascii=False)[:-1]
+
+
+class OrderBoard:
+    """
+    Дошка відкритих замовлень у пам'яті (pending, без персонального призначення) для /api/courier/open_orders.
+    Оновлюється з after_flush/after_commit (створення, прийняття, скасування, підняття ціни -- з будь-якого місця коду)
+    і реплікується між воркерами через шину ConnectionManager. Також знає, у кого з кур'єрів є активне замовлення.
+    """
+
+    def __init__(self):
+        self._open: Dict[int, BoardEntry] = {}
+        # courier_id -> активні замовлення (прийняті, ще не доставлені)
+        self._busy: Dict[int, Set[int]] = {}
+        self._job_courier: Dict[int, int] = {}
+        self._dirty: Set[int] = set()
+        self._dirty_partners: Set[int] = set()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._manager = None
+        self.ready = False
+        self.refreshes = 0
+
+    # --- Старт ---
+    def attach(self, ws_manager):
+        self._manager = ws_manager
+        ws_manager.subscribe("order_board", self.apply)
+        asyncio.create_task(self._resync_loop())
+
+    async def load(self):
+        """Повне перечитування: усі незавершені замовлення (відкриті та активні)."""
+        async with async_session_maker() as db:
+            jobs = (await db.execute(
+                select(DeliveryJob)
+                .options(joinedload(DeliveryJob.partner))
+                .where(DeliveryJob.status.notin_(ACTIVE_STATUSES_EXCLUDED))
+            )).scalars().all()
+        self._open.clear()
+        self._busy.clear()
+        self._job_courier.clear()
+        for job in jobs:
+            self._apply_state(job_state(job))
+        self.ready = True
+        logging.info(f"Order board: {len(self._open)} open, {len(self._job_courier)} active")
+
+    async def ensure_loaded(self):
+        if not self.ready:
+            await self.load()
+
+    async def _resync_loop(self):
+        while True:
+            await asyncio.sleep(BOARD_RESYNC_SECONDS)
+            try:
+                await self.load()
+            except Exception as e:
+                logging.error(f"Order board resync error: {e}")
+
+    # --- Зміни з БД (цей воркер) ---
+    def job_changed(self, job_id: int):
+        self._dirty.add(job_id)
+        self._schedule()
+
+    def partner_changed(self, partner_id: int):
+        self._dirty_partners.add(partner_id)
+        self._schedule()
+
+    def _schedule(self):
+        if self._refresh_task and not self._refresh_task.done():
+            return
+        try:
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh())
+        except RuntimeError:
+            pass
+
+    async def _refresh(self):
+        # Кілька комітів поспіль -- один запит
+        await asyncio.sleep(0)
+        while self._dirty or self._dirty_partners:
+            job_ids, self._dirty = self._dirty, set()
+            partner_ids, self._dirty_partners = self._dirty_partners, set()
+            job_ids |= {e.job_id for e in self._open.values() if e.partner_id in partner_ids}
+            if not job_ids:
+                continue
+            try:
+                async with async_session_maker() as db:
+                    jobs = (await db.execute(
+                        select(DeliveryJob)
+                        .options(joinedload(DeliveryJob.partner))
+                        .where(DeliveryJob.id.in_(job_ids))
+                    )).scalars().all()
+            except Exception as e:
+                logging.error(f"Order board refresh error: {e}")
+                continue
+            self.refreshes += 1
+            found = set()
+            for job in jobs:
+                found.add(job.id)
+                state = job_state(job)
+                self._apply_state(state)
+                self._replicate({"event": "job", "state": state})
+            for job_id in job_ids - found:
+                self._apply_remove(job_id)
+                self._replicate({"event": "remove", "id": job_id})
+
+    def _replicate(self, event: dict):
+        if not self._manager:
+            return
+        asyncio.create_task(self._manager.publish_event("order_board", event))
+
+    # --- Застосування (локально та з інших воркерів) ---
+    def _apply_state(self, state: dict):
+        job_id = state["id"]
+        if state["status"] == "pending" and state["target_courier_id"] is None:
+            self._open[job_id] = BoardEntry(state)
+        else:
+            self._open.pop(job_id, None)
+
+        old_courier = self._job_courier.pop(job_id, None)
+        if old_courier is not None:
+            self._release(old_courier, job_id)
+        if state["courier_id"] is not None and state["status"] not in ACTIVE_STATUSES_EXCLUDED:
+            self._job_courier[job_id] = state["courier_id"]
+            self._busy.setdefault(state["courier_id"], set()).add(job_id)
+
+    def _apply_remove(self, job_id: int):
+        self._open.pop(job_id, None)
+        courier_id = self._job_courier.pop(job_id, None)
+        if courier_id is not None:
+            self._release(courier_id, job_id)
+
+    def _release(self, courier_id: int, job_id: int):
+        jobs = self._busy.get(courier_id)
+        if jobs:
+            jobs.discard(job_id)
+            if not jobs:
+                del self._busy[courier_id]
+
+    async def apply(self, event: dict):
+        """Обробник змін дошки з інших воркерів."""
+        if event.get("event") == "job":
+            self._apply_state(event["state"])
+        elif event.get("event") == "remove":
+            self._apply_remove(event["id"])
+
+    # --- Запити ---
+    def is_open(self, job_id: int) -> bool:
+        """Замовлення ще чекає на кур'єра (pending, без персонального призначення)."""
+        return job_id in self._open or not self.ready
+
+    def entry(self, job_id: int) -> Optional[BoardEntry]:
+        return self._open.get(job_id)
+
+    def has_active_job(self, courier_id: int) -> bool:
+        return courier_id in self._busy
+
+    def busy_courier_ids(self) -> Set[int]:
+        return set(self._busy)
+
+    def open_orders_json(self, lat: float, lon: float) -> str:
+        """JSON-масив відкритих замовлень з dist_to_rest для цього кур'єра, найближчі першими."""
+        entries: List[BoardEntry] = list(self._open.values())
+        if not entries:
+            return "[]"
+        dists = geo_distance.to_km_list(geo_distance.distances_from(
+            lat, lon, [e.rest_lat for e in entries], [e.rest_lon for e in entries],
+        ))
+        order = sorted(range(len(entries)), key=lambda i: dists[i] if dists[i] is not None else 9999)
+        return "[" + ", ".join(
+            f'{entries[i].card_prefix}, "dist_to_rest": {json.dumps(dists[i])}}}' for i in order
+        ) + "]"
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "open": len(self._open),
+            "active": len(self._job_courier),
+            "busy_couriers": len(self._busy),
+            "refreshes": self.refreshes,
+        }
+
+
+board = OrderBoard()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_board_changes(session, flush_context):
+    """Запам'ятовує змінені замовлення/заклади; дошка оновлюється лише після коміту."""
+    jobs = session.info.setdefault("order_board_jobs", set())
+    partners = session.info.setdefault("order_board_partners", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, DeliveryJob) and obj.id is not None:
+            jobs.add(obj.id)
+        elif isinstance(obj, DeliveryPartner) and obj.id is not None:
+            partners.add(obj.id)
+
+@event.listens_for(Session, "after_commit")
+def _apply_board_changes(session):
+    for job_id in session.info.pop("order_board_jobs", ()):
+        board.job_changed(job_id)
+    for partner_id in session.info.pop("order_board_partners", ()):
+        board.partner_changed(partner_id)
+
+@event.listens_for(Session, "after_rollback")
+def _drop_board_changes(session):
+    session.info.pop("order_board_jobs", None)
+    session.info.pop("order_board_partners", None)
@@ -0,0 +1,39 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# after_commit з order_board (і admin_delivery) оновлює дошку і карту за session.info
+import order_board
+from models import DeliveryJob
+
+# ==============================================================================
+# ПРИЙНЯТТЯ ЗАМОВЛЕННЯ ОДНИМ УМОВНИМ UPDATE
+# ==============================================================================
+# Замість SELECT ... FOR UPDATE + перевірок під блокуванням: усі перевірки (відстань тощо) робляться
+# заздалегідь з даних у пам'яті, а саме "забрати" -- один UPDATE ... WHERE status='pending' RETURNING.
+# З кількох кур'єрів, що натиснули одночасно, рядок оновить лише перший; решта одразу отримають
+# "вже зайняте", не чекаючи в черзі на блокування.
+
+
+async def claim_job(db: AsyncSession, job_id: int, courier_id: int, now: datetime = None, commit: bool = True) -> Optional[int]:
+    """
+    Закріплює pending-замовлення за кур'єром. partner_id, або None, якщо замовлення вже зайняте.
+    commit=False -- коміт за викликачем (щоб у ту саму транзакцію потрапили сповіщення outbox).
+    """
+    res = await db.execute(
+        update(DeliveryJob)
+        .where(DeliveryJob.id == job_id, DeliveryJob.status == "pending")
+        .values(status="assigned", courier_id=courier_id, accepted_at=now or datetime.utcnow())
+        .returning(DeliveryJob.partner_id)
+        .execution_options(synchronize_session=False)
+    )
+    partner_id = res.scalar_one_or_none()
+    if partner_id is not None:
+        # UPDATE в обхід ORM -- дошці відкритих замовлень і карті операцій треба сказати явно (після коміту)
+        db.sync_session.info.setdefault("order_board_jobs", set()).add(job_id)
+        db.sync_session.info.setdefault("ops_map_jobs", set()).add(job_id)
+    if commit:
+        await db.commit()
+    return partner_id
@@ -9,8 +9,13 @@ from models import async_session_maker, DeliveryJob, Courier, DeliveryPartner, e
 # Импортируем сервис бота для отправки сообщений
 import bot_service
 
-# ИМПОРТ FCM ДЛЯ ОТПРАВКИ ПУШЕЙ ИЗ ФОНОВОЙ ЗАДАЧИ
+# Хто зараз зайнятий замовленням і хвилі розсилки
+import order_board
+import order_waves
+
+# ИМПОРТ FCM ДЛЯ ОТПРАВКИ ПУШЕЙ ИЗ ФОНОВОЙ ЗАДАЧИ (відправка -- пачками через push_service)
 from firebase_admin import messaging
+import push_service
 
 # Получаем ID админа для тревожных уведомлений (берем из окружения, как в app.py)
 ADMIN_CHAT_ID = os.environ.get("TG_CHAT_ID")
@@ -34,7 +39,7 @@ async def monitor_expired_motivators(db_session):
             # Уведомляем курьера о завершении бонуса
             if courier.telegram_chat_id:
                 tg_msg = f"ℹ️ <b>Бонус завершено</b>\nЧас дії вашої нагороди вийшов. Ваша комісія повернута до стандартної ({prog.old_commission}%)."
-                asyncio.create_task(bot_service.send_telegram_message(courier.telegram_chat_id, tg_msg))
+                asyncio.create_task(bot_service.send_telegram_message(courier.telegram_chat_id, tg_msg, bot_service.PRIORITY_BULK))
             
     if expired_bonuses:
         await db_session.commit()
@@ -73,6 +78,8 @@ async def monitor_stale_orders(ws_manager):
                 query_direct = select(DeliveryJob).options(joinedload(DeliveryJob.partner)).where(
                     DeliveryJob.status == "pending",
                     DeliveryJob.target_courier_id.is_not(None),
+                    # Пропозиції пакетного диспетчера (offered_at) він прострочує сам
+                    DeliveryJob.offered_at.is_(None),
                     DeliveryJob.created_at <= time_1_min_ago
                 )
                 ignored_jobs = (await db.execute(query_direct)).scalars().all()
@@ -101,20 +108,33 @@ async def monitor_stale_orders(ws_manager):
                 time_5_min_ago = now - timedelta(minutes=5)
                 time_6_min_ago = now - timedelta(minutes=6)
                 
-                query_5 = select(DeliveryJob).where(
+                query_5 = select(DeliveryJob).options(joinedload(DeliveryJob.partner)).where(
                     DeliveryJob.status == "pending",
+                    # Замовлення з активною пропозицією пакетного диспетчера не розсилаємо
+                    DeliveryJob.offered_at.is_(None),
                     DeliveryJob.created_at <= time_5_min_ago,
                     DeliveryJob.created_at > time_6_min_ago
                 )
                 jobs_5 = (await db.execute(query_5)).scalars().all()
                 
                 if jobs_5:
-                    # Находим всех курьеров, которые онлайн
-                    online_couriers = (await db.execute(
-                        select(Courier).where(Courier.is_online == True)
-                    )).scalars().all()
+                    # Лише вільні кур'єри в радіусі останньої хвилі розсилки (order_waves), а не всі на зміні
+                    busy_ids = order_board.board.busy_courier_ids()
+                    final_wave = order_waves.broadcaster.waves[-1]
+                    hot_recipients = {
+                        job.id: [cid for cid, _ in order_waves.broadcaster.recipients(
+                            final_wave, job.partner.lat if job.partner else None, job.partner.lon if job.partner else None,
+                            busy_ids, last=True
+                        )]
+                        for job in jobs_5
+                    }
+                    hot_ids = set().union(*hot_recipients.values())
+                    couriers_by_id = {c.id: c for c in (await db.execute(
+                        select(Courier).where(Courier.id.in_(hot_ids))
+                    )).scalars().all()} if hot_ids else {}
                     
                     for job in jobs_5:
+                        online_couriers = [couriers_by_id[cid] for cid in hot_recipients[job.id] if cid in couriers_by_id]
                         msg_title = "🔥 ГАРЯЧЕ ЗАМОВЛЕННЯ!"
                         
                         # Текст для Telegram
@@ -130,31 +150,19 @@ async def monitor_stale_orders(ws_manager):
 
                         for courier in online_couriers:
                             # 1. Отправка в Telegram (если привязан)
+                            # (у фоні: черга bot_service розкладає відправку за лімітами Telegram)
                             if courier.telegram_chat_id:
-                                await bot_service.send_telegram_message(
+                                asyncio.create_task(bot_service.send_telegram_message(
                                     courier.telegram_chat_id, 
                                     f"🔥 <b>ГАРЯЧЕ ЗАМОВЛЕННЯ!</b>\n{msg_body_tg}"
-                                )
-                            
-                            # 2. Отправка Firebase Push Notification (Android / PWA)
-                            if courier.fcm_token:
-                                try:
-                                    push_msg = messaging.Message(
-                                        token=courier.fcm_token,
-                                        notification=messaging.Notification(
-                                            title=msg_title, 
-                                            body=msg_body_push
-                                        ),
-                                        data={
-                                            "url": "/courier/app", 
-                                            "job_id": str(job.id), 
-                                            "fee": str(job.delivery_fee)
-                                        },
-                                        android=messaging.AndroidConfig(priority='high', ttl=0)
-                                    )
-                                    messaging.send(push_msg)
-                                except Exception as e:
-                                    logging.error(f"FCM Monitor Error (Courier {courier.id}): {e}")
+                                ))
+                        
+                        # 2. Firebase Push Notification (Android / PWA) -- одним multicast на всіх
+                        await push_service.push.send_multicast(
+                            [c.fcm_token for c in online_couriers],
+                            data={"url": "/courier/app", "job_id": str(job.id), "fee": str(job.delivery_fee)},
+                            notification=messaging.Notification(title=msg_title, body=msg_body_push)
+                        )
                         
                         logging.info(f"Order #{job.id}: Sent HOT notification to {len(online_couriers)} couriers.")
 
@@ -172,6 +180,7 @@ async def monitor_stale_orders(ws_manager):
                     DeliveryJob.created_at > time_11_min_ago
                 )
                 jobs_10 = (await db.execute(query_10)).scalars().all()
+                partner_pushes = []
                 
                 for job in jobs_10:
                     if job.partner:
@@ -185,24 +194,20 @@ async def monitor_stale_orders(ws_manager):
                             )
                             await bot_service.send_telegram_message(job.partner.telegram_chat_id, partner_msg)
                         
-                        # 2.2. Уведомление Партнеру через Firebase Push Notification
+                        # 2.2. Уведомление Партнеру через Firebase Push Notification (відправка пачкою після циклу)
                         if job.partner.fcm_token:
-                            try:
-                                push_msg = messaging.Message(
-                                    token=job.partner.fcm_token,
-                                    notification=messaging.Notification(
-                                        title="⚠️ Увага: Затримка замовлення",
-                                        body=f"Замовлення #{job.id} не можуть забрати вже 10 хв. Збільште ціну доставки!"
-                                    ),
-                                    data={
-                                        "url": "/partner/dashboard", 
-                                        "job_id": str(job.id)
-                                    },
-                                    android=messaging.AndroidConfig(priority='high', ttl=0)
-                                )
-                                messaging.send(push_msg)
-                            except Exception as e:
-                                logging.error(f"FCM Monitor Error (Partner {job.partner.id}): {e}")
+                            partner_pushes.append(messaging.Message(
+                                token=job.partner.fcm_token,
+                                notification=messaging.Notification(
+                                    title="⚠️ Увага: Затримка замовлення",
+                                    body=f"Замовлення #{job.id} не можуть забрати вже 10 хв. Збільште ціну доставки!"
+                                ),
+                                data={
+                                    "url": "/partner/dashboard", 
+                                    "job_id": str(job.id)
+                                },
+                                android=push_service.ANDROID_HIGH
+                            ))
                     
                     # 2.3. Уведомление Главному Админу в Telegram
                     if ADMIN_CHAT_ID:
@@ -216,6 +221,9 @@ async def monitor_stale_orders(ws_manager):
                         await bot_service.send_telegram_message(ADMIN_CHAT_ID, admin_msg)
                         
                     logging.warning(f"Order #{job.id}: Sent STALE warning to Partner and Admin.")
+                
+                if partner_pushes:
+                    await push_service.push.send_each(partner_pushes)
 
                 # =======================================================
                 # СЦЕНАРІЙ 3: АВТОМАТИЧНЕ ПІДТВЕРДЖЕННЯ ГОТОВНОСТІ
@@ -228,6 +236,7 @@ async def monitor_stale_orders(ws_manager):
                     DeliveryJob.status.in_(["pending", "assigned", "arrived_pickup"])
                 )
                 jobs_to_ready = (await db.execute(ready_query)).scalars().all()
+                ready_pushes = []
                 
                 for job in jobs_to_ready:
                     job.ready_at = now # Автоматично маркуємо готовим
@@ -244,19 +253,15 @@ async def monitor_stale_orders(ws_manager):
                                 f"🍳 <b>Замовлення #{job.id} готове!</b>\nЧас приготування (таймер) вийшов. Можете забирати пакунок."
                             )
                         if job.courier.fcm_token:
-                            try:
-                                push_msg = messaging.Message(
-                                    token=job.courier.fcm_token,
-                                    notification=messaging.Notification(
-                                        title="🍳 Замовлення готове!",
-                                        body="Час приготування вийшов. Можете забирати."
-                                    ),
-                                    data={"url": "/courier/app", "job_id": str(job.id)},
-                                    android=messaging.AndroidConfig(priority='high', ttl=0)
-                                )
-                                messaging.send(push_msg)
-                            except Exception:
-                                pass
+                            ready_pushes.append(messaging.Message(
+                                token=job.courier.fcm_token,
+                                notification=messaging.Notification(
+                                    title="🍳 Замовлення готове!",
+                                    body="Час приготування вийшов. Можете забирати."
+                                ),
+                                data={"url": "/courier/app", "job_id": str(job.id)},
+                                android=push_service.ANDROID_HIGH
+                            ))
                                 
                     # Сповіщаємо заклад про автоматичну зміну
                     if job.partner_id and job.partner:
@@ -268,6 +273,8 @@ async def monitor_stale_orders(ws_manager):
                 if jobs_to_ready:
                     await db.commit()
                     logging.info(f"Auto-marked {len(jobs_to_ready)} orders as ready.")
+                if ready_pushes:
+                    await push_service.push.send_each(ready_pushes)
 
         except Exception as e:
             logging.error(f"❌ Помилка в order_monitor: {e}")
@@ -0,0 +1,117 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Set, Tuple
+
+import presence
+import order_board
+
+# ==============================================================================
+# РОЗСИЛКА НОВОГО ЗАМОВЛЕННЯ ХВИЛЯМИ
+# ==============================================================================
+# Замість одночасної розсилки всім вільним кур'єрам у радіусі: спершу K найближчим,
+# через T секунд -- наступним у більшому радіусі і так далі. Кожен кур'єр отримує замовлення
+# не більше одного разу; щойно замовлення прийняли, скасували або віддали персонально
+# (зникло з дошки відкритих замовлень), наступні хвилі не відправляються.
+# Кур'єри без свіжої позиції отримують замовлення лише в останній хвилі.
+#
+# ORDER_WAVES: "K:радіус_км:через_секунд,..."; K=0 -- усі в радіусі.
+
+ORDER_WAVES = os.environ.get("ORDER_WAVES", "5:3:0,15:7:30,0:20:75")
+
+# recipients: [(courier_id, відстань_до_закладу або "?")]
+SendWave = Callable[[List[Tuple[int, object]]], Awaitable[None]]
+
+
+class Wave:
+    __slots__ = ("limit", "radius_km", "after_s")
+
+    def __init__(self, limit: int, radius_km: float, after_s: float):
+        self.limit = limit
+        self.radius_km = radius_km
+        self.after_s = after_s
+
+
+def parse_waves(spec: str) -> List[Wave]:
+    waves = []
+    for part in spec.split(","):
+        limit, radius_km, after_s = part.strip().split(":")
+        waves.append(Wave(int(limit), float(radius_km), float(after_s)))
+    return sorted(waves, key=lambda w: w.after_s)
+
+
+class WaveBroadcaster:
+    def __init__(self, waves: List[Wave]):
+        self.waves = waves
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self.jobs = 0
+        self.waves_sent = 0
+        self.notified = 0
+        self.stopped_early = 0
+
+    def recipients(self, wave: Wave, lat, lon, exclude: Set[int], last: bool) -> List[Tuple[int, object]]:
+        """Вільні кур'єри на зміні для цієї хвилі, найближчі першими."""
+        found: List[Tuple[int, object]] = []
+        if lat and lon:
+            found = presence.registry.couriers_near(lat, lon, wave.radius_km, exclude=exclude, limit=wave.limit or None)
+        if last or not (lat and lon):
+            grid = presence.registry.grid
+            found += [(cid, "?") for cid in presence.registry.on_shift_ids() - exclude
+                      if not (lat and lon) or not grid.is_fresh(cid)]
+        return found
+
+    async def start(self, job_id: int, lat, lon, send: SendWave):
+        """Перша хвиля -- одразу (в межах виклику), решта -- у фоні. Повторний старт для job_id скасовує попередні хвилі."""
+        previous = self._tasks.pop(job_id, None)
+        if previous:
+            previous.cancel()
+        self.jobs += 1
+        # Без координат закладу хвилі за відстанню неможливі -- одна розсилка всім вільним
+        waves = self.waves if lat and lon else self.waves[-1:]
+        notified: Set[int] = set()
+        await self._send_wave(job_id, waves[0], lat, lon, notified, send, last=len(waves) == 1)
+        if len(waves) > 1:
+            task = asyncio.create_task(self._run_rest(job_id, waves, lat, lon, notified, send))
+            self._tasks[job_id] = task
+            task.add_done_callback(lambda t: self._forget(job_id, t))
+
+    def _forget(self, job_id: int, task: asyncio.Task):
+        if self._tasks.get(job_id) is task:
+            del self._tasks[job_id]
+
+    async def _run_rest(self, job_id: int, waves: List[Wave], lat, lon, notified: Set[int], send: SendWave):
+        started = time.monotonic()
+        for i, wave in enumerate(waves[1:], 1):
+            await asyncio.sleep(max(0.0, started + wave.after_s - waves[0].after_s - time.monotonic()))
+            if not order_board.board.is_open(job_id):
+                self.stopped_early += 1
+                return
+            try:
+                await self._send_wave(job_id, wave, lat, lon, notified, send, last=i == len(waves) - 1)
+            except Exception as e:
+                logging.error(f"Order #{job_id}: wave {i + 1} error: {e}")
+
+    async def _send_wave(self, job_id: int, wave: Wave, lat, lon, notified: Set[int], send: SendWave, last: bool):
+        exclude = notified | order_board.board.busy_courier_ids()
+        recipients = self.recipients(wave, lat, lon, exclude, last)
+        if not recipients:
+            return
+        notified.update(cid for cid, _ in recipients)
+        self.waves_sent += 1
+        self.notified += len(recipients)
+        await send(recipients)
+
+    def stats(self) -> dict:
+        return {
+            "waves": [f"{w.limit or 'all'} within {w.radius_km:g} km after {w.after_s:g}s" for w in self.waves],
+            "running": len(self._tasks),
+            "jobs": self.jobs,
+            "waves_sent": self.waves_sent,
+            "couriers_notified": self.notified,
+            "stopped_early": self.stopped_early,
+            "notified_per_job": round(self.notified / self.jobs, 2) if self.jobs else 0.0,
+        }
+
+
+broadcaster = WaveBroadcaster(parse_waves(ORDER_WAVES))
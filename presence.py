@@ -0,0 +1,286 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Optional, Set
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Courier
+from courier_index import CourierGrid
+import geo_distance
+
+# Після скількох секунд без ping вважаємо з'єднання "зависшим" (клієнт шле ping кожні 30 с)
+HEARTBEAT_STALE_SECONDS = 90
+
+# Позиція реплікується іншим воркерам не частіше, ніж раз на N секунд (або при зсуві > M метрів)
+POSITION_PUBLISH_SECONDS = 15
+POSITION_PUBLISH_METERS = 50
+# Ping реплікується не частіше, ніж раз на N секунд: іншим воркерам last_heartbeat потрібен лише
+# для статистики, і він має бути свіжішим за HEARTBEAT_STALE_SECONDS (позиція теж його оновлює)
+HEARTBEAT_PUBLISH_SECONDS = HEARTBEAT_STALE_SECONDS / 2
+
+
+def _distance_m(lat1, lon1, lat2, lon2) -> Optional[float]:
+    dist = geo_distance.haversine_km(lat1, lon1, lat2, lon2)
+    return dist * 1000 if dist is not None else None
+
+
+class CourierPresence:
+    """Стан одного кур'єра: зміна, WS-з'єднання, остання відома позиція."""
+    __slots__ = (
+        "courier_id", "on_shift", "connected", "client_type",
+        "connected_at", "last_heartbeat", "lat", "lon", "position_at",
+        "_published_at", "_published_lat", "_published_lon", "_heartbeat_published_at",
+    )
+
+    def __init__(self, courier_id: int):
+        self.courier_id = courier_id
+        self.on_shift = False
+        self.connected = False
+        self.client_type: Optional[str] = None
+        self.connected_at: Optional[datetime] = None
+        self.last_heartbeat: Optional[datetime] = None
+        self.lat: Optional[float] = None
+        self.lon: Optional[float] = None
+        self.position_at: Optional[datetime] = None
+        self._published_at: Optional[datetime] = None
+        self._published_lat: Optional[float] = None
+        self._published_lon: Optional[float] = None
+        self._heartbeat_published_at: Optional[datetime] = None
+
+    def to_dict(self) -> dict:
+        def iso(dt):
+            return dt.isoformat() + "Z" if dt else None
+        return {
+            "id": self.courier_id,
+            "on_shift": self.on_shift,
+            "connected": self.connected,
+            "client_type": self.client_type,
+            "connected_at": iso(self.connected_at),
+            "last_heartbeat": iso(self.last_heartbeat),
+            "lat": self.lat,
+            "lon": self.lon,
+            "position_at": iso(self.position_at),
+        }
+
+
+class PresenceRegistry:
+    """
+    Реєстр присутності кур'єрів у пам'яті.
+    Заповнюється з /ws/courier (connect/disconnect/ping/init_location) та перемикача зміни,
+    тому диспетчеризація не робить SELECT по Courier.is_online на кожну подію.
+    Між воркерами стан реплікується через шину ConnectionManager.
+    """
+
+    def __init__(self):
+        self._couriers: Dict[int, CourierPresence] = {}
+        self._on_shift: Set[int] = set()
+        self._connected: Set[int] = set()
+        # Просторовий індекс кур'єрів на зміні з відомою позицією (для радіусної диспетчеризації)
+        self.grid = CourierGrid()
+        self._manager = None
+
+    # --- Підключення до шини та початкове завантаження ---
+    def attach(self, ws_manager):
+        self._manager = ws_manager
+        ws_manager.subscribe("presence", self.apply)
+
+    async def load(self, db: AsyncSession):
+        """Одноразово підтягує кур'єрів на зміні з БД (під час старту)."""
+        rows = (await db.execute(
+            select(Courier.id, Courier.lat, Courier.lon, Courier.last_seen).where(Courier.is_online == True)
+        )).all()
+        for courier_id, lat, lon, last_seen in rows:
+            p = self._entry(courier_id)
+            p.on_shift = True
+            p.lat, p.lon, p.position_at = lat, lon, last_seen
+            self._on_shift.add(courier_id)
+            self._index(p)
+        logging.info(f"Presence: loaded {len(rows)} on-shift couriers")
+
+    def _entry(self, courier_id: int) -> CourierPresence:
+        p = self._couriers.get(courier_id)
+        if p is None:
+            p = self._couriers[courier_id] = CourierPresence(courier_id)
+        return p
+
+    def _gc(self, courier_id: int):
+        p = self._couriers.get(courier_id)
+        if p and not p.on_shift and not p.connected:
+            del self._couriers[courier_id]
+
+    def _index(self, p: CourierPresence):
+        if p.on_shift and p.lat is not None and p.lon is not None and p.position_at:
+            self.grid.update(p.courier_id, p.lat, p.lon, p.position_at)
+        else:
+            self.grid.remove(p.courier_id)
+
+    def _publish(self, event: dict):
+        if not self._manager:
+            return
+        try:
+            asyncio.get_running_loop().create_task(self._manager.publish_event("presence", event))
+        except RuntimeError:
+            pass
+
+    # --- Локальні події (з цього воркера) ---
+    def set_on_shift(self, courier_id: int, on_shift: bool):
+        self._apply_shift(courier_id, on_shift)
+        self._publish({"event": "shift", "id": courier_id, "on_shift": on_shift})
+
+    def connect(self, courier_id: int, client_type: str):
+        now = datetime.utcnow()
+        self._apply_connect(courier_id, client_type, now)
+        # Подія connect сама несе last_heartbeat
+        self._couriers[courier_id]._heartbeat_published_at = now
+        self._publish({"event": "connect", "id": courier_id, "client_type": client_type, "at": now.isoformat()})
+
+    def disconnect(self, courier_id: int):
+        self._apply_disconnect(courier_id)
+        self._publish({"event": "disconnect", "id": courier_id})
+
+    def heartbeat(self, courier_id: int):
+        now = datetime.utcnow()
+        p = self._apply_heartbeat(courier_id, now)
+        if p is None:
+            return
+        last = p._heartbeat_published_at
+        if last is None or (now - last).total_seconds() > HEARTBEAT_PUBLISH_SECONDS:
+            p._heartbeat_published_at = now
+            self._publish({"event": "heartbeat", "id": courier_id, "at": now.isoformat()})
+
+    def update_position(self, courier_id: int, lat: float, lon: float, at: datetime = None):
+        at = at or datetime.utcnow()
+        p = self._apply_position(courier_id, lat, lon, at)
+        # Не на зміні і не підключений -- позиція нікому не потрібна (вона є в БД)
+        if p is None:
+            return
+
+        moved = _distance_m(p._published_lat, p._published_lon, lat, lon)
+        if (p._published_at is None or moved is None or moved > POSITION_PUBLISH_METERS
+                or (at - p._published_at).total_seconds() > POSITION_PUBLISH_SECONDS):
+            p._published_at, p._published_lat, p._published_lon = at, lat, lon
+            if p.connected:
+                # Позиція на інших воркерах оновлює і last_heartbeat
+                p._heartbeat_published_at = at
+            self._publish({"event": "position", "id": courier_id, "lat": lat, "lon": lon, "at": at.isoformat()})
+
+    # --- Застосування подій (локальних і з інших воркерів) ---
+    def _apply_shift(self, courier_id: int, on_shift: bool):
+        p = self._entry(courier_id)
+        p.on_shift = on_shift
+        if on_shift:
+            self._on_shift.add(courier_id)
+        else:
+            self._on_shift.discard(courier_id)
+        self._index(p)
+        if not on_shift:
+            self._gc(courier_id)
+
+    def _apply_connect(self, courier_id: int, client_type: str, at: datetime):
+        p = self._entry(courier_id)
+        p.connected = True
+        p.client_type = client_type
+        p.connected_at = at
+        p.last_heartbeat = at
+        self._connected.add(courier_id)
+
+    def _apply_disconnect(self, courier_id: int):
+        p = self._couriers.get(courier_id)
+        if p:
+            p.connected = False
+            self._gc(courier_id)
+        self._connected.discard(courier_id)
+
+    def _apply_heartbeat(self, courier_id: int, at: datetime) -> Optional[CourierPresence]:
+        p = self._couriers.get(courier_id)
+        if p and p.connected:
+            p.last_heartbeat = at
+            return p
+        return None
+
+    def _apply_position(self, courier_id: int, lat: float, lon: float, at: datetime) -> Optional[CourierPresence]:
+        p = self._entry(courier_id)
+        p.lat, p.lon, p.position_at = lat, lon, at
+        if p.connected:
+            p.last_heartbeat = at
+        self._index(p)
+        self._gc(courier_id)
+        return self._couriers.get(courier_id)
+
+    async def apply(self, event: dict):
+        """Обробник подій присутності з інших воркерів."""
+        kind = event.get("event")
+        courier_id = event.get("id")
+        at = datetime.fromisoformat(event["at"]) if event.get("at") else datetime.utcnow()
+        if kind == "shift":
+            self._apply_shift(courier_id, bool(event.get("on_shift")))
+        elif kind == "connect":
+            self._apply_connect(courier_id, event.get("client_type"), at)
+        elif kind == "disconnect":
+            self._apply_disconnect(courier_id)
+        elif kind == "heartbeat":
+            self._apply_heartbeat(courier_id, at)
+        elif kind == "position":
+            self._apply_position(courier_id, event.get("lat"), event.get("lon"), at)
+
+    # --- Запити (O(1)) ---
+    def get(self, courier_id: int) -> Optional[CourierPresence]:
+        return self._couriers.get(courier_id)
+
+    def is_on_shift(self, courier_id: int) -> bool:
+        return courier_id in self._on_shift
+
+    def is_connected(self, courier_id: int) -> bool:
+        return courier_id in self._connected
+
+    def on_shift_ids(self) -> Set[int]:
+        """Кур'єри на зміні (аналог Courier.is_online == True)."""
+        return set(self._on_shift)
+
+    def connected_ids(self) -> Set[int]:
+        return set(self._connected)
+
+    def position(self, courier_id: int):
+        """(lat, lon, position_at) або (None, None, None)."""
+        p = self._couriers.get(courier_id)
+        if not p:
+            return None, None, None
+        return p.lat, p.lon, p.position_at
+
+    def couriers_near(self, lat: float, lon: float, radius_km: float,
+                      exclude=(), limit: Optional[int] = None):
+        """[(courier_id, відстань_км)] кур'єрів на зміні зі свіжою позицією в радіусі, найближчі першими."""
+        return self.grid.within(lat, lon, radius_km, limit=limit, exclude=exclude)
+
+    def stats(self) -> dict:
+        now = datetime.utcnow()
+        by_client: Dict[str, int] = {}
+        stale = 0
+        for courier_id in self._connected:
+            p = self._couriers[courier_id]
+            by_client[p.client_type or "unknown"] = by_client.get(p.client_type or "unknown", 0) + 1
+            if p.last_heartbeat and (now - p.last_heartbeat).total_seconds() > HEARTBEAT_STALE_SECONDS:
+                stale += 1
+        return {
+            "on_shift": len(self._on_shift),
+            "connected": len(self._connected),
+            "on_shift_not_connected": len(self._on_shift - self._connected),
+            "connected_not_on_shift": len(self._connected - self._on_shift),
+            "stale_heartbeat": stale,
+            "by_client_type": by_client,
+            "grid": self.grid.stats(),
+            "couriers": [p.to_dict() for p in self._couriers.values()],
+        }
+
+
+def detect_client_type(websocket) -> str:
+    """PWA або нативний Android-додаток (?client=android або User-Agent OkHttp)."""
+    client = (websocket.query_params.get("client") or "").lower()
+    if client in ("android", "pwa"):
+        return client
+    user_agent = (websocket.headers.get("user-agent") or "").lower()
+    return "android" if "okhttp" in user_agent else "pwa"
+
+
+registry = PresenceRegistry()
@@ -0,0 +1,128 @@
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import firebase_admin
+from firebase_admin import messaging
+
+# ==============================================================================
+# FCM-ПУШІ ПАЧКАМИ, БЕЗ БЛОКУВАННЯ EVENT LOOP
+# ==============================================================================
+# firebase_admin синхронний: кожен messaging.send -- HTTPS-запит до Google, і поки він іде,
+# стоїть увесь event loop (усі WebSocket, усі запити). Тут відправка йде у власному пулі потоків:
+# токени групуються по FCM_BATCH_SIZE (ліміт FCM -- 500) і йдуть через send_each / send_each_for_multicast,
+# пачки -- паралельно. Результат -- по одному запису на токен: {"token", "ok", "message_id" | "error"}.
+
+FCM_BATCH_SIZE = 500
+PUSH_WORKERS = int(os.environ.get("PUSH_WORKERS", "4"))
+
+# Однакові для всіх пушів налаштування доставки: без затримки, без зберігання на сервері FCM
+ANDROID_HIGH = messaging.AndroidConfig(priority='high', ttl=0)
+APNS_HIGH = messaging.APNSConfig(
+    headers={'apns-priority': '10'},
+    payload=messaging.APNSPayload(aps=messaging.Aps(content_available=True))
+)
+
+
+def courier_data(title: str, body: str, job_id: int = None, fee: float = None) -> Dict[str, str]:
+    """data-пуш для застосунку кур'єра (FCM приймає лише рядки)."""
+    return {
+        "title": title,
+        "body": body,
+        "url": "/courier/app",
+        "job_id": str(job_id) if job_id else "",
+        "fee": str(fee) if fee is not None else "0"
+    }
+
+
+def partner_data(title: str, body: str, url: str = "/partner/dashboard", job_id: int = None) -> Dict[str, str]:
+    data = {"title": title, "body": body, "url": url}
+    if job_id is not None:
+        data["job_id"] = str(job_id)
+    return data
+
+
+def _chunks(items: list, size: int) -> List[list]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _error_code(exc: Exception) -> str:
+    # FirebaseError.code: 'NOT_FOUND' (токен застарів), 'INVALID_ARGUMENT', 'UNAVAILABLE' ...
+    return getattr(exc, "code", None) or type(exc).__name__
+
+
+class PushService:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.sent = 0
+        self.failed = 0
+        self.batches = 0
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="fcm")
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    # --- Відправка ---
+    async def send_each(self, messages: List[messaging.Message]) -> List[Dict]:
+        """Різні повідомлення (у кожного свій token). Результати -- у тому ж порядку."""
+        messages = [m for m in messages if m.token]
+        batches = _chunks(messages, FCM_BATCH_SIZE)
+        results = await asyncio.gather(*(
+            self._run([m.token for m in batch], messaging.send_each, batch) for batch in batches
+        ))
+        return [r for batch in results for r in batch]
+
+    async def send_multicast(self, tokens: List[str], data: Dict[str, str],
+                             notification: messaging.Notification = None) -> List[Dict]:
+        """Одне повідомлення на багато токенів; порожні й повторні токени відкидаються."""
+        tokens = list(dict.fromkeys(t for t in tokens if t))
+        batches = [
+            messaging.MulticastMessage(tokens=batch, data=data, notification=notification,
+                                       android=ANDROID_HIGH, apns=APNS_HIGH)
+            for batch in _chunks(tokens, FCM_BATCH_SIZE)
+        ]
+        results = await asyncio.gather(*(
+            self._run(batch.tokens, messaging.send_each_for_multicast, batch) for batch in batches
+        ))
+        return [r for batch in results for r in batch]
+
+    async def _run(self, tokens: List[str], send, payload) -> List[Dict]:
+        if not firebase_admin._apps:
+            return [{"token": t, "ok": False, "error": "FIREBASE_NOT_INITIALIZED"} for t in tokens]
+        self.batches += 1
+        try:
+            response = await asyncio.get_running_loop().run_in_executor(self.executor, send, payload)
+        except Exception as e:
+            # Уся пачка не пішла (мережа, облікові дані) -- помилка однакова для кожного токена
+            logging.error(f"FCM batch error ({len(tokens)} tokens): {e}")
+            self.failed += len(tokens)
+            return [{"token": t, "ok": False, "error": _error_code(e)} for t in tokens]
+
+        results = []
+        for token, r in zip(tokens, response.responses):
+            if r.success:
+                results.append({"token": token, "ok": True, "message_id": r.message_id})
+            else:
+                results.append({"token": token, "ok": False, "error": _error_code(r.exception)})
+        self.sent += response.success_count
+        self.failed += response.failure_count
+        if response.failure_count:
+            errors = sorted({r["error"] for r in results if not r["ok"]})
+            logging.warning(f"FCM: {response.failure_count}/{len(tokens)} failed ({', '.join(errors)})")
+        return results
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "batches": self.batches, "sent": self.sent, "failed": self.failed}
+
+
+push = PushService(PUSH_WORKERS)
@@ -0,0 +1,222 @@
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import geo_distance
+
+# ==============================================================================
+# ПОРЯДОК ЗУПИНОК ДЛЯ КУР'ЄРА З КІЛЬКОМА ЗАМОВЛЕННЯМИ
+# ==============================================================================
+# Кожне замовлення -- ланцюжок зупинок, які треба пройти по черзі: заклад -> клієнт (-> заклад,
+# якщо треба повернути гроші). Уже забране замовлення починається з клієнта.
+# Мінімізується час до останньої зупинки: дорога зі швидкістю ROUTE_SPEED_KMH, очікування
+# готовності в закладі та ROUTE_STOP_MINUTES на кожній зупинці. Маршрут будується вставкою
+# найдешевшого місця для кожної зупинки, далі 2-opt і перенесення зупинок з перевіркою порядку,
+# поки є час (ROUTE_TIME_BUDGET_MS). Короткі маршрути (типові 2-3 замовлення) після цього
+# перевіряються точним перебором.
+
+ROUTE_SPEED_KMH = 20.0
+ROUTE_STOP_MINUTES = 3.0
+ROUTE_TIME_BUDGET_MS = float(os.environ.get("ROUTE_TIME_BUDGET_MS", "30"))
+# До стількох зупинок евристику добиває точний перебір (гілки з гіршим часом відсікаються)
+ROUTE_EXACT_STOPS = 8
+# Кеш маршруту: поки набір зупинок той самий, а кур'єр зрушив не більше ніж на ROUTE_CACHE_MOVE_KM
+ROUTE_CACHE_MOVE_KM = 0.3
+ROUTE_CACHE_SECONDS = 300
+ROUTE_CACHE_SIZE = 2000
+
+PICKUP, DROPOFF, RETURN = "pickup", "dropoff", "return"
+
+
+class Stop:
+    """Зупинка маршруту. ready_in -- через скільки хвилин замовлення буде готове (лише для pickup)."""
+    __slots__ = ("job_id", "kind", "lat", "lon", "ready_in", "info")
+
+    def __init__(self, job_id: int, kind: str, lat: float, lon: float, ready_in: float = 0.0, info: dict = None):
+        self.job_id = job_id
+        self.kind = kind
+        self.lat = lat
+        self.lon = lon
+        self.ready_in = ready_in
+        self.info = info or {}
+
+
+class _Problem:
+    """Матриця хвилин у дорозі (0 -- старт кур'єра) і попередник кожної зупинки в ланцюжку."""
+
+    def __init__(self, start: Tuple[float, float], stops: Sequence[Stop]):
+        self.stops = stops
+        lats = [start[0]] + [s.lat for s in stops]
+        lons = [start[1]] + [s.lon for s in stops]
+        km = geo_distance.distance_matrix(lats, lons, lats, lons)
+        if hasattr(km, "tolist"):
+            km = km.tolist()
+        self.km = km
+        self.minutes = [[d / ROUTE_SPEED_KMH * 60 for d in row] for row in km]
+        self.prev: List[Optional[int]] = [None] * (len(stops) + 1)
+        last_of_job: Dict[int, int] = {}
+        for i, stop in enumerate(stops, 1):
+            self.prev[i] = last_of_job.get(stop.job_id)
+            last_of_job[stop.job_id] = i
+
+    def duration(self, route: Sequence[int]) -> float:
+        """Хвилини від старту до завершення останньої зупинки."""
+        t, here = 0.0, 0
+        minutes, stops = self.minutes, self.stops
+        for i in route:
+            t += minutes[here][i]
+            ready_in = stops[i - 1].ready_in
+            if ready_in > t:
+                t = ready_in
+            t += ROUTE_STOP_MINUTES
+            here = i
+        return t
+
+    def feasible(self, route: Sequence[int]) -> bool:
+        seen = set()
+        for i in route:
+            p = self.prev[i]
+            if p is not None and p not in seen:
+                return False
+            seen.add(i)
+        return True
+
+
+def _insertion(problem: _Problem) -> List[int]:
+    """Зупинки по черзі ланцюжків; кожна -- у найдешевше місце після свого попередника."""
+    route: List[int] = []
+    for i in range(1, len(problem.stops) + 1):
+        p = problem.prev[i]
+        lo = route.index(p) + 1 if p is not None else 0
+        best, best_pos = None, len(route)
+        for pos in range(lo, len(route) + 1):
+            cost = problem.duration(route[:pos] + [i] + route[pos:])
+            if best is None or cost < best:
+                best, best_pos = cost, pos
+        route.insert(best_pos, i)
+    return route
+
+
+def _two_opt(problem: _Problem, route: List[int], deadline: float) -> List[int]:
+    """2-opt (розворот відрізка) і перенесення однієї зупинки, поки є покращення і час."""
+    best = problem.duration(route)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(len(route) - 1):
+            for j in range(i + 1, len(route)):
+                reversed_ = route[:i] + route[i:j + 1][::-1] + route[j + 1:]
+                moved = route[:i] + route[i + 1:j + 1] + [route[i]] + route[j + 1:]
+                back = route[:i] + [route[j]] + route[i:j] + route[j + 1:]
+                for candidate in (reversed_, moved, back):
+                    if not problem.feasible(candidate):
+                        continue
+                    cost = problem.duration(candidate)
+                    if cost < best - 1e-9:
+                        route, best, improved = candidate, cost, True
+            if time.perf_counter() >= deadline:
+                break
+    return route
+
+
+def _exact(problem: _Problem, route: List[int], deadline: float) -> List[int]:
+    """Перебір допустимих порядків з відсіканням; стартова межа -- маршрут евристики."""
+    n = len(route)
+    minutes, stops, prev = problem.minutes, problem.stops, problem.prev
+    best = [problem.duration(route), route]
+    path: List[int] = []
+    visited = [False] * (n + 1)
+
+    def dfs(here: int, t: float):
+        if len(path) == n:
+            if t < best[0] - 1e-9:
+                best[0], best[1] = t, list(path)
+            return
+        if time.perf_counter() >= deadline:
+            return
+        for i in range(1, n + 1):
+            if visited[i] or (prev[i] is not None and not visited[prev[i]]):
+                continue
+            arrive = max(t + minutes[here][i], stops[i - 1].ready_in) + ROUTE_STOP_MINUTES
+            if arrive >= best[0] - 1e-9:
+                continue
+            visited[i] = True
+            path.append(i)
+            dfs(i, arrive)
+            path.pop()
+            visited[i] = False
+
+    dfs(0, 0.0)
+    return best[1]
+
+
+def plan_route(start: Tuple[float, float], stops: Sequence[Stop],
+               time_budget_ms: float = ROUTE_TIME_BUDGET_MS) -> dict:
+    """
+    Порядок зупинок: {"stops": [{job_id, kind, lat, lon, leg_km, eta_min, ...info}], "total_km", "total_min"}.
+    Зупинки одного замовлення передаються в порядку ланцюжка (pickup, dropoff, return).
+    """
+    if not stops:
+        return {"stops": [], "total_km": 0.0, "total_min": 0.0}
+    deadline = time.perf_counter() + time_budget_ms / 1000
+    problem = _Problem(start, stops)
+    route = _two_opt(problem, _insertion(problem), deadline)
+    if len(stops) <= ROUTE_EXACT_STOPS:
+        route = _exact(problem, route, deadline)
+
+    result, t, here, total_km = [], 0.0, 0, 0.0
+    for i in route:
+        stop = stops[i - 1]
+        leg_km = problem.km[here][i]
+        total_km += leg_km
+        t += problem.minutes[here][i]
+        arrive = t
+        t = max(t, stop.ready_in) + ROUTE_STOP_MINUTES
+        result.append({
+            **stop.info, "job_id": stop.job_id, "kind": stop.kind, "lat": stop.lat, "lon": stop.lon,
+            "leg_km": round(leg_km, 2), "eta_min": round(arrive, 1),
+        })
+        here = i
+    return {"stops": result, "total_km": round(total_km, 2), "total_min": round(t, 1)}
+
+
+class RouteCache:
+    """Останній маршрут кур'єра; перераховується, коли змінились зупинки або кур'єр помітно зрушив."""
+
+    def __init__(self, max_size: int = ROUTE_CACHE_SIZE):
+        self.max_size = max_size
+        # courier_id -> (ключ зупинок, (lat, lon), створено, маршрут)
+        self._routes: "OrderedDict[int, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(stops: Sequence[Stop]) -> tuple:
+        return tuple((s.job_id, s.kind, round(s.lat, 5), round(s.lon, 5)) for s in stops)
+
+    def get(self, courier_id: int, stops: Sequence[Stop], start: Tuple[float, float]) -> Optional[dict]:
+        entry = self._routes.get(courier_id)
+        if entry:
+            key, position, created, route = entry
+            moved = geo_distance.haversine_km(position[0], position[1], start[0], start[1])
+            fresh = datetime.utcnow() - created <= timedelta(seconds=ROUTE_CACHE_SECONDS)
+            if key == self.key(stops) and moved is not None and moved <= ROUTE_CACHE_MOVE_KM and fresh:
+                self._routes.move_to_end(courier_id)
+                self.hits += 1
+                return route
+        self.misses += 1
+        return None
+
+    def put(self, courier_id: int, stops: Sequence[Stop], start: Tuple[float, float], route: dict):
+        self._routes[courier_id] = (self.key(stops), start, datetime.utcnow(), route)
+        self._routes.move_to_end(courier_id)
+        while len(self._routes) > self.max_size:
+            self._routes.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"cached": len(self._routes), "hits": self.hits, "misses": self.misses}
+
+
+route_cache = RouteCache()
@@ -1155,23 +1155,29 @@ def get_courier_pwa_html(courier, config):
 
             // --- WEBSOCKET ТА ОНОВЛЕННЯ ДАНИХ ---
             let pingInterval;
+            // Сесія WS: після реконекту сервер дошле лише пропущені події (після wsLastSeq)
+            let wsSession = null, wsLastSeq = 0;
+
+            // Повне оновлення даних (сервер не зміг дослати пропущене)
+            function resyncAfterReconnect() {{
+                if(isOnline && !activeJobId) {{
+                    fetchOpenOrders();
+                }} else if (activeJobId) {{
+                    checkActiveJob();
+                }}
+                checkDirectOffers();
+                fetchAnnouncements();
+            }}
 
             function initWebSocket() {{
                 const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-                ws = new WebSocket(`${{protocol}}//${{window.location.host}}/ws/courier`);
+                const resume = wsSession ? `?session=${{wsSession}}&last_seq=${{wsLastSeq}}` : '';
+                ws = new WebSocket(`${{protocol}}//${{window.location.host}}/ws/courier${{resume}}`);
                 
                 ws.onopen = () => {{
                     console.log("WS Connected");
                     if(currentLat && currentLon) sendLocationToWS();
                     
-                    if(isOnline && !activeJobId) {{
-                        fetchOpenOrders();
-                    }} else if (activeJobId) {{
-                        checkActiveJob();
-                    }}
-                    
-                    checkDirectOffers(); // <--- ДОБАВЛЕНО СЮДА
-                    
                     if(pingInterval) clearInterval(pingInterval);
                     pingInterval = setInterval(() => {{ if(ws.readyState === WebSocket.OPEN) ws.send("ping"); }}, 30000);
                 }};
@@ -1182,6 +1188,16 @@ def get_courier_pwa_html(courier, config):
                         const msg = JSON.parse(e.data);
                         console.log("WS MSG:", msg);
                         
+                        if(msg.type === 'session') {{
+                            wsSession = msg.session;
+                            if(msg.resync) {{
+                                wsLastSeq = msg.seq;
+                                resyncAfterReconnect();
+                            }}
+                            return;
+                        }}
+                        if(msg.seq) wsLastSeq = msg.seq;
+                        
                         if(msg.type === 'new_announcement') {{
                             renderAnnouncement(msg.data);
                             playNotifySound();
@@ -1241,12 +1257,13 @@ def get_courier_pwa_html(courier, config):
                 if (document.visibilityState === "visible") {{
                     console.log("App became visible, updating data...");
                     if (!ws || ws.readyState !== WebSocket.OPEN) {{
+                        // Пропущене дошле сервер (або попросить resync)
                         initWebSocket();
                     }} else {{
                         if(isOnline && !activeJobId) fetchOpenOrders();
                         if(activeJobId) checkActiveJob();
+                        checkDirectOffers(); // <--- ДОБАВЛЕНО СЮДА
                     }}
-                    checkDirectOffers(); // <--- ДОБАВЛЕНО СЮДА
                 }}
             }});
 
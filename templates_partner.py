@@ -817,12 +817,15 @@ DASHBOARD_SCRIPT = """
     // --- WEBSOCKET ---
     let socket = null;
     let pingInterval = null;
+    // Сесія WS: після реконекту сервер дошле лише пропущені події (після wsLastSeq)
+    let wsSession = null, wsLastSeq = 0;
 
     function connectWS() {
         if (socket && (socket.readyState === WebSocket.OPEN || socket.readyState === WebSocket.CONNECTING)) return;
         
         const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-        socket = new WebSocket(`${protocol}//${window.location.host}/ws/partner`);
+        const resume = wsSession ? `?session=${wsSession}&last_seq=${wsLastSeq}` : '';
+        socket = new WebSocket(`${protocol}//${window.location.host}/ws/partner${resume}`);
 
         socket.onopen = () => {
             clearInterval(pingInterval);
@@ -836,6 +839,21 @@ DASHBOARD_SCRIPT = """
             if (event.data === "pong") return; // Ігноруємо відповідь на пінг
             
             const data = JSON.parse(event.data);
+            if (data.type === 'session') {
+                // Пропущене вже не дослати -- перезавантажуємо сторінку (але не при першому підключенні)
+                if (data.resync && wsSession) location.reload();
+                wsSession = data.session;
+                if (data.resync) wsLastSeq = data.seq;
+                // Підписка на трекінг живе в з'єднанні -- після реконекту поновлюємо її
+                if (trackedJobId) socket.send(JSON.stringify({type: 'track_courier', job_id: trackedJobId}));
+                return;
+            }
+            if (data.type === 'courier_track' || data.type === 'courier_location') {
+                if (data.job_id == trackedJobId) showCourierLocation(data);
+                return;
+            }
+            if (data.seq) wsLastSeq = data.seq;
+            
             if (data.type === 'order_update') {
                 alertSound.play().catch(e => {});
                 showToast(data.message);
@@ -1015,7 +1033,7 @@ DASHBOARD_SCRIPT = """
     function openRateModal(jobId) { document.getElementById('rate_job_id').value = jobId; document.getElementById('rateModal').style.display = 'flex'; }
     async function submitRating(e) { e.preventDefault(); const form = new FormData(e.target); try { await fetch('/api/partner/rate_courier', {method:'POST', body:form}); location.reload(); } catch(e) {} }
 
-    let map, courierMarker, trackInterval;
+    let map, courierMarker, trackInterval, trackedJobId = null;
     function openTrackModal(jobId) {
         document.getElementById('trackModal').style.display = 'flex';
         if(!map) {
@@ -1025,20 +1043,33 @@ DASHBOARD_SCRIPT = """
             }).addTo(map);
         }
         setTimeout(() => map.invalidateSize(), 150);
-        fetchLocation(jobId);
-        trackInterval = setInterval(() => fetchLocation(jobId), 5000);
+        trackedJobId = jobId;
+        if (socket && socket.readyState === WebSocket.OPEN) {
+            // Сервер сам шле позиції кур'єра через WebSocket
+            socket.send(JSON.stringify({type: 'track_courier', job_id: jobId}));
+        } else {
+            fetchLocation(jobId);
+            trackInterval = setInterval(() => fetchLocation(jobId), 5000);
+        }
+    }
+    function closeTrackModal() {
+        document.getElementById('trackModal').style.display = 'none';
+        clearInterval(trackInterval);
+        trackedJobId = null;
+        if (socket && socket.readyState === WebSocket.OPEN) socket.send(JSON.stringify({type: 'untrack_courier'}));
+    }
+    function showCourierLocation(data) {
+        if (data.name) document.getElementById('track-info').innerHTML = `🚴 <b>${data.name}</b> • ${data.job_status}`;
+        if (!data.lat) return;
+        const pos = [data.lat, data.lon];
+        if(!courierMarker) courierMarker = L.marker(pos).addTo(map); else courierMarker.setLatLng(pos);
+        map.setView(pos, 15);
     }
-    function closeTrackModal() { document.getElementById('trackModal').style.display = 'none'; clearInterval(trackInterval); }
     async function fetchLocation(jobId) {
         try {
             const res = await fetch(`/api/partner/track_courier/${jobId}`);
             const data = await res.json();
-            if(data.status === 'ok' && data.lat) {
-                document.getElementById('track-info').innerHTML = `🚴 <b>${data.name}</b> • ${data.job_status}`;
-                const pos = [data.lat, data.lon];
-                if(!courierMarker) courierMarker = L.marker(pos).addTo(map); else courierMarker.setLatLng(pos);
-                map.setView(pos, 15);
-            }
+            if(data.status === 'ok') showCourierLocation(data);
         } catch(e) {}
     }
 
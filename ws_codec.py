@@ -0,0 +1,153 @@
+import json
+import logging
+from typing import Dict, List, Optional, Tuple, Union
+
+try:
+    import msgpack
+except ImportError:  # Опціональна залежність: без неї працює лише JSON
+    msgpack = None
+
+# ==============================================================================
+# КОМПАКТНИЙ БІНАРНИЙ ПРОТОКОЛ WEBSOCKET (msgpack + словник ключів)
+# ==============================================================================
+# Клієнт вмикає його заголовком Sec-WebSocket-Protocol: restify.msgpack.v1
+# (new WebSocket(url, ["restify.msgpack.v1"]) або OkHttp .header("Sec-WebSocket-Protocol", ...)).
+# Без нього сервер, як і раніше, шле JSON-текст -- старі збірки Android не зачіпаються.
+#
+# Формат кадру: binary msgpack, у якому відомі ключі словників замінені їхнім номером
+# у KEY_DICTIONARY. Невідомі ключі передаються рядком. "pong" лишається текстовим кадром.
+# Словник та аліаси віддаються ендпоінтом GET /api/ws/protocol.
+
+MSGPACK_SUBPROTOCOL = "restify.msgpack.v1"
+
+# ТІЛЬКИ ДОПИСУВАТИ В КІНЕЦЬ: номер ключа = його індекс
+KEY_DICTIONARY: List[str] = [
+    "type", "data", "seq", "id", "job_id", "status", "message", "text", "role", "time",
+    "status_text", "status_color", "courier_name",
+    "address", "dropoff_address", "restaurant", "restaurant_name", "restaurant_address",
+    "customer_name", "customer_phone", "fee", "price", "comment", "payment_type",
+    "is_return", "estimated_ready_at", "dist_to_rest", "dist_trip",
+    "session", "resync", "replayed", "lat", "lon", "title", "style",
+]
+
+# Дубльовані для PWA ключі: якщо значення збігається з канонічним ключем (Android-модель),
+# у бінарному кадрі передається лише канонічний. Клієнт відновлює аліас сам.
+ALIASES = {"restaurant": "restaurant_name", "address": "dropoff_address"}
+
+_KEY_CODES = {key: code for code, key in enumerate(KEY_DICTIONARY)}
+
+
+def _compact(obj):
+    if isinstance(obj, dict):
+        out = {}
+        for key, value in obj.items():
+            canonical = ALIASES.get(key)
+            if canonical is not None and canonical in obj and obj[canonical] == value:
+                continue
+            out[_KEY_CODES.get(key, key)] = _compact(value)
+        return out
+    if isinstance(obj, list):
+        return [_compact(v) for v in obj]
+    return obj
+
+
+def _expand(obj):
+    if isinstance(obj, dict):
+        out = {}
+        for key, value in obj.items():
+            name = KEY_DICTIONARY[key] if isinstance(key, int) and 0 <= key < len(KEY_DICTIONARY) else key
+            out[name] = _expand(value)
+        for alias, canonical in ALIASES.items():
+            if canonical in out and alias not in out:
+                out[alias] = out[canonical]
+        return out
+    if isinstance(obj, list):
+        return [_expand(v) for v in obj]
+    return obj
+
+
+def msgpack_available() -> bool:
+    return msgpack is not None
+
+
+def pack(message: dict) -> bytes:
+    """dict -> бінарний кадр протоколу restify.msgpack.v1."""
+    return msgpack.packb(_compact(message), use_bin_type=True)
+
+
+def unpack(frame: bytes) -> dict:
+    """Зворотне перетворення (для клієнтів на Python, тестів та бенчмарку)."""
+    return _expand(msgpack.unpackb(frame, raw=False, strict_map_key=False))
+
+
+def encode_frame(text: str) -> Union[str, bytes]:
+    """
+    Перекодовує вже серіалізований JSON-кадр у msgpack.
+    Службові текстові кадри ("pong") лишаються текстом.
+    """
+    if not text.startswith("{"):
+        return text
+    try:
+        return pack(json.loads(text))
+    except (ValueError, TypeError) as e:
+        logging.error(f"WS msgpack encode error: {e}")
+        return text
+
+
+def _map_header(size: int) -> bytes:
+    if size < 16:
+        return bytes([0x80 | size])
+    if size < 0x10000:
+        return b"\xde" + size.to_bytes(2, "big")
+    return b"\xdf" + size.to_bytes(4, "big")
+
+
+def _split_map(frame: bytes) -> Optional[Tuple[int, bytes]]:
+    """Бінарний кадр-словник -> (кількість пар, байти пар без заголовка)."""
+    first = frame[0] if frame else 0
+    if 0x80 <= first <= 0x8f:
+        return first & 0x0f, frame[1:]
+    if first == 0xde:
+        return int.from_bytes(frame[1:3], "big"), frame[3:]
+    if first == 0xdf:
+        return int.from_bytes(frame[1:5], "big"), frame[5:]
+    return None
+
+
+class FrameCache:
+    """
+    Бінарні кадри однієї розсилки: кожен різний текст пакується один раз,
+    а "seq" отримувача дописується до вже запакованих пар словника.
+    """
+
+    def __init__(self):
+        self._bodies: Dict[str, Optional[Tuple[int, bytes]]] = {}
+
+    def frame(self, text: str, seq: Optional[int] = None) -> Optional[bytes]:
+        """Кадр для тексту без "seq" або None -- тоді з'єднання перекодує текст саме."""
+        if text not in self._bodies:
+            frame = encode_frame(text)
+            self._bodies[text] = _split_map(frame) if isinstance(frame, bytes) else None
+        body = self._bodies[text]
+        if body is None:
+            return None
+        size, pairs = body
+        if seq is None:
+            return _map_header(size) + pairs
+        return _map_header(size + 1) + msgpack.packb(_KEY_CODES["seq"]) + msgpack.packb(seq) + pairs
+
+
+def choose_subprotocol(offered: List[str]) -> Optional[str]:
+    """Підпротокол для websocket.accept(): msgpack лише на запит клієнта і якщо бібліотека встановлена."""
+    if MSGPACK_SUBPROTOCOL in (offered or []) and msgpack is not None:
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+
+def protocol_description() -> dict:
+    return {
+        "default": "json",
+        "subprotocols": [MSGPACK_SUBPROTOCOL] if msgpack is not None else [],
+        "keys": KEY_DICTIONARY,
+        "aliases": ALIASES,
+    }
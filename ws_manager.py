@@ -0,0 +1,662 @@
+import os
+import json
+import uuid
+import asyncio
+import logging
+import itertools
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Dict, List, Optional, Callable, Awaitable, Iterable, Tuple, Union
+from fastapi import WebSocket
+
+import ws_codec
+
+# --- Налаштування шини повідомлень між воркерами ---
+# memory   -- один процес (за замовчуванням, та для тестів)
+# postgres -- Postgres LISTEN/NOTIFY, дозволяє запускати uvicorn з кількома воркерами
+WS_BROKER = os.environ.get("WS_BROKER", "memory").lower()
+WS_BROKER_CHANNEL = os.environ.get("WS_BROKER_CHANNEL", "restify_ws")
+
+# Postgres обмежує payload NOTIFY ~8000 байтами
+PG_NOTIFY_MAX_BYTES = 7900
+
+# Якщо один кадр не вдається відправити за цей час -- клієнт вважається завислим і відключається
+WS_SEND_TIMEOUT = float(os.environ.get("WS_SEND_TIMEOUT", "10.0"))
+
+# Максимальна кількість повідомлень у черзі одного з'єднання
+WS_QUEUE_SIZE = int(os.environ.get("WS_QUEUE_SIZE", "100"))
+
+# Скільки останніх подій зберігається для дошлення після реконекту
+WS_REPLAY_SIZE = int(os.environ.get("WS_REPLAY_SIZE", "100"))
+
+# Скільки секунд сесія відключеного клієнта чекає на його повернення
+WS_SESSION_TTL = int(os.environ.get("WS_SESSION_TTL", "300"))
+
+BrokerHandler = Callable[[dict], Awaitable[None]]
+
+
+# ==============================================================================
+# БРОКЕРИ (PUB/SUB)
+# ==============================================================================
+
+class InMemoryBroker:
+    """Брокер у межах одного процесу. Повідомлення одразу повертається обробнику."""
+
+    def __init__(self):
+        self._handler: Optional[BrokerHandler] = None
+
+    async def start(self, handler: BrokerHandler):
+        self._handler = handler
+
+    async def stop(self):
+        self._handler = None
+
+    async def publish(self, envelope: dict):
+        if self._handler:
+            await self._handler(envelope)
+
+
+class PostgresBroker:
+    """
+    Брокер на базі Postgres LISTEN/NOTIFY.
+    Кожен воркер слухає спільний канал і доставляє повідомлення лише тим сокетам,
+    які підключені саме до нього.
+    """
+
+    def __init__(self, dsn: str, channel: str = WS_BROKER_CHANNEL):
+        # SQLAlchemy URL (postgresql+asyncpg://) -> звичайний DSN для asyncpg
+        self.dsn = dsn.replace("postgresql+asyncpg://", "postgresql://", 1)
+        self.channel = channel
+        self._handler: Optional[BrokerHandler] = None
+        self._listen_conn = None
+        self._pool = None
+        self._closing = False
+
+    async def start(self, handler: BrokerHandler):
+        import asyncpg
+
+        self._handler = handler
+        self._closing = False
+        self._pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=4)
+        await self._listen()
+        logging.info(f"WS Broker: LISTEN {self.channel}")
+
+    async def _listen(self):
+        import asyncpg
+
+        self._listen_conn = await asyncpg.connect(self.dsn)
+        self._listen_conn.add_termination_listener(self._on_terminated)
+        await self._listen_conn.add_listener(self.channel, self._on_notify)
+
+    def _on_terminated(self, connection):
+        if self._closing:
+            return
+        logging.error("WS Broker: LISTEN connection lost, reconnecting...")
+        asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = 1
+        while not self._closing:
+            try:
+                await self._listen()
+                logging.info("WS Broker: LISTEN connection restored")
+                return
+            except Exception as e:
+                logging.error(f"WS Broker reconnect error: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            envelope = json.loads(payload)
+        except (json.JSONDecodeError, TypeError):
+            logging.error(f"WS Broker: invalid payload on {channel}")
+            return
+        if self._handler:
+            asyncio.create_task(self._handler(envelope))
+
+    async def stop(self):
+        self._closing = True
+        if self._listen_conn:
+            try:
+                await self._listen_conn.close()
+            except Exception:
+                pass
+        if self._pool:
+            await self._pool.close()
+
+    async def publish(self, envelope: dict):
+        payload = json.dumps(envelope, ensure_ascii=False)
+        if len(payload.encode("utf-8")) > PG_NOTIFY_MAX_BYTES:
+            # Занадто велике для NOTIFY -- доставляємо хоча б локальним сокетам
+            logging.warning(f"WS Broker: payload too large ({len(payload)} chars), local delivery only")
+            if self._handler:
+                await self._handler(envelope)
+            return
+        async with self._pool.acquire() as conn:
+            await conn.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+
+
+def create_broker():
+    """Створює брокер відповідно до змінної оточення WS_BROKER."""
+    if WS_BROKER == "postgres":
+        dsn = os.environ.get("DATABASE_URL")
+        if dsn and dsn.startswith("postgresql"):
+            return PostgresBroker(dsn)
+        logging.warning("WS_BROKER=postgres, але DATABASE_URL не Postgres. Використовується memory.")
+    return InMemoryBroker()
+
+
+# ==============================================================================
+# СЕРІАЛІЗАЦІЯ ДЛЯ МАСОВОЇ РОЗСИЛКИ
+# ==============================================================================
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False)
+
+
+class SharedPayloadEncoder:
+    """
+    Кодує спільну частину повідомлення один раз і дописує до неї
+    персональні поля кожного отримувача.
+
+    Персональні поля потрапляють в об'єкт "data" (якщо він є) або в корінь повідомлення.
+    Ключі патчів виключаються зі спільної частини, тому дублікатів у JSON немає.
+    """
+
+    def __init__(self, base_payload: dict, patch_keys: Iterable[str] = ()):
+        self.base_payload = base_payload
+        self.patch_keys = set(patch_keys)
+        self.nested = isinstance(base_payload.get("data"), dict)
+
+        target = base_payload["data"] if self.nested else base_payload
+        # Значення за замовчуванням для ключів, яких немає в патчі конкретного отримувача
+        self.defaults = {k: target[k] for k in self.patch_keys if k in target}
+        shared_body = _dumps({k: v for k, v in target.items() if k not in self.patch_keys})[1:-1]
+
+        if self.nested:
+            outer_body = _dumps({k: v for k, v in base_payload.items() if k != "data"})[1:-1]
+            self._head = (outer_body + ", " if outer_body else "") + '"data": {' + shared_body
+            self._tail = "}}"
+        else:
+            self._head = shared_body
+            self._tail = "}"
+        self._head_has_fields = bool(shared_body)
+        self._plain = "{" + self._head + self._tail
+
+    def encode(self, patch: Optional[dict] = None) -> str:
+        if not self.patch_keys:
+            return self._plain
+        fields = dict(self.defaults)
+        if patch:
+            fields.update(patch)
+        if not fields:
+            return self._plain
+        patch_body = _dumps(fields)[1:-1]
+        sep = ", " if self._head_has_fields else ""
+        return "{" + self._head + sep + patch_body + self._tail
+
+    def to_dict(self, patch: Optional[dict] = None) -> dict:
+        """Повне повідомлення для отримувача як dict (для брокера між воркерами)."""
+        fields = dict(self.defaults)
+        if patch:
+            fields.update(patch)
+        if self.nested:
+            return {**self.base_payload, "data": {**self.base_payload["data"], **fields}}
+        return {**self.base_payload, **fields}
+
+
+# ==============================================================================
+# ЧЕРГА ВІДПРАВКИ ДЛЯ ОДНОГО З'ЄДНАННЯ
+# ==============================================================================
+
+def coalesce_key(message: dict) -> Optional[str]:
+    """
+    Ключ злиття: нове повідомлення з тим самим ключем замінює ще не відправлене старе.
+    None -- повідомлення завжди ставиться в чергу (чат, персональні пропозиції тощо).
+    """
+    msg_type = message.get("type")
+    if msg_type == "order_update" and message.get("job_id") is not None:
+        return f"order_update:{message['job_id']}"
+    if msg_type == "new_order":
+        data = message.get("data") or {}
+        if data.get("id") is not None:
+            return f"new_order:{data['id']}"
+    if msg_type == "courier_location":
+        return f"courier_location:{message.get('job_id')}"
+    return None
+
+
+# Події, які не нумеруються і не потрапляють у буфер дошлення (після реконекту вони вже застарілі)
+EPHEMERAL_TYPES = {"courier_location", "courier_track"}
+
+
+class ClientConnection:
+    """
+    WS-з'єднання з власною обмеженою чергою та задачею-писачем.
+    Обробники HTTP-запитів лише кладуть повідомлення в чергу і не чекають на клієнта.
+    При переповненні відкидається найстаріше повідомлення (лічильник dropped).
+    Для клієнтів з підпротоколом msgpack (ws_codec) кадри перекодовуються при постановці в чергу,
+    якщо розсилка не передала вже готовий бінарний кадр (ws_codec.FrameCache).
+    """
+
+    def __init__(self, websocket: WebSocket, role: str, target_id: int,
+                 on_broken: Callable[["ClientConnection"], None], max_queue: int = WS_QUEUE_SIZE,
+                 subprotocol: Optional[str] = None):
+        self.websocket = websocket
+        self.role = role
+        self.target_id = target_id
+        self.max_queue = max_queue
+        self.subprotocol = subprotocol
+        self.binary = subprotocol == ws_codec.MSGPACK_SUBPROTOCOL
+        self.connected_at = datetime.utcnow()
+
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+        self._on_broken = on_broken
+        self._queue: "OrderedDict[object, Union[str, bytes]]" = OrderedDict()
+        self._unique = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self._writer = asyncio.create_task(self._run())
+
+    def enqueue(self, text: str, key: Optional[str] = None, frame: Optional[bytes] = None) -> str:
+        """Ставить вже серіалізоване повідомлення в чергу. Повертає "queued" або "coalesced"."""
+        if self._closed:
+            return "closed"
+        if self.binary:
+            text = frame if frame is not None else ws_codec.encode_frame(text)
+        if key is not None and key in self._queue:
+            self._queue[key] = text
+            # Новіший seq не може йти перед подіями, що вже стоять за старим кадром
+            self._queue.move_to_end(key)
+            self.coalesced += 1
+            return "coalesced"
+
+        if len(self._queue) >= self.max_queue:
+            # Спочатку жертвуємо станом, що оновлюється (order_update/new_order), а не чатом
+            victim = next((k for k in self._queue if isinstance(k, str)), None)
+            if victim is not None:
+                del self._queue[victim]
+            else:
+                self._queue.popitem(last=False)
+            self.dropped += 1
+            logging.warning(f"WS queue full ({self.role.capitalize()} {self.target_id}), dropped oldest message")
+
+        self._queue[key if key is not None else next(self._unique)] = text
+        self._wakeup.set()
+        return "queued"
+
+    async def _run(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            _, frame = self._queue.popitem(last=False)
+            send = self.websocket.send_bytes if isinstance(frame, bytes) else self.websocket.send_text
+            try:
+                await asyncio.wait_for(send(frame), timeout=WS_SEND_TIMEOUT)
+                self.sent += 1
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                logging.error(f"WS stalled ({self.role.capitalize()} {self.target_id}), closing connection")
+                self._on_broken(self)
+                return
+            except Exception as e:
+                logging.error(f"WS Error ({self.role.capitalize()} {self.target_id}): {e}")
+                self._on_broken(self)
+                return
+
+    def stop(self):
+        """Зупиняє писача без закриття сокета (коли клієнт вже відключився сам)."""
+        self._closed = True
+        self._queue.clear()
+        if self._writer is not asyncio.current_task():
+            self._writer.cancel()
+
+    async def close(self):
+        self.stop()
+        try:
+            await self.websocket.close()
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "id": self.target_id,
+            "connected_at": self.connected_at.isoformat() + "Z",
+            "protocol": self.subprotocol or "json",
+            "queued": len(self._queue),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
+
+
+# ==============================================================================
+# СЕСІЇ З ДОШЛЕННЯМ ПРОПУЩЕНИХ ПОДІЙ
+# ==============================================================================
+
+def _with_seq(seq: int, text: str) -> str:
+    """Дописує "seq" у вже серіалізований JSON-об'єкт без повторної серіалізації."""
+    body = text[1:]
+    return '{"seq": %d%s%s' % (seq, "" if body.lstrip().startswith("}") else ", ", body)
+
+
+class ReplaySession:
+    """
+    Нумерація вихідних подій одного отримувача та кільцевий буфер останніх подій.
+    Сесія переживає обрив з'єднання (до WS_SESSION_TTL), тому клієнт, що повернувся
+    з last_seq, отримує лише пропущене замість повного перезавантаження даних.
+    """
+
+    def __init__(self, size: int = WS_REPLAY_SIZE):
+        self.token = uuid.uuid4().hex[:16]
+        self.seq = 0
+        self.detached_at: Optional[datetime] = None
+        self._buffer: "deque[Tuple[int, Optional[str], str]]" = deque(maxlen=size)
+
+    def append(self, text: str, key: Optional[str] = None) -> str:
+        """Присвоює події наступний номер, зберігає її в буфері та повертає текст з "seq"."""
+        self.seq += 1
+        framed = _with_seq(self.seq, text)
+        self._buffer.append((self.seq, key, framed))
+        return framed
+
+    def since(self, last_seq: int) -> Optional[List[Tuple[Optional[str], str]]]:
+        """
+        Події після last_seq як [(key, text)] або None, якщо частина з них вже
+        витіснена з буфера (або номер невідомий) -- тоді потрібна повна ресинхронізація.
+        З подій з однаковим ключем злиття залишається лише остання.
+        """
+        if last_seq > self.seq:
+            return None
+        if last_seq == self.seq:
+            return []
+        if not self._buffer or self._buffer[0][0] > last_seq + 1:
+            return None
+
+        missed = [(key, text) for seq, key, text in self._buffer if seq > last_seq]
+        last_index = {key: i for i, (key, _) in enumerate(missed) if key is not None}
+        return [(key, text) for i, (key, text) in enumerate(missed) if key is None or last_index[key] == i]
+
+    def stats(self) -> dict:
+        return {
+            "seq": self.seq,
+            "buffered": len(self._buffer),
+            "detached_at": self.detached_at.isoformat() + "Z" if self.detached_at else None,
+        }
+
+
+def _resume_params(websocket: WebSocket) -> Tuple[Optional[str], Optional[int]]:
+    """Параметри відновлення з URL: ?session=<token>&last_seq=<n>."""
+    token = websocket.query_params.get("session")
+    try:
+        last_seq = int(websocket.query_params.get("last_seq"))
+    except (TypeError, ValueError):
+        last_seq = None
+    return token, last_seq
+
+
+# ==============================================================================
+# WEBSOCKET MANAGER
+# ==============================================================================
+
+class ConnectionManager:
+    def __init__(self, broker=None):
+        self.active_couriers: Dict[int, ClientConnection] = {}
+        self.active_partners: Dict[int, ClientConnection] = {}
+        self.broker = broker or create_broker()
+        # Унікальний ID воркера, щоб ігнорувати власні службові повідомлення
+        self.worker_id = uuid.uuid4().hex
+        # Підписники на службові події інших воркерів (presence тощо)
+        self._subscribers: Dict[str, List[BrokerHandler]] = {}
+        # Сесії з нумерацією подій (живуть і після відключення, до WS_SESSION_TTL)
+        self._sessions: Dict[str, Dict[int, ReplaySession]] = {"courier": {}, "partner": {}}
+        self._last_sweep = datetime.utcnow()
+
+    # --- Запуск/Зупинка шини ---
+    async def start(self):
+        await self.broker.start(self._on_broker_message)
+
+    async def stop(self):
+        await self.broker.stop()
+
+    def subscribe(self, op: str, handler: BrokerHandler):
+        """Підписка на подію, опубліковану іншим воркером через publish_event."""
+        self._subscribers.setdefault(op, []).append(handler)
+
+    async def publish_event(self, op: str, payload: dict):
+        """Публікує службову подію всім іншим воркерам."""
+        await self._publish(op, None, None, payload)
+
+    def _registry(self, role: str) -> Dict[int, ClientConnection]:
+        return self.active_couriers if role == "courier" else self.active_partners
+
+    async def _publish(self, op: str, role: str, target_id: Optional[int], message: dict = None):
+        try:
+            await self.broker.publish({
+                "origin": self.worker_id, "op": op, "role": role,
+                "target": target_id, "message": message
+            })
+        except Exception as e:
+            logging.error(f"WS Broker publish error ({role} {target_id}): {e}")
+
+    async def _on_broker_message(self, envelope: dict):
+        op = envelope.get("op")
+        if op in self._subscribers:
+            if envelope.get("origin") != self.worker_id:
+                for handler in self._subscribers[op]:
+                    await handler(envelope.get("message"))
+            return
+
+        role = envelope.get("role")
+        target = envelope.get("target")
+        registry = self._registry(role)
+
+        if op == "kick":
+            # Клієнт перепідключився до іншого воркера -- закриваємо тут старий сокет
+            if envelope.get("origin") == self.worker_id:
+                return
+            # Сесія тепер живе на іншому воркері
+            self._sessions[role].pop(target, None)
+            if target not in registry:
+                return
+            await registry.pop(target).close()
+            logging.info(f"Closed stale WS for {role} {target} (reconnected to another worker)")
+
+        elif op == "send":
+            message = envelope.get("message")
+            sessions = self._sessions[role]
+            if target is None:
+                text, key = _dumps(message), coalesce_key(message)
+                frames = ws_codec.FrameCache()
+                for target_id in set(registry) | set(sessions):
+                    self._deliver(role, target_id, text, key, frames=frames)
+            elif target in registry or target in sessions:
+                # Клієнт тимчасово відключений -- подія лягає в буфер сесії
+                self._send_local(role, target, message)
+
+    def _deliver(self, role: str, target_id: int, text: str, key: Optional[str] = None,
+                 ephemeral: bool = False, frames: Optional[ws_codec.FrameCache] = None) -> str:
+        """
+        Нумерує подію в сесії отримувача (якщо вона є на цьому воркері) і ставить у чергу.
+        frames -- спільний для розсилки кеш бінарних кадрів: msgpack-клієнти не перекодовують текст кожен.
+        """
+        session = None if ephemeral else self._sessions[role].get(target_id)
+        framed = session.append(text, key) if session else text
+        conn = self._registry(role).get(target_id)
+        if conn:
+            frame = None
+            if conn.binary and frames is not None:
+                frame = frames.frame(text, session.seq if session else None)
+            return conn.enqueue(framed, key, frame)
+        return "buffered" if session else "remote"
+
+    def _send_local(self, role: str, target_id: int, message: dict) -> str:
+        return self._deliver(role, target_id, _dumps(message), coalesce_key(message),
+                             message.get("type") in EPHEMERAL_TYPES)
+
+    def _on_connection_broken(self, conn: ClientConnection):
+        self._disconnect(conn.role, conn.target_id, conn.websocket)
+        asyncio.create_task(conn.close())
+
+    async def _connect(self, role: str, websocket: WebSocket, target_id: int) -> ClientConnection:
+        subprotocol = ws_codec.choose_subprotocol(websocket.scope.get("subprotocols"))
+        await websocket.accept(subprotocol=subprotocol)
+        registry = self._registry(role)
+        # ЗАКРИВАЄМО СТАРЕ З'ЄДНАННЯ, ЯКЩО ВОНО ІСНУЄ
+        if target_id in registry:
+            await registry[target_id].close()
+            logging.info(f"Closed previous WS for {role.capitalize()} {target_id}")
+
+        conn = ClientConnection(websocket, role, target_id, self._on_connection_broken, subprotocol=subprotocol)
+        registry[target_id] = conn
+        # Без await між реєстрацією і дошленням, щоб нові події йшли вже після пропущених
+        self._resume(conn, *_resume_params(websocket))
+        # ...і на інших воркерах теж
+        await self._publish("kick", role, target_id)
+        logging.info(f"{role.capitalize()} {target_id} connected to WS")
+        return conn
+
+    def _resume(self, conn: ClientConnection, token: Optional[str], last_seq: Optional[int]):
+        """
+        Першим кадром шле {"type": "session", ...}. Якщо клієнт прийшов з токеном цієї сесії
+        і всі пропущені події ще є в буфері -- дошлює їх, інакше просить resync (повне оновлення).
+        """
+        self._expire_sessions()
+        sessions = self._sessions[conn.role]
+        session = sessions.get(conn.target_id)
+
+        replay = None
+        if session and token == session.token and last_seq is not None:
+            replay = session.since(last_seq)
+            # Не вміщається в чергу з'єднання -- дешевше перезавантажити дані
+            if replay is not None and len(replay) >= conn.max_queue:
+                replay = None
+        if session is None:
+            session = sessions[conn.target_id] = ReplaySession()
+        session.detached_at = None
+
+        conn.enqueue(_dumps({
+            "type": "session", "session": session.token, "seq": session.seq,
+            "resync": replay is None, "replayed": len(replay or []),
+        }))
+        for key, text in replay or []:
+            conn.enqueue(text, key)
+        if replay:
+            logging.info(f"Replayed {len(replay)} missed events to {conn.role.capitalize()} {conn.target_id}")
+
+    def _expire_sessions(self):
+        now = datetime.utcnow()
+        if (now - self._last_sweep).total_seconds() < 30:
+            return
+        self._last_sweep = now
+        for sessions in self._sessions.values():
+            for target_id, session in list(sessions.items()):
+                if session.detached_at and (now - session.detached_at).total_seconds() > WS_SESSION_TTL:
+                    del sessions[target_id]
+
+    def _disconnect(self, role: str, target_id: int, websocket: WebSocket = None) -> bool:
+        registry = self._registry(role)
+        if target_id not in registry:
+            return False
+        conn = registry[target_id]
+        # Не видаляємо нове з'єднання, якщо відключається старий сокет
+        if websocket is not None and conn.websocket is not websocket:
+            return False
+        del registry[target_id]
+        session = self._sessions[role].get(target_id)
+        if session:
+            session.detached_at = datetime.utcnow()
+        if websocket is None:
+            asyncio.create_task(conn.close())
+        else:
+            # Сокет вже закритий клієнтом -- достатньо зупинити писача
+            conn.stop()
+        logging.info(f"{role.capitalize()} {target_id} disconnected from WS")
+        return True
+
+    async def _notify(self, role: str, target_id: int, message: dict):
+        if target_id in self._registry(role) or target_id in self._sessions[role]:
+            self._send_local(role, target_id, message)
+        else:
+            # Сокет може жити в іншому воркері
+            await self._publish("send", role, target_id, message)
+
+    def stats(self) -> dict:
+        """Статистика черг по кожному з'єднанню цього воркера."""
+        return {
+            "worker_id": self.worker_id,
+            "couriers": [c.stats() for c in self.active_couriers.values()],
+            "partners": [p.stats() for p in self.active_partners.values()],
+            "sessions": {
+                role: {target_id: s.stats() for target_id, s in sessions.items()}
+                for role, sessions in self._sessions.items()
+            },
+        }
+
+    # --- Методи для КУР'ЄРІВ ---
+    async def connect_courier(self, websocket: WebSocket, courier_id: int) -> ClientConnection:
+        return await self._connect("courier", websocket, courier_id)
+
+    def disconnect_courier(self, courier_id: int, websocket: WebSocket = None) -> bool:
+        return self._disconnect("courier", courier_id, websocket)
+
+    async def notify_courier(self, courier_id: int, message: dict):
+        await self._notify("courier", courier_id, message)
+
+    async def notify_all_couriers(self, message: dict):
+        """Розсилка всім кур'єрам, підключеним до будь-якого воркера."""
+        await self._publish("send", "courier", None, message)
+
+    async def broadcast_to_couriers(
+        self,
+        courier_ids: List[int],
+        base_payload: dict,
+        per_recipient_patch: Optional[Dict[int, dict]] = None,
+    ) -> Dict[int, str]:
+        """
+        Розсилка одного повідомлення групі кур'єрів.
+        Спільна частина серіалізується один раз, персональні поля (per_recipient_patch)
+        дописуються для кожного кур'єра. Повідомлення лише ставляться в черги з'єднань,
+        тому повільний сокет не затримує інших.
+
+        Повертає {courier_id: "queued" | "coalesced" | "buffered" | "remote"}.
+        """
+        patches = per_recipient_patch or {}
+        patch_keys = set()
+        for patch in patches.values():
+            patch_keys.update(patch.keys())
+        encoder = SharedPayloadEncoder(base_payload, patch_keys)
+        key = coalesce_key(base_payload)
+        frames = ws_codec.FrameCache()
+
+        outcomes: Dict[int, str] = {}
+        sessions = self._sessions["courier"]
+        for courier_id in dict.fromkeys(courier_ids):
+            if courier_id in self.active_couriers or courier_id in sessions:
+                outcomes[courier_id] = self._deliver("courier", courier_id, encoder.encode(patches.get(courier_id)), key, frames=frames)
+            else:
+                # Сокет може жити в іншому воркері
+                await self._publish("send", "courier", courier_id, encoder.to_dict(patches.get(courier_id)))
+                outcomes[courier_id] = "remote"
+        return outcomes
+
+    # --- Методи для ПАРТНЕРІВ (Ресторанів) ---
+    async def connect_partner(self, websocket: WebSocket, partner_id: int) -> ClientConnection:
+        return await self._connect("partner", websocket, partner_id)
+
+    def disconnect_partner(self, partner_id: int, websocket: WebSocket = None) -> bool:
+        return self._disconnect("partner", partner_id, websocket)
+
+    async def notify_partner(self, partner_id: int, message: dict):
+        await self._notify("partner", partner_id, message)
+
+
+manager = ConnectionManager()